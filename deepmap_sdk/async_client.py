@@ -0,0 +1,307 @@
+""" Asyncio client to interact with the APIs. """
+
+import asyncio
+import json
+import time
+import aiohttp
+import jwt
+from deepmap_sdk import auth, users, tiles, maps, streaming
+
+# Maximum number of requests in flight at once, across all coroutines sharing
+# the client.
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+class AsyncDeepmapClient:
+    """ Asyncio Client for the Deepmap API.
+
+    Uses the same url and payload builders as DeepmapClient, over a
+    non-blocking aiohttp transport. Must be logged in before use, either by
+    awaiting login() or by using the client as an async context manager:
+
+        async with AsyncDeepmapClient(api_token) as client:
+            maps_list = await client.list_maps()
+    """
+
+    def __init__(self,
+                 api_token,
+                 server_url='https://api.deepmap.com',
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.api_token = api_token
+        self.server_url = server_url
+        self.max_concurrency = max_concurrency
+        self.expiration = None
+        self.session = None
+
+    async def __aenter__(self):
+        try:
+            await self.login()
+        except BaseException:
+            # __aexit__ isn't called when __aenter__ fails.
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def login(self):
+        """ Creates the HTTP session and an API session token (JWT). """
+        url, payload, headers = auth.create_api_session(
+            self.api_token, self.server_url)
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 headers=headers)
+        async with self.session.post(url, data=json.dumps(payload)) as response:
+            response.raise_for_status()
+            token = (await response.json())['token']
+
+        self.session.headers['Authorization'] = 'Bearer ' + token
+
+        decoded_token = jwt.decode(token, algorithms=["ES256"], verify=False)
+        self.expiration = decoded_token['exp']
+
+    async def close(self):
+        """ Closes the HTTP session and its connections. """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def is_exp(self):
+        """ Returns True if token is expired or not created yet, False
+        otherwise. """
+        return self.expiration is None or time.time() >= self.expiration
+
+    def get_exp(self):
+        """ Returns the Unix time since epoch expiration time, or None before
+        login. """
+        return self.expiration
+
+    async def _get_json(self, url):
+        async with self.session.get(url) as response:
+            return await response.json()
+
+    async def _get_content(self, url):
+        async with self.session.get(url) as response:
+            if response.status == 200:
+                return await response.read()
+            return await response.json()
+
+    async def _post_json(self, url, payload):
+        async with self.session.post(url, data=json.dumps(payload)) as response:
+            return await response.json()
+
+    async def _delete(self, url):
+        async with self.session.delete(url) as response:
+            return response.status == 200
+
+    async def _iter_json(self, url):
+        parser = streaming.JSONArrayParser()
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(
+                    streaming.DEFAULT_CHUNK_SIZE):
+                for item in parser.feed(chunk):
+                    yield item
+        parser.close()
+
+    async def list_maps(self):
+        """ Returns a dictionary of the list of maps. """
+        return await self._get_json(maps.list_maps(self.server_url))
+
+    def iter_maps(self):
+        """ Returns an async iterator over the list of maps. """
+        return self._iter_json(maps.list_maps(self.server_url))
+
+    async def list_feature_tiles(self, map_id):
+        """ Returns a dictionary of feature tiles for map designated by map_id. """
+        return await self._get_json(
+            tiles.list_feature_tiles(map_id, self.server_url))
+
+    def iter_feature_tiles(self, map_id):
+        """ Returns an async iterator over the feature tiles for map
+        designated by map_id. """
+        return self._iter_json(tiles.list_feature_tiles(map_id, self.server_url))
+
+    def iter_tiles_diff(self, map_id, z, map_format, before=None, after=None):
+        """ Returns an async iterator over the tiles updated in the given
+        time range. See tiles.list_tiles_diff for the arguments. """
+        return self._iter_json(
+            tiles.list_tiles_diff(map_id, self.server_url, z, map_format,
+                                  before, after))
+
+    def iter_search_tiles(self,
+                          map_id,
+                          z,
+                          lat1,
+                          lat2,
+                          lng1,
+                          lng2,
+                          map_format,
+                          before=None,
+                          after=None):
+        """ Returns an async iterator over the tiles in a bbox. See
+        tiles.search_tiles for the arguments. """
+        return self._iter_json(
+            tiles.search_tiles(map_id, self.server_url, z, lat1, lat2, lng1,
+                               lng2, map_format, before, after))
+
+    async def list_users(self):
+        """ Returns a dictionary of the list of users. """
+        return await self._get_json(users.list_users(self.server_url))
+
+    def iter_users(self):
+        """ Returns an async iterator over the list of users. """
+        return self._iter_json(users.list_users(self.server_url))
+
+    async def download_feature_tile(self, tile_id):
+        """ Downloads a feature tile designated by tile_id. Returns a binary string. """
+        return await self._get_content(
+            tiles.download_feature_tile(tile_id, self.server_url))
+
+    async def download_tile(self,
+                            map_id,
+                            z,
+                            x,
+                            y,
+                            map_format,
+                            before=None,
+                            after=None):
+        """ Downloads the tile at (z, x, y) of the map designated by map_id.
+        Returns a binary string. """
+        return await self._get_content(
+            tiles.download_tile(map_id, self.server_url, z, x, y, map_format,
+                                before, after))
+
+    async def download_tiles(self,
+                             map_id,
+                             tile_xyzs,
+                             map_format,
+                             before=None,
+                             after=None):
+        """ Downloads many tiles of the map designated by map_id concurrently.
+
+        An async generator of ((z, x, y), result) pairs in completion order,
+        where result is the binary string of the tile, or the exception raised
+        while fetching it. At most max_concurrency requests are in flight.
+
+        Args:
+            tile_xyzs: Iterable of (z, x, y) tuples.
+        """
+
+        async def fetch(xyz):
+            z, x, y = xyz
+            url = tiles.download_tile(map_id, self.server_url, z, x, y,
+                                      map_format, before, after)
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+
+        xyzs = iter(tile_xyzs)
+        pending = {}
+        for xyz in xyzs:
+            pending[asyncio.ensure_future(fetch(xyz))] = xyz
+            if len(pending) >= self.max_concurrency:
+                break
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    xyz = pending.pop(task)
+                    error = task.exception()
+                    yield xyz, (error if error is not None else task.result())
+                    for next_xyz in xyzs:
+                        pending[asyncio.ensure_future(fetch(next_xyz))] = next_xyz
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_user(self, user_id):
+        """ Returns user information for user designated by user_id. """
+        return await self._get_json(users.get_user(user_id, self.server_url))
+
+    async def invite_user(self, email, admin=''):
+        """ Invites new user to join.
+
+        Args:
+            email: email of the new user.
+            admin: String, 'True' if new user is an admin. 'False' or '' otherwise.
+        """
+        url, payload = users.invite_user(email, admin, self.server_url)
+        async with self.session.post(url, data=json.dumps(payload)) as response:
+            if response.status != 200:
+                return {}
+            return await response.json()
+
+    async def edit_user(self, user_id, email='', admin=''):
+        """ Edits an exisiting user's information. Returns True on success.
+        Raises ValueError if neither email nor admin is given.
+
+        Args:
+            email: email of the new user.
+            admin: String, 'True' if user will be admin. 'False' or '' otherwise.
+        """
+        url, payload = users.edit_user(user_id, email, admin, self.server_url)
+        async with self.session.post(url, data=json.dumps(payload)) as response:
+            return response.status == 200
+
+    async def delete_user(self, user_id):
+        """ Deletes user designated by user_id. Returns True on success. """
+        return await self._delete(users.delete_user(user_id, self.server_url))
+
+    async def create_api_token(self, description):
+        """ Creates an API access token with the given description. """
+        url, payload = auth.create_api_token(description, self.server_url)
+        return await self._post_json(url, payload)
+
+    async def create_vehicle_token(self, vehicle_id, description):
+        """ Creates an vehicle access token with the given description and
+            vehicle_id. """
+        url, payload = auth.create_vehicle_token(vehicle_id, description,
+                                                 self.server_url)
+        return await self._post_json(url, payload)
+
+    async def delete_api_token(self, token_id):
+        """ Delete the API token with token_id as its id. Returns True on
+        success. """
+        return await self._delete(
+            auth.delete_api_token(token_id, self.server_url))
+
+    async def delete_vehicle_token(self, token_id):
+        """ Delete the vehicle token with token_id as its id. Returns True on
+        success. """
+        return await self._delete(
+            auth.delete_vehicle_token(token_id, self.server_url))
+
+    async def list_api_tokens(self):
+        """ List all issued API tokens under the user's account. """
+        return await self._get_json(auth.list_api_tokens(self.server_url))
+
+    def iter_api_tokens(self):
+        """ Returns an async iterator over the issued API tokens. """
+        return self._iter_json(auth.list_api_tokens(self.server_url))
+
+    async def list_vehicle_tokens(self):
+        """ List all issued vehicle tokens under the user's account. """
+        return await self._get_json(auth.list_vehicle_tokens(self.server_url))
+
+    def iter_vehicle_tokens(self):
+        """ Returns an async iterator over the issued vehicle tokens. """
+        return self._iter_json(auth.list_vehicle_tokens(self.server_url))
+
+    async def create_api_session(self, api_token):
+        """ Create an API session token (JWT) using a API access token. """
+        url, payload, _ = auth.create_api_session(api_token, self.server_url)
+        return await self._post_json(url, payload)
+
+    async def create_vehicle_session(self, vehicle_token):
+        """ Create a vehicle session token (JWT) using a API access token. """
+        url, payload, _ = auth.create_vehicle_session(vehicle_token,
+                                                      self.server_url)
+        return await self._post_json(url, payload)
+
+    def __str__(self):
+        return "url: {}\nexp: {}\n".format(self.server_url, self.expiration)
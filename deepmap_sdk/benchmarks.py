@@ -0,0 +1,419 @@
+""" Performance benchmarks for the SDK.
+
+Requires pytest-benchmark, installable with 'pip install .[bench]'. Run with
+'pytest deepmap_sdk/benchmarks.py'. Client scenarios run against a local
+mock_server.MockServer, so their results only depend on the SDK and the
+injected latency, bandwidth and errors.
+"""
+
+import hashlib
+import json
+import math
+import subprocess
+import sys
+import tracemalloc
+import numpy as np
+import pytest
+from deepmap_sdk import decoding, planner, pyramid, records, tilemath, tiles
+from deepmap_sdk.endpoints import TileEndpoints
+from deepmap_sdk.deepmap_sdk_example import DeepmapClient
+from deepmap_sdk.mock_server import MockServer
+from deepmap_sdk.sync import DirectoryTileStore
+from deepmap_sdk.transports import HTTP2Transport
+
+# Number of points in the synthetic GPS trace.
+TRACE_POINTS = 100000
+# Level the trace is converted to tiles at.
+TRACE_LEVEL = 16
+# Simulated network round trip of the mock server, in seconds.
+MOCK_LATENCY = 0.005
+# Map and format of the tiles requested from the mock server.
+MAP_ID = 'mock-map'
+MAP_FORMAT = 'mock-format'
+# Number of tiles downloaded by the bulk scenarios.
+BULK_TILES = 256
+# Number of tile urls built by the url builder scenarios.
+URL_TILES = 10000
+# Hash rounds of the CPU bound decode of the pipeline scenario.
+DECODE_ROUNDS = 2000
+# Number of tiles updated between two syncs of the diff sync scenario.
+SYNC_TILES = 128
+# Region and levels of the pyramid scenario.
+PYRAMID_BBOX = (37.70, 37.80, -122.50, -122.40)
+PYRAMID_LEVELS = (12, 16)
+# Tiles listed by the compressed listing scenarios, and bandwidth of the
+# server in bytes per second.
+LISTING_TILES = 20000
+LISTING_BANDWIDTH = 4 * 1024**2
+# Vehicle tokens of the listing memory scenario.
+LISTING_TOKENS = 50000
+# Modules the client imported before they were deferred to the methods using
+# them.
+DEFERRED_MODULES = ('jwt, deepmap_sdk.planner, deepmap_sdk.pipeline, '
+                    'deepmap_sdk.sync, deepmap_sdk.downloads')
+
+
+def _trace():
+    """ Returns the lat and lng arrays of a random walk around San Francisco. """
+    rng = np.random.RandomState(0)
+    lat = 37.77 + np.cumsum(rng.normal(0, 1e-5, TRACE_POINTS))
+    lng = -122.42 + np.cumsum(rng.normal(0, 1e-5, TRACE_POINTS))
+    return lat, lng
+
+
+def _lat_lng_to_tile_loop(lats, lngs, z):
+    """ Per point pure Python equivalent of tilemath.lat_lng_to_tile. """
+    n = 1 << z
+    tiles = []
+    for lat, lng in zip(lats, lngs):
+        lat = min(max(lat, -tilemath.MAX_LATITUDE), tilemath.MAX_LATITUDE)
+        x = int((lng + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) /
+                2.0 * n)
+        tiles.append((min(max(x, 0), n - 1), min(max(y, 0), n - 1)))
+    return tiles
+
+
+def test_lat_lng_to_tile_vectorized(benchmark):
+    """ Converts a GPS trace to tiles with tilemath. """
+    lat, lng = _trace()
+    x, y = benchmark(tilemath.lat_lng_to_tile, lat, lng, TRACE_LEVEL)
+    assert len(x) == len(y) == TRACE_POINTS
+
+
+def test_lat_lng_to_tile_python_loop(benchmark):
+    """ Converts a GPS trace to tiles one point at a time, for comparison. """
+    lat, lng = _trace()
+    lats, lngs = lat.tolist(), lng.tolist()
+    tiles = benchmark(_lat_lng_to_tile_loop, lats, lngs, TRACE_LEVEL)
+    x, y = tilemath.lat_lng_to_tile(lat, lng, TRACE_LEVEL)
+    assert tiles == list(zip(x.tolist(), y.tolist()))
+
+
+def test_tile_to_quadkey_vectorized(benchmark):
+    """ Encodes the tiles of a GPS trace as quadkeys with tilemath. """
+    x, y = tilemath.lat_lng_to_tile(*_trace(), TRACE_LEVEL)
+    quadkeys = benchmark(tilemath.tile_to_quadkey, x, y, TRACE_LEVEL)
+    assert len(quadkeys) == TRACE_POINTS
+
+
+def _url_xyzs():
+    """ Returns an (n, 3) array of the tiles of the GPS trace. """
+    lat, lng = _trace()
+    x, y = tilemath.lat_lng_to_tile(lat[:URL_TILES], lng[:URL_TILES],
+                                    TRACE_LEVEL)
+    return np.stack([np.full_like(x, TRACE_LEVEL), x, y], axis=-1)
+
+
+def test_tile_urls_module_functions(benchmark):
+    """ Builds tile urls with tiles.download_tile, for comparison. """
+    xyzs = _url_xyzs().tolist()
+
+    def build():
+        return [
+            tiles.download_tile(MAP_ID, 'https://api.deepmap.com', z, x, y,
+                                MAP_FORMAT, 1561000000000) for z, x, y in xyzs
+        ]
+
+    assert len(benchmark(build)) == URL_TILES
+
+
+def test_tile_urls_precompiled(benchmark):
+    """ Builds tile urls one at a time with endpoints.TileEndpoints. """
+    xyzs = _url_xyzs().tolist()
+    builder = TileEndpoints('https://api.deepmap.com')
+
+    def build():
+        return [
+            builder.download_tile(MAP_ID, z, x, y, MAP_FORMAT, 1561000000000)
+            for z, x, y in xyzs
+        ]
+
+    assert len(benchmark(build)) == URL_TILES
+
+
+def test_tile_urls_batch(benchmark):
+    """ Builds tile urls from an array with TileEndpoints.download_tiles. """
+    xyzs = _url_xyzs()
+    builder = TileEndpoints('https://api.deepmap.com')
+    urls = benchmark(builder.download_tiles, MAP_ID, xyzs, MAP_FORMAT,
+                     1561000000000)
+    assert len(urls) == URL_TILES
+
+
+@pytest.fixture(scope='module')
+def mock_server():
+    """ A mock DeepMap API with a small simulated latency. """
+    with MockServer(latency=MOCK_LATENCY) as server:
+        yield server
+
+
+@pytest.fixture
+def mock_client(mock_server):
+    """ A client logged in to the mock server. """
+    return DeepmapClient(mock_server.api_token, mock_server.url)
+
+
+def _bulk_xyzs(offset=0):
+    return [(10, offset + i % 16, i // 16) for i in range(BULK_TILES)]
+
+
+def test_single_tile_latency(benchmark, mock_client):
+    """ Downloads one tile at a time. """
+    tile = benchmark(mock_client.download_tile, MAP_ID, 10, 1, 2, MAP_FORMAT)
+    assert len(tile) == 4096
+
+
+@pytest.mark.parametrize('max_workers', [1, 8, 32])
+def test_bulk_tile_throughput(benchmark, mock_client, max_workers):
+    """ Downloads many tiles with download_tiles at several concurrencies. """
+
+    def download():
+        return list(
+            mock_client.download_tiles(MAP_ID, _bulk_xyzs(), MAP_FORMAT,
+                                       max_workers=max_workers))
+
+    results = benchmark.pedantic(download, rounds=3)
+    assert all(isinstance(tile, bytes) for _, tile in results)
+    # Timings aren't collected with --benchmark-disable.
+    if benchmark.stats:
+        benchmark.extra_info['tiles_per_second'] = (BULK_TILES /
+                                                    benchmark.stats['mean'])
+
+
+def test_bulk_tile_throughput_with_errors(benchmark):
+    """ Downloads many tiles while 5% of the requests fail and are retried. """
+    with MockServer(latency=MOCK_LATENCY, error_rate=0.05) as server:
+        client = DeepmapClient(server.api_token, server.url)
+
+        def download():
+            return list(client.download_tiles(MAP_ID, _bulk_xyzs(),
+                                              MAP_FORMAT))
+
+        results = benchmark.pedantic(download, rounds=3)
+    assert all(isinstance(tile, bytes) for _, tile in results)
+
+
+@pytest.mark.parametrize('protocol', ['http1', 'http2'])
+def test_bulk_tile_throughput_by_transport(benchmark, protocol):
+    """ Downloads many tiles over HTTP/1.1 with requests, or over HTTP/2
+    with httpx against the HTTP/2 mock server. """
+    if protocol == 'http2':
+        from deepmap_sdk.mock_server_http2 import HTTP2MockServer
+        server = HTTP2MockServer(latency=MOCK_LATENCY)
+        transport = HTTP2Transport(http1=False)
+    else:
+        server = MockServer(latency=MOCK_LATENCY)
+        transport = None
+    with server:
+        client = DeepmapClient(server.api_token,
+                               server.url,
+                               transport=transport)
+
+        def download():
+            return list(client.download_tiles(MAP_ID, _bulk_xyzs(),
+                                              MAP_FORMAT))
+
+        results = benchmark.pedantic(download, rounds=3)
+    assert all(isinstance(tile, bytes) for _, tile in results)
+    # Timings aren't collected with --benchmark-disable.
+    if benchmark.stats:
+        benchmark.extra_info['tiles_per_second'] = (BULK_TILES /
+                                                    benchmark.stats['mean'])
+
+
+@pytest.mark.parametrize('segments', [1, 4])
+def test_distribution_streaming(benchmark, tmp_path, segments):
+    """ Streams a distribution from a server capping the bandwidth of each
+    connection, in one or several ranged segments. """
+    with MockServer(latency=MOCK_LATENCY,
+                    bandwidth=32 * 1024**2,
+                    distribution_size=16 * 1024**2) as server:
+        client = DeepmapClient(server.api_token, server.url)
+        dest_path = str(tmp_path / 'distribution')
+
+        def download():
+            return client.download_distribution(MAP_ID,
+                                                dest_path,
+                                                segments=segments)
+
+        benchmark.pedantic(download, rounds=3)
+    assert (tmp_path / 'distribution').stat().st_size == 16 * 1024**2
+
+
+def _expensive_decode(tile):
+    """ A CPU bound stand-in for parsing a tile. """
+    digest = tile
+    for _ in range(DECODE_ROUNDS):
+        digest = hashlib.sha256(digest).digest()
+    return digest
+
+
+@pytest.mark.parametrize('processes', [1, 4])
+def test_decode_pipeline(benchmark, mock_client, processes):
+    """ Downloads tiles and decodes them with a CPU bound function in a
+    process pool of one or several processes. """
+
+    def download_and_decode():
+        return list(
+            mock_client.decode_tiles(MAP_ID,
+                                     _bulk_xyzs(),
+                                     MAP_FORMAT,
+                                     decode=_expensive_decode,
+                                     processes=processes))
+
+    results = benchmark.pedantic(download_and_decode, rounds=3)
+    assert all(isinstance(digest, bytes) for _, digest in results)
+
+
+def test_diff_sync(benchmark, mock_server, mock_client, tmp_path):
+    """ Syncs a local mirror after a batch of tiles changed. """
+    store = DirectoryTileStore(str(tmp_path))
+    rounds = iter(range(1, 100))
+
+    def update():
+        offset = next(rounds) * 16
+        mock_server.update_tiles(MAP_ID, MAP_FORMAT,
+                                 _bulk_xyzs(offset)[:SYNC_TILES])
+
+    def sync():
+        return mock_client.sync_map(MAP_ID, 10, MAP_FORMAT, store)
+
+    updated = benchmark.pedantic(sync, setup=update, rounds=3)
+    assert len(updated) >= SYNC_TILES
+
+
+@pytest.mark.parametrize('method', ['pruned', 'per_level'])
+def test_pyramid_update(benchmark, mock_server, mock_client, method):
+    """ Finds the changes of a region at several levels after one tile and
+    its ancestors changed, descending only into changed tiles, or searching
+    every level independently. """
+    min_z, max_z = PYRAMID_LEVELS
+    levels = pyramid.pyramid_tiles(min_z, max_z, *PYRAMID_BBOX)
+    _, x, y = sorted(levels[max_z])[0]
+    rounds = iter(range(1, 100))
+
+    def update():
+        version = mock_server.initial_version + 2 * next(rounds)
+        mock_server.update_tiles(MAP_ID, MAP_FORMAT,
+                                 [(z, x >> (max_z - z), y >> (max_z - z))
+                                  for z in range(min_z, max_z + 1)],
+                                 version=version)
+        return (version, ), {}
+
+    def find_changes(after):
+        if method == 'pruned':
+            return pyramid.changed_tiles(mock_client, MAP_ID, levels,
+                                         MAP_FORMAT, after=after)
+        return {
+            z: planner.search_tiles(mock_client, MAP_ID, tiles, MAP_FORMAT,
+                                    after=after)
+            for z, tiles in levels.items()
+        }
+
+    changed = benchmark.pedantic(find_changes, setup=update, rounds=5)
+    assert all(len(level) == 1 for level in changed.values())
+
+
+@pytest.fixture(scope='module')
+def listing_server():
+    """ A mock server with a large tiles diff, compressing its responses
+    with every supported content coding. """
+    with MockServer(latency=MOCK_LATENCY,
+                    bandwidth=LISTING_BANDWIDTH,
+                    content_encodings=decoding.supported_encodings()) as server:
+        server.update_tiles(MAP_ID, MAP_FORMAT,
+                            [(14, i % 128, i // 128)
+                             for i in range(LISTING_TILES)])
+        yield server
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip', 'br', 'zstd'])
+def test_compressed_listing(benchmark, listing_server, encoding):
+    """ Lists a large tiles diff over a limited bandwidth, uncompressed or
+    compressed with a content coding. Reports the bytes sent per listing. """
+    if encoding not in decoding.supported_encodings() + ['identity']:
+        pytest.skip('{} is not installed'.format(encoding))
+    client = DeepmapClient(listing_server.api_token,
+                           listing_server.url,
+                           accept_encoding=encoding)
+    sent = listing_server.bytes_sent
+    diff = benchmark.pedantic(client.list_tiles_diff,
+                              (MAP_ID, 14, MAP_FORMAT),
+                              rounds=5)
+    benchmark.extra_info['response_bytes'] = (listing_server.bytes_sent -
+                                              sent) // 5
+    assert len(diff) == LISTING_TILES
+
+
+@pytest.mark.parametrize('backend', decoding.JSON_BACKENDS)
+def test_json_backend(benchmark, backend):
+    """ Decodes a large tiles diff with a JSON backend. """
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    loads = decoding.json_loads(backend)
+    document = json.dumps([{
+        'z': 14,
+        'x': i % 128,
+        'y': i // 128,
+        'version': 1560000000000 + i
+    } for i in range(LISTING_TILES)]).encode()
+    assert len(benchmark(loads, document)) == LISTING_TILES
+
+
+@pytest.mark.parametrize('record_format', records.RECORD_FORMATS)
+def test_listing_memory(benchmark, record_format):
+    """ Decodes a large vehicle token listing into decoded JSON, records or
+    a RecordTable. Reports the memory held by the result. """
+    document = json.dumps([{
+        'id': str(100000 + i),
+        'vehicle_id': 'vehicle-{}'.format(i),
+        'description': 'fleet vehicle {}'.format(i),
+    } for i in range(LISTING_TOKENS)]).encode()
+
+    def decode():
+        return records.convert(json.loads(document), records.VehicleToken,
+                               record_format)
+
+    tracemalloc.start()
+    listing = decode()
+    benchmark.extra_info['listing_bytes'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del listing
+    assert len(benchmark.pedantic(decode, rounds=5)) == LISTING_TOKENS
+
+
+@pytest.mark.parametrize('deferred', ['deferred', 'eager'])
+def test_client_import(benchmark, deferred):
+    """ Imports the client in a new interpreter, with the modules used by
+    some methods only deferred as they are, or imported eagerly. """
+    code = 'import deepmap_sdk.deepmap_sdk_example'
+    if deferred == 'eager':
+        code += '; import ' + DEFERRED_MODULES
+
+    def start():
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+    benchmark.pedantic(start, rounds=10)
+
+
+@pytest.mark.parametrize('login', ['eager', 'cached'])
+def test_client_startup(benchmark, mock_server, tmp_path, login):
+    """ Creates a client and lists the maps, logging in first, or reusing a
+    session token cached by an earlier client. """
+    session_cache = str(tmp_path / 'session.json')
+    DeepmapClient(mock_server.api_token,
+                  mock_server.url,
+                  session_cache=session_cache)
+
+    def start():
+        if login == 'eager':
+            client = DeepmapClient(mock_server.api_token, mock_server.url)
+        else:
+            client = DeepmapClient(mock_server.api_token,
+                                   mock_server.url,
+                                   lazy_login=True,
+                                   session_cache=session_cache)
+        return client.list_maps()
+
+    assert benchmark.pedantic(start, rounds=20) == mock_server.maps
@@ -0,0 +1,112 @@
+""" Content encodings and JSON decoders of responses.
+
+Transports decompress response bodies incrementally as they are read, so
+streamed listings and downloads are decoded chunk by chunk. gzip and deflate
+are always supported, brotli and zstd only if the transport can decode them:
+that takes the brotli (or brotlicffi) and zstandard packages, installed with
+'pip install .[compression]', and for requests urllib3 2 for zstd. The
+orjson JSON backend is installed with 'pip install .[orjson]'.
+"""
+
+import json
+import zlib
+
+# Content codings in order of preference.
+_ENCODINGS = ('zstd', 'br', 'gzip', 'deflate')
+JSON_BACKENDS = ('json', 'orjson')
+
+
+def _urllib3_encodings():
+    """ Returns the set of content codings urllib3 decodes. It only decodes
+    brotli if a brotli package imports, and zstd from urllib3 2 if a recent
+    enough zstandard imports. """
+    from urllib3 import response
+    encodings = {'gzip', 'deflate'}
+    if getattr(response, 'brotli', None) is not None:
+        encodings.add('br')
+    if getattr(response, 'HAS_ZSTD', False):
+        encodings.add('zstd')
+    return encodings
+
+
+def transport_encodings(transport=None):
+    """ Returns the set of content codings a transport decodes: those of its
+    content_encodings() method if it has one, such as
+    transports.HTTP2Transport, or else those of urllib3, which decodes the
+    responses of requests.Session. """
+    content_encodings = getattr(transport, 'content_encodings', None)
+    if content_encodings is not None:
+        return set(content_encodings())
+    return _urllib3_encodings()
+
+
+def supported_encodings(transport=None):
+    """ Returns the list of content codings the responses of transport can
+    be decoded from, in order of preference. Defaults to requests. """
+    decodable = transport_encodings(transport)
+    return [encoding for encoding in _ENCODINGS if encoding in decodable]
+
+
+def accept_encoding(encodings=None, transport=None):
+    """ Returns the value of an Accept-Encoding header of the requests of a
+    transport.
+
+    Args:
+        encodings: Content codings to accept, in order of preference, or
+            'identity' for uncompressed bodies only. Defaults to every
+            supported coding.
+        transport: The transport decoding the responses, see
+            supported_encodings.
+
+    Raises:
+        ValueError: If a coding can't be decoded, such as 'br' without the
+            brotli package or 'zstd' with urllib3 1.
+    """
+    if encodings == 'identity':
+        return 'identity'
+    supported = supported_encodings(transport)
+    if encodings is None:
+        encodings = supported
+    elif isinstance(encodings, str):
+        encodings = [encodings]
+    for encoding in encodings:
+        if encoding not in supported:
+            raise ValueError(
+                'Unsupported content encoding {!r}, supported: {}'.format(
+                    encoding, ', '.join(supported)))
+    return ', '.join(encodings)
+
+
+def compress(data, encoding):
+    """ Returns data encoded with a content coding of supported_encodings. """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'deflate':
+        return zlib.compress(data)
+    if encoding == 'br':
+        try:
+            import brotli
+        except ImportError:
+            import brotlicffi as brotli
+        return brotli.compress(data)
+    if encoding == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError('Unsupported content encoding {!r}'.format(encoding))
+
+
+def json_loads(backend='json'):
+    """ Returns a function decoding a JSON document from bytes.
+
+    Args:
+        backend: 'json' for the standard library, or 'orjson', which
+            decodes large listings about twice as fast.
+    """
+    if backend == 'json':
+        return json.loads
+    if backend == 'orjson':
+        import orjson
+        return orjson.loads
+    raise ValueError('Unknown JSON backend {!r}, expected one of: {}'.format(
+        backend, ', '.join(JSON_BACKENDS)))
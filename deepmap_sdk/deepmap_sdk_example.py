@@ -1,74 +1,608 @@
-""" Python class to interact with the APIs. """
+""" Python class to interact with the APIs.
+
+Modules only needed by some methods, such as planner (numpy), pipeline
+(multiprocessing), tile_cache (sqlite3), sync, downloads, user_admin,
+streaming and jwt, are imported by the methods using them, so that importing
+the client and logging in stay fast for short lived processes.
+"""
 
 import sys
 import json
+import logging
+import threading
 import time
-import jwt
-from requests import Session
-from deepmap_sdk import auth, users, tiles, maps
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests import HTTPError
+from deepmap_sdk import (auth, users, tiles, maps, executor, endpoints,
+                         transports, singleflight, decoding, records)
+
+logger = logging.getLogger(__name__)
+
+# Number of connections kept open per host. Sized so that the default number
+# of download workers never has to open throwaway connections.
+DEFAULT_POOL_MAXSIZE = 32
+# Seconds before the session token expires at which it is renewed.
+DEFAULT_REFRESH_MARGIN = 300
+# Milliseconds a before timestamp must be in the past for the tile versions
+# it pins to be final, allowing for clock skew and publishing delays.
+FINAL_VERSION_AGE = 3600 * 1000
 
 
 class DeepmapClient:
     """ Python Client for the Deepmap API. """
 
-    def __init__(self, api_token, server_url='https://api.deepmap.com'):
-        self.session = Session()
-        url, payload, headers = auth.create_api_session(api_token, server_url)
-        self.session.headers.update(headers)
-        response = self.session.post(url, data=json.dumps(payload))
+    def __init__(self,
+                 api_token,
+                 server_url='https://api.deepmap.com',
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 cache=None,
+                 vehicle=False,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 retry_policy=None,
+                 rate_limiter=None,
+                 hooks=(),
+                 transport=None,
+                 coalesce=True,
+                 lazy_login=False,
+                 session_cache=None,
+                 accept_encoding=None,
+                 json_backend='json',
+                 record_format='dict'):
+        """ Logs in with api_token.
+
+        The session token (JWT) is renewed with api_token when it is about to
+        expire, and when the server rejects it, so that a client can be used
+        for longer than the lifetime of one session.
 
-        if response.status_code != 200:
+        Args:
+            pool_maxsize: Number of pooled connections to the server.
+            cache: An optional tile_cache.TileCache that downloaded tiles and
+                feature tiles are served from and stored in.
+            vehicle: True if api_token is a vehicle access token.
+            refresh_margin: Seconds before expiration at which the session
+                token is renewed, at most half the lifetime of the session.
+            retry_policy: The executor.RetryPolicy of failed requests.
+                Defaults to 3 retries with exponential backoff.
+            rate_limiter: An optional executor.TokenBucket limiting the rate
+                of requests, which may be shared with other clients.
+            hooks: Callables called with a metrics.RequestEvent after every
+                request attempt, such as a metrics.Metrics aggregator.
+            transport: The transport requests are sent with, such as a
+                transports.HTTP2Transport. Defaults to a requests.Session
+                with pool_maxsize connections per server.
+            coalesce: Whether concurrent identical requests for tiles,
+                feature tiles, map lists and users share one request and its
+                response body, see singleflight.SingleFlight.
+            lazy_login: Whether to log in on the first request instead of
+                now. A failed login then shows as a 401 response instead of
+                exiting.
+            session_cache: Optional path of a file the session token is
+                saved to, and restored from by later clients with the same
+                api_token and server_url while it is valid for more than
+                refresh_margin, saving the login. See token_cache.
+            accept_encoding: Content codings the server may compress
+                responses with, in order of preference, or 'identity' for
+                none. Defaults to the codings the transport accepts. See
+                decoding.accept_encoding.
+            json_backend: Decoder of JSON responses, 'json' or the faster
+                'orjson'. Streamed listings are always parsed with json.
+            record_format: Format of the maps, feature tiles, users and
+                tokens returned: 'dict' for decoded JSON, 'records' for
+                typed records such as records.Map, or 'table' for listings
+                in a records.RecordTable, which takes the least memory.
+                Iterators yield records in both formats.
+        """
+        self.cache = cache
+        if transport is None:
+            transport = transports.requests_transport(pool_maxsize)
+        self.session = transport
+        if accept_encoding is not None:
+            self.session.headers['Accept-Encoding'] = decoding.accept_encoding(
+                accept_encoding, self.session)
+        self._loads = decoding.json_loads(json_backend)
+        if record_format not in records.RECORD_FORMATS:
+            raise ValueError('Unknown record format {!r}, expected one of: '
+                             '{}'.format(record_format,
+                                         ', '.join(records.RECORD_FORMATS)))
+        self.record_format = record_format
+        self.flights = singleflight.SingleFlight() if coalesce else None
+        self.pool_maxsize = pool_maxsize
+        if retry_policy is None:
+            retry_policy = executor.RetryPolicy()
+        self.executor = executor.RequestExecutor(retry_policy, rate_limiter,
+                                                 hooks)
+        self.server_url = server_url
+        self.endpoints = endpoints.TileEndpoints(server_url)
+        self.refresh_margin = refresh_margin
+        # refresh_margin clamped to the lifetime of the current session.
+        self._margin = refresh_margin
+        if vehicle:
+            self._create_session = auth.create_vehicle_session
+        else:
+            self._create_session = auth.create_api_session
+        self._api_token = api_token
+        self._login_lock = threading.Lock()
+        self.token = None
+        self.expiration = None
+        self.session_cache = session_cache
+
+        if session_cache is not None and self._restore_session():
+            return
+        if not lazy_login and not self._login():
             sys.exit('Failed to login.')
 
-        token = response.json()['token']
-        headers['Authorization'] = 'Bearer ' + token
-
+    def _restore_session(self):
+        """ Uses the session token saved in the session cache if it is still
+        valid. Returns False if there is none. """
+        from deepmap_sdk import token_cache
+        cached = token_cache.load_session(self.session_cache, self.server_url,
+                                          self._api_token,
+                                          self.refresh_margin)
+        if cached is None:
+            return False
+        self.token, self.expiration = cached
+        _, _, headers = self._create_session(self._api_token, self.server_url)
+        self.session.headers.update(headers)
+        self.session.headers['Authorization'] = 'Bearer ' + self.token
+        return True
+
+    def _login(self):
+        """ Creates a new session token. Returns False if the server refused
+        to create one. """
+        url, payload, headers = self._create_session(self._api_token,
+                                                     self.server_url)
         self.session.headers.update(headers)
+        response = self.executor.send(self.session,
+                                      'POST',
+                                      url,
+                                      data=json.dumps(payload))
+
+        if response.status_code != 200:
+            return False
 
+        import jwt
+        token = response.json()['token']
         decoded_token = jwt.decode(token, algorithms=["ES256"], verify=False)
+        self.session.headers['Authorization'] = 'Bearer ' + token
         self.expiration = decoded_token['exp']
-
-        self.server_url = server_url
+        self.token = token
+        # A margin as long as the session would renew it on every request.
+        self._margin = min(self.refresh_margin,
+                           (self.expiration - time.time()) / 2)
+        if self.session_cache is not None:
+            from deepmap_sdk import token_cache
+            token_cache.save_session(self.session_cache, self.server_url,
+                                     self._api_token, token, self.expiration)
+        return True
+
+    def _refresh(self, stale_token):
+        """ Renews the session token if it is still stale_token. Threads that
+        find their token stale at the same time wait for a single renewal. """
+        with self._login_lock:
+            if self.token == stale_token and not self._login():
+                logger.error("Could not renew the session token.")
+
+    def _request(self, method, url, **kwargs):
+        """ Sends a request with a valid session token through the executor
+        and returns the response. The token is renewed ahead of its
+        expiration, and the request is retried once if the server rejects the
+        token anyway. """
+        token = self.token
+        if (self.expiration is None or
+                time.time() >= self.expiration - self._margin):
+            self._refresh(token)
+            token = self.token
+        response = self.executor.send(self.session, method, url, **kwargs)
+        if response.status_code == 401:
+            self._refresh(token)
+            if self.token != token:
+                response.close()
+                response = self.executor.send(self.session, method, url,
+                                              **kwargs)
+        return response
+
+    def _get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def _coalesced(self, url, function, *args):
+        """ Returns function(*args), sharing the call with concurrent
+        callers for the same url if coalescing is enabled. """
+        if self.flights is None:
+            return function(*args)
+        return self.flights.do(url, function, *args)
+
+    def _get_content(self, url):
+        return self._get(url).content
+
+    def _json(self, response):
+        """ Returns the decoded JSON body of a response. """
+        return self._loads(response.content)
+
+    def _get_json(self, url):
+        """ Returns the decoded JSON response of a GET of url. Concurrent
+        callers share the response body but each decode their own copy, which
+        they are free to modify. """
+        return self._loads(self._coalesced(url, self._get_content, url))
+
+    def _iter_json(self, url):
+        """ Returns a generator of the items of the JSON list at url, parsed
+        while the response is streamed. Raises an HTTPError on failure. """
+        from deepmap_sdk import streaming
+        with self._get(url, stream=True) as response:
+            response.raise_for_status()
+            yield from streaming.iter_json_array(
+                response.iter_content(streaming.DEFAULT_CHUNK_SIZE))
+
+    def _records(self, record_type, document):
+        """ Returns a decoded response in the record format of the client. """
+        return records.convert(document, record_type, self.record_format)
+
+    def _iter_records(self, record_type, url):
+        """ Returns a generator of the items of the JSON list at url, as
+        records unless the record format of the client is 'dict'. """
+        items = self._iter_json(url)
+        if self.record_format == 'dict':
+            return items
+        return (record_type.from_dict(item) for item in items)
 
     def is_exp(self):
-        """ Returns True if token is expired, False otherwise. """
-        return time.time() >= self.expiration
+        """ Returns True if token is expired or not created yet, False
+        otherwise. """
+        return self.expiration is None or time.time() >= self.expiration
 
     def get_exp(self):
-        """ Returns the Unix time since epoch expiration time. """
+        """ Returns the Unix time since epoch expiration time, or None before
+        a lazy login. """
         return self.expiration
 
     def list_maps(self):
         """ Returns a dictionary of the list of maps. """
-        url = maps.list_maps(self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        return self._records(records.Map,
+                             self._get_json(maps.list_maps(self.server_url)))
+
+    def iter_maps(self):
+        """ Returns an iterator over the list of maps. """
+        return self._iter_records(records.Map, maps.list_maps(self.server_url))
+
+    def download_distribution(self,
+                              map_id,
+                              dest_path,
+                              map_format=None,
+                              version=None,
+                              segments=1,
+                              checksum=None,
+                              algorithm='sha256'):
+        """ Streams a map distribution to dest_path without buffering it in
+        memory, resuming an interrupted download of the same distribution.
+        Returns dest_path.
+
+        Args:
+            map_id: Id of the map whose distribution is being downloaded.
+            dest_path: Path of the file to write the distribution to.
+            map_format: Format of the map distribution to download.
+            version: Version of the map to download.
+            segments: Number of byte ranges to download in parallel.
+            checksum: Optional hex digest the distribution must match.
+            algorithm: hashlib algorithm of checksum.
+        """
+        url = maps.download_distribution(map_id, self.server_url, map_format,
+                                         version)
+        from deepmap_sdk import downloads
+        return downloads.download_file(self._get,
+                                       url,
+                                       dest_path,
+                                       segments=segments,
+                                       checksum=checksum,
+                                       algorithm=algorithm)
 
     def list_feature_tiles(self, map_id):
         """ Returns a dictionary of feature tiles for map designated by map_id. """
         url = tiles.list_feature_tiles(map_id, self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        response = self._get(url)
+        return self._records(records.FeatureTile, self._json(response))
+
+    def iter_feature_tiles(self, map_id):
+        """ Returns an iterator over the feature tiles for map designated by
+        map_id, yielding the first tiles before the whole list is received. """
+        url = tiles.list_feature_tiles(map_id, self.server_url)
+        return self._iter_records(records.FeatureTile, url)
+
+    def list_tiles_diff(self, map_id, z, map_format, before=None, after=None):
+        """ Returns a list of the tiles at level z updated in the given time
+        range. See tiles.list_tiles_diff for the arguments. """
+        url = self.endpoints.list_tiles_diff(map_id, z, map_format, before,
+                                             after)
+        response = self._get(url)
+        return self._json(response)
+
+    def search_tiles(self,
+                     map_id,
+                     z,
+                     lat1,
+                     lat2,
+                     lng1,
+                     lng2,
+                     map_format,
+                     before=None,
+                     after=None):
+        """ Returns a list of the tiles at level z in a lat/lng bbox. See
+        tiles.search_tiles for the arguments. """
+        url = self.endpoints.search_tiles(map_id, z, lat1, lat2, lng1, lng2,
+                                          map_format, before, after)
+        response = self._get(url)
+        return self._json(response)
+
+    def search_region(self,
+                      map_id,
+                      z,
+                      lat1,
+                      lat2,
+                      lng1,
+                      lng2,
+                      map_format,
+                      before=None,
+                      after=None,
+                      max_tiles=None):
+        """ Returns a list of the tiles at level z in a lat/lng bbox of any
+        size, searched with concurrent queries of at most max_tiles tiles,
+        planner.DEFAULT_MAX_TILES by default. See planner.search_tiles. """
+        from deepmap_sdk import planner
+        if max_tiles is None:
+            max_tiles = planner.DEFAULT_MAX_TILES
+        tile_xyzs = planner.covering_tiles(z, lat1, lat2, lng1, lng2)
+        return planner.search_tiles(self, map_id, tile_xyzs, map_format,
+                                    before, after, max_tiles)
+
+    def fetch_pyramid(self,
+                      map_id,
+                      min_z,
+                      max_z,
+                      lat1,
+                      lat2,
+                      lng1,
+                      lng2,
+                      map_format,
+                      before=None,
+                      after=None,
+                      max_workers=None):
+        """ Downloads the tiles of levels min_z to max_z in a lat/lng bbox
+        changed since after, only looking for changes below the changed tiles
+        of the level above. Returns a dictionary of the changed tiles to their
+        version and a generator of ((z, x, y), result) pairs. See
+        pyramid.fetch_pyramid for the arguments. """
+        from deepmap_sdk import pyramid
+        return pyramid.fetch_pyramid(self, map_id, min_z, max_z, lat1, lat2,
+                                     lng1, lng2, map_format, before, after,
+                                     max_workers)
+
+    def sync_map(self, map_id, z, map_format, local_store, max_workers=None):
+        """ Downloads the tiles at level z changed since the last sync into
+        local_store. Returns the list of updated (z, x, y) tiles. See
+        sync.sync_map for the arguments. """
+        from deepmap_sdk import sync
+        return sync.sync_map(self, map_id, z, map_format, local_store,
+                             max_workers)
+
+    def prefetch_route(self,
+                       map_id,
+                       polyline,
+                       width,
+                       zs,
+                       map_format,
+                       max_workers=None):
+        """ Starts downloading the tiles within width meters of a route into
+        the cache, nearest tiles first. Returns the started
+        prefetch.RoutePrefetcher, whose progress is queryable.
+
+        Args:
+            polyline: Sequence of (lat, lng) points of the route.
+            width: Width of the corridor around the route in meters.
+            zs: Iterable of the levels to prefetch.
+            max_workers: Number of concurrent downloads. Defaults to the size
+                of the connection pool.
+        """
+        from deepmap_sdk import prefetch
+        return prefetch.RoutePrefetcher(self, map_id, polyline, width, zs,
+                                        map_format, max_workers).start()
 
     def list_users(self):
         """ Returns a dictionary of the list of maps. """
-        url = users.list_users(self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        return self._records(records.User,
+                             self._get_json(users.list_users(self.server_url)))
+
+    def _fetch_tile(self, key, url, immutable=False):
+        """ Returns the body of a tile, sharing the fetch with concurrent
+        callers for the same url. See _fetch_tile_once. """
+        return self._coalesced(url, self._fetch_tile_once, key, url, immutable)
+
+    def _fetch_tile_once(self, key, url, immutable=False):
+        """ Returns the body of a tile, going through the cache if any.
+
+        Cached tiles that may have changed are revalidated with a conditional
+        request, so an unchanged tile is not downloaded again. Raises an
+        HTTPError if the tile couldn't be fetched.
+
+        Args:
+            key: Cache key of the tile.
+            immutable: True if the tile at url can never change, in which case
+                a cached tile is returned without contacting the server.
+        """
+        if self.cache is None:
+            response = self._get(url)
+            response.raise_for_status()
+            return response.content
+
+        if immutable:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        response = self._get(url, headers=self.cache.validators(key))
+        if response.status_code == 304:
+            data = self.cache.revalidated(key)
+            if data is not None:
+                return data
+            response = self._get(url)
+        response.raise_for_status()
+        self.cache.put(key, response.content, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+        return response.content
+
+    def _fetch_map_tile(self, map_id, z, x, y, map_format, before, after):
+        url = self.endpoints.download_tile(map_id, z, x, y, map_format, before,
+                                           after)
+        from deepmap_sdk import tile_cache
+        key = tile_cache.tile_key(map_id, map_format, z, x, y, before, after)
+        # Only versions up to before are served, so once nothing can be
+        # published at or before it any more, the tile is final.
+        immutable = (before is not None and
+                     before <= time.time() * 1000 - FINAL_VERSION_AGE)
+        return self._fetch_tile(key, url, immutable=immutable)
+
+    def iter_users(self):
+        """ Returns an iterator over the list of users. """
+        return self._iter_records(records.User,
+                                  users.list_users(self.server_url))
 
     def download_feature_tile(self, tile_id):
         """ Downloads a feature tile designated by tile_id. Returns a binary string. """
+        from deepmap_sdk import tile_cache
         url = tiles.download_feature_tile(tile_id, self.server_url)
-        response = self.session.get(url)
-        if response.status_code == 200:
-            return response.content
-        return response.json()
+        try:
+            return self._fetch_tile(tile_cache.feature_tile_key(tile_id), url)
+        except HTTPError as error:
+            return error.response.json()
+
+    def download_tile(self,
+                      map_id,
+                      z,
+                      x,
+                      y,
+                      map_format,
+                      before=None,
+                      after=None):
+        """ Downloads the tile at (z, x, y) of the map designated by map_id.
+        Returns a binary string. """
+        try:
+            return self._fetch_map_tile(map_id, z, x, y, map_format, before,
+                                        after)
+        except HTTPError as error:
+            return error.response.json()
+
+    def download_tiles(self,
+                       map_id,
+                       tile_xyzs,
+                       map_format,
+                       before=None,
+                       after=None,
+                       max_workers=None):
+        """ Downloads many tiles of the map designated by map_id concurrently.
+
+        Returns a generator of ((z, x, y), result) pairs in completion order,
+        where result is the binary string of the tile, or the exception raised
+        while fetching it. Only a bounded number of requests are in flight at
+        any time, so tile_xyzs may be a lazy iterable of any length.
+
+        Args:
+            tile_xyzs: Iterable of (z, x, y) tuples.
+            max_workers: Number of concurrent requests. Defaults to the size
+                of the connection pool.
+        """
+
+        def fetch(xyz):
+            z, x, y = xyz
+            return self._fetch_map_tile(map_id, z, x, y, map_format, before,
+                                        after)
+
+        return self._fetch_concurrently(fetch, tile_xyzs, max_workers)
+
+    def _fetch_concurrently(self, fetch, keys, max_workers=None):
+        """ Returns a generator of (key, result) pairs in completion order,
+        where result is fetch(key), or the exception it raised. Only a
+        bounded number of calls are in flight at any time. """
+        if max_workers is None:
+            max_workers = self.pool_maxsize
+
+        keys = iter(keys)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for key in keys:
+                pending[executor.submit(fetch, key)] = key
+                if len(pending) >= 2 * max_workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    error = future.exception()
+                    yield key, (error if error is not None else future.result())
+                    for next_key in keys:
+                        pending[executor.submit(fetch, next_key)] = next_key
+                        break
+
+    def download_feature_tiles(self, tile_ids, max_workers=None):
+        """ Downloads many feature tiles concurrently.
+
+        Returns a generator of (tile_id, result) pairs in completion order,
+        where result is the binary string of the feature tile, or the
+        exception raised while fetching it.
+
+        Args:
+            tile_ids: Iterable of feature tile ids.
+            max_workers: Number of concurrent requests. Defaults to the size
+                of the connection pool.
+        """
+
+        from deepmap_sdk import tile_cache
+
+        def fetch(tile_id):
+            url = tiles.download_feature_tile(tile_id, self.server_url)
+            return self._fetch_tile(tile_cache.feature_tile_key(tile_id), url)
+
+        return self._fetch_concurrently(fetch, tile_ids, max_workers)
+
+    def decode_tiles(self,
+                     map_id,
+                     tile_xyzs,
+                     map_format,
+                     decode=None,
+                     before=None,
+                     after=None,
+                     max_workers=None,
+                     processes=None):
+        """ Downloads many tiles concurrently and decodes them in a process
+        pool. Returns a generator of ((z, x, y), result) pairs, where result
+        is the decoded tile or the exception raised while fetching or
+        decoding it. See pipeline.decode_pipeline.
+
+        Args:
+            decode: A picklable function of the binary string of a tile.
+                Defaults to decompressing gzip and zlib encoded tiles.
+            max_workers: Number of concurrent downloads.
+            processes: Number of decoding processes, by default the number
+                of CPUs.
+        """
+        from deepmap_sdk import pipeline
+        tile_results = self.download_tiles(map_id, tile_xyzs, map_format,
+                                           before, after, max_workers)
+        return pipeline.decode_pipeline(tile_results, decode or
+                                        pipeline.decompress, processes)
+
+    def decode_feature_tiles(self,
+                             tile_ids,
+                             decode=None,
+                             max_workers=None,
+                             processes=None):
+        """ Downloads many feature tiles concurrently and decodes them in a
+        process pool, see decode_tiles. """
+        from deepmap_sdk import pipeline
+        tile_results = self.download_feature_tiles(tile_ids, max_workers)
+        return pipeline.decode_pipeline(tile_results, decode or
+                                        pipeline.decompress, processes)
 
     def get_user(self, user_id):
         """ Returns user information for user designated by user_id. """
         url = users.get_user(user_id, self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        return self._records(records.User, self._get_json(url))
 
     def invite_user(self, email, admin=''):
         """ Invites new user to join.
@@ -78,42 +612,84 @@ class DeepmapClient:
             admin: String, 'True' if new user is an admin. 'False' or '' otherwise.
         """
         url, payload = users.invite_user(email, admin, self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
 
         if response.status_code != 200:
-            print("Error. Could not invite user.")
+            logger.error("Could not invite user.")
             return {}
         return response.json()
 
     def edit_user(self, user_id, email='', admin=''):
-        """ Edits an exisiting user's information.
+        """ Edits an exisiting user's information. Raises
+        ValueError if neither email nor admin is given.
 
         Args:
             email: email of the new user.
             admin: String, 'True' if user will be admin. 'False' or '' otherwise.
         """
         url, payload = users.edit_user(user_id, email, admin, self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
 
         if response.status_code != 200:
-            print("Error. Could not edit user.")
+            logger.error("Could not edit user.")
         else:
-            print("User edited.")
+            logger.info("User edited.")
 
     def delete_user(self, user_id):
         """ Deletes user designated by user_id. """
         url = users.delete_user(user_id, self.server_url)
-        response = self.session.delete(url)
+        response = self._request('DELETE', url)
 
         if response.status_code != 200:
-            print("Error. Could not invite user.")
+            logger.error("Could not delete user.")
         else:
-            print("User deleted.")
+            logger.info("User deleted.")
+
+    def invite_users(self, invites, max_workers=None):
+        """ Invites users concurrently. Returns a user_admin.BulkReport with
+        the result of every invite. See user_admin.invite_users.
+
+        Args:
+            invites: Iterable of emails, or of (email, admin) pairs.
+            max_workers: Number of concurrent requests. Defaults to the size
+                of the connection pool.
+        """
+        from deepmap_sdk import user_admin
+        return user_admin.invite_users(self._request, self.server_url,
+                                       invites, max_workers or
+                                       self.pool_maxsize)
+
+    def edit_users(self, edits, max_workers=None):
+        """ Edits users concurrently. Returns a user_admin.BulkReport with
+        the result of every edit. See user_admin.edit_users.
+
+        Args:
+            edits: Iterable of (user_id, email, admin) tuples.
+            max_workers: Number of concurrent requests. Defaults to the size
+                of the connection pool.
+        """
+        from deepmap_sdk import user_admin
+        return user_admin.edit_users(self._request, self.server_url, edits,
+                                     max_workers or self.pool_maxsize)
+
+    def delete_users(self, user_ids, max_workers=None):
+        """ Deletes users concurrently. Returns a user_admin.BulkReport with
+        the result of every deletion.
+
+        Args:
+            user_ids: Iterable of user ids.
+            max_workers: Number of concurrent requests. Defaults to the size
+                of the connection pool.
+        """
+        from deepmap_sdk import user_admin
+        return user_admin.delete_users(self._request, self.server_url,
+                                       user_ids, max_workers or
+                                       self.pool_maxsize)
 
     def create_api_token(self, description):
         """ Creates an API access token with the given description. """
         url, payload = auth.create_api_token(description, self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
         return response.json()
 
     def create_vehicle_token(self, vehicle_id, description):
@@ -121,52 +697,62 @@ class DeepmapClient:
             vehicle_id. """
         url, payload = auth.create_vehicle_token(vehicle_id, description,
                                                  self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
         return response.json()
 
     def delete_api_token(self, token_id):
         """ Delete the API token with token_id as its id. """
         url = auth.delete_api_token(token_id, self.server_url)
-        response = self.session.delete(url)
+        response = self._request('DELETE', url)
 
         if response.status_code != 200:
-            print("Error. Could not delete API token.")
+            logger.error("Could not delete API token.")
         else:
-            print("API token deleted.")
+            logger.info("API token deleted.")
 
     def delete_vehicle_token(self, token_id):
         """ Delete the vehicle token with token_id as its id. """
         url = auth.delete_vehicle_token(token_id, self.server_url)
-        response = self.session.delete(url)
+        response = self._request('DELETE', url)
 
         if response.status_code != 200:
-            print("Error. Could not delete vehicle token.")
+            logger.error("Could not delete vehicle token.")
         else:
-            print("Vehicle token deleted.")
+            logger.info("Vehicle token deleted.")
 
     def list_api_tokens(self):
         """ List all issued API tokens under the user's account. """
         url = auth.list_api_tokens(self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        response = self._get(url)
+        return self._records(records.ApiToken, self._json(response))
+
+    def iter_api_tokens(self):
+        """ Returns an iterator over the issued API tokens. """
+        return self._iter_records(records.ApiToken,
+                                  auth.list_api_tokens(self.server_url))
 
     def list_vehicle_tokens(self):
         """ List all issued vehicle tokens under the user's account. """
         url = auth.list_vehicle_tokens(self.server_url)
-        response = self.session.get(url)
-        return response.json()
+        response = self._get(url)
+        return self._records(records.VehicleToken, self._json(response))
+
+    def iter_vehicle_tokens(self):
+        """ Returns an iterator over the issued vehicle tokens. """
+        return self._iter_records(records.VehicleToken,
+                                  auth.list_vehicle_tokens(self.server_url))
 
     def create_api_session(self, api_token):
         """ Create an API session token (JWT) using a API access token. """
         url, payload, _ = auth.create_api_session(api_token, self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
         return response.json()
 
     def create_vehicle_session(self, vehicle_token):
         """ Create a vehicle session token (JWT) using a API access token. """
         url, payload, _ = auth.create_vehicle_session(vehicle_token,
                                                       self.server_url)
-        response = self.session.post(url, data=json.dumps(payload))
+        response = self._request('POST', url, data=json.dumps(payload))
         return response.json()
 
     def __str__(self):
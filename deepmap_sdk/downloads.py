@@ -0,0 +1,238 @@
+""" Streaming, resumable downloads of large files such as map distributions. """
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes read from the network and written to disk at a time.
+DEFAULT_CHUNK_SIZE = 1024**2
+# Bytes written by a segment between two saves of the resume state.
+CHECKPOINT_BYTES = 16 * 1024**2
+
+
+class DownloadError(Exception):
+    """ Raised when a downloaded file fails verification or the server
+    doesn't honor a range request needed to resume it. """
+
+
+class _FileChanged(DownloadError):
+    """ Raised when the file changed on the server during a download. """
+
+
+def _headers(headers):
+    """ Returns the headers of a request for part of a file. Byte ranges
+    apply to the encoded body, so the file is requested uncompressed. """
+    return dict(headers, **{'Accept-Encoding': 'identity'})
+
+
+def _validator(headers):
+    """ Returns the strong ETag, or else the Last-Modified date, identifying
+    the content of a file, or None if the response has neither. """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def _probe(get, url):
+    """ Returns the size of the file at url, or None if unknown, whether
+    the server accepts range requests for it, and its validator. """
+    response = get(url, headers=_headers({'Range': 'bytes=0-0'}), stream=True)
+    with response:
+        validator = _validator(response.headers)
+        if response.status_code == 416:
+            # No byte range exists in an empty file.
+            return 0, False, validator
+        response.raise_for_status()
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if total.isdigit():
+                return int(total), True, validator
+            return None, False, validator
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), False, validator
+
+
+def _split(size, segments):
+    """ Returns a list of [start, end, done] byte ranges covering size. """
+    if size is None:
+        return [[0, None, 0]]
+    step = -(-size // max(segments, 1)) or 1
+    return [[start, min(start + step, size), 0]
+            for start in range(0, size, step)] or [[0, 0, 0]]
+
+
+class _Download:
+    """ The state of a download to a partial file, saved next to it so that
+    an interrupted download resumes where it stopped. """
+
+    def __init__(self, get, url, dest_path, chunk_size):
+        self.get = get
+        self.url = url
+        self.part_path = dest_path + '.part'
+        self.state_path = self.part_path + '.json'
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.size = None
+        self.ranges = False
+        self.validator = None
+        self.segments = []
+
+    def load(self, size, ranges, validator, segments):
+        """ Restores the saved progress of the same file if the server
+        supports range requests and the file didn't change since, or starts
+        over. """
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            state = None
+        self.size = size
+        self.ranges = ranges
+        self.validator = validator
+        if (ranges and state and state['url'] == self.url and
+                state['size'] == size and
+                state.get('validator') == validator and
+                os.path.exists(self.part_path)):
+            self.segments = state['segments']
+            return
+        self.segments = _split(size, segments if ranges else 1)
+        with open(self.part_path, 'wb') as part:
+            if size is not None:
+                part.truncate(size)
+        self.save()
+
+    def save(self):
+        """ Atomically saves the progress of every segment. """
+        with self.lock:
+            state = {'url': self.url, 'size': self.size,
+                     'validator': self.validator, 'segments': self.segments}
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(temp_path, self.state_path)
+
+    def discard(self):
+        """ Removes the partial file and its state. """
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        """ Fetches every segment, in parallel if there are several. """
+        if len(self.segments) == 1:
+            self.fetch(self.segments[0])
+            return
+        with ThreadPoolExecutor(max_workers=len(self.segments)) as pool:
+            for future in [pool.submit(self.fetch, segment)
+                           for segment in self.segments]:
+                future.result()
+
+    def fetch(self, segment):
+        """ Streams the rest of a segment into its place in the partial file. """
+        start, end, done = segment
+        if end is not None and start + done >= end:
+            return
+        headers = {}
+        if self.ranges:
+            headers['Range'] = 'bytes={}-{}'.format(start + done, end - 1)
+            if self.validator is not None:
+                # The server sends the whole file instead if it changed.
+                headers['If-Range'] = self.validator
+        response = self.get(self.url, headers=_headers(headers), stream=True)
+        with response, open(self.part_path, 'r+b') as part:
+            response.raise_for_status()
+            if headers and response.status_code != 206:
+                if 'If-Range' in headers and response.status_code == 200:
+                    raise _FileChanged('{} changed during the download'.format(
+                        self.url))
+                raise DownloadError(
+                    'Server ignored range request for {}'.format(self.url))
+            part.seek(start + done)
+            unsaved = 0
+            try:
+                for chunk in response.iter_content(self.chunk_size):
+                    part.write(chunk)
+                    segment[2] += len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= CHECKPOINT_BYTES:
+                        part.flush()
+                        self.save()
+                        unsaved = 0
+            finally:
+                part.flush()
+                self.save()
+
+
+def _file_digest(path, algorithm, chunk_size):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_file(get,
+                  url,
+                  dest_path,
+                  segments=1,
+                  checksum=None,
+                  algorithm='sha256',
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Streams the file at url to dest_path with constant memory use.
+
+    The file is written to dest_path + '.part' and only moved to dest_path
+    once complete and verified. If a previous call for the same url was
+    interrupted, the download resumes with HTTP range requests from where it
+    stopped, unless the ETag or Last-Modified date of the file changed since.
+    Range requests are conditional on them, and a download restarts once if
+    the file changes while it runs. Without either, a file changed at the same
+    size is only detected by checksum.
+
+    Args:
+        get: The function sending GET requests, such as requests.get or
+            the get method of a requests.Session.
+        segments: Number of byte ranges downloaded in parallel. Ignored if the
+            server doesn't support range requests.
+        checksum: Optional hex digest the file must match.
+        algorithm: hashlib algorithm of checksum.
+        chunk_size: Bytes read from the network at a time.
+
+    Returns:
+        dest_path.
+
+    Raises:
+        DownloadError: The file doesn't have the expected size or checksum.
+        requests.HTTPError: The server responded with an error.
+    """
+    for attempt in range(2):
+        size, ranges, validator = _probe(get, url)
+        download = _Download(get, url, dest_path, chunk_size)
+        download.load(size, ranges, validator, segments)
+        try:
+            download.run()
+            break
+        except _FileChanged:
+            download.discard()
+            if attempt:
+                raise
+
+    actual_size = sum(done for _, _, done in download.segments)
+    if size is not None and actual_size != size:
+        raise DownloadError('Expected {} bytes, downloaded {}'.format(
+            size, actual_size))
+    if checksum is not None:
+        actual = _file_digest(download.part_path, algorithm, chunk_size)
+        if actual != checksum.lower():
+            download.discard()
+            raise DownloadError('Expected {} {}, downloaded {}'.format(
+                algorithm, checksum, actual))
+
+    os.replace(download.part_path, dest_path)
+    os.remove(download.state_path)
+    return dest_path
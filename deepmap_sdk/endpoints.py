@@ -0,0 +1,91 @@
+""" Precompiled URL builders for the hot tiles API endpoints.
+
+Build the same URLs as the functions of tiles.py, but parse the server url
+once and reuse the constant part of each URL, so generating URLs for millions
+of tiles costs one string concatenation per tile.
+"""
+
+import urllib.parse
+
+
+def _time_range(before, after):
+    """ Returns the query string suffix of the optional time range. """
+    suffix = ''
+    if before is not None:
+        suffix += '&before=' + urllib.parse.quote_plus(str(before))
+    if after is not None:
+        suffix += '&after=' + urllib.parse.quote_plus(str(after))
+    return suffix
+
+
+class TileEndpoints:
+    """ URL builders of the tiles v2 API of one server.
+
+    Args:
+        server_url: String of base URL of the API.
+    """
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self._base = urllib.parse.urljoin(server_url, '/api/tiles/v2/')
+        self._prefixes = {}
+
+    def _prefix(self, map_id, endpoint, map_format):
+        """ Returns the URL of endpoint up to the value of the z parameter. """
+        key = (map_id, endpoint, map_format)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = '{}{}/{}?format={}&z='.format(
+                self._base, map_id, endpoint,
+                urllib.parse.quote_plus(str(map_format)))
+            self._prefixes[key] = prefix
+        return prefix
+
+    def download_tile(self, map_id, z, x, y, map_format, before=None,
+                      after=None):
+        """ Returns a url for downloading a tile, see tiles.download_tile. """
+        return (self._prefix(map_id, 'tile', map_format) + str(z) + '&x=' +
+                str(x) + '&y=' + str(y) + _time_range(before, after))
+
+    def download_tiles(self,
+                       map_id,
+                       tile_xyzs,
+                       map_format,
+                       before=None,
+                       after=None):
+        """ Returns the list of urls for downloading many tiles.
+
+        Args:
+            tile_xyzs: Iterable of (z, x, y) tuples, or an integer array of
+                shape (n, 3).
+        """
+        if hasattr(tile_xyzs, 'tolist'):
+            tile_xyzs = tile_xyzs.tolist()
+        prefix = self._prefix(map_id, 'tile', map_format)
+        suffix = _time_range(before, after)
+        return [
+            '%s%d&x=%d&y=%d%s' % (prefix, z, x, y, suffix)
+            for z, x, y in tile_xyzs
+        ]
+
+    def list_tiles_diff(self, map_id, z, map_format, before=None, after=None):
+        """ Returns a url for fetching updated tiles, see
+        tiles.list_tiles_diff. """
+        return (self._prefix(map_id, 'diff', map_format) + str(z) +
+                _time_range(before, after))
+
+    def search_tiles(self,
+                     map_id,
+                     z,
+                     lat1,
+                     lat2,
+                     lng1,
+                     lng2,
+                     map_format,
+                     before=None,
+                     after=None):
+        """ Returns a url for fetching tiles in bbox, see tiles.search_tiles. """
+        return (self._prefix(map_id, 'tiles/search/bbox', map_format) +
+                str(z) + '&' + urllib.parse.urlencode(
+                    (('lat1', lat1), ('lat2', lat2), ('lng1', lng1),
+                     ('lng2', lng2))) + _time_range(before, after))
@@ -0,0 +1,201 @@
+""" Sends requests with retries, backoff and client-side rate limiting. """
+
+import email.utils
+import random
+import threading
+import time
+from requests import ConnectionError as RequestsConnectionError, Timeout
+from deepmap_sdk import metrics
+
+# Methods that can be retried after the server may have processed them.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class TokenBucket:
+    """ A thread-safe token bucket limiting the rate of requests.
+
+    Share one bucket between clients or threads to cap their combined rate.
+
+    Args:
+        rate: Requests per second allowed on average.
+        capacity: Requests allowed in a burst. Defaults to rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a request may be sent. """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve a token, possibly ahead of time, so waiting threads are
+            # served in order.
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Holds back every request for seconds, such as when the server
+        asks to retry later. """
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+
+
+def _retry_after(response):
+    """ Returns the seconds to wait from a Retry-After header, or None. """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """ When and how long to wait before retrying a failed request.
+
+    Requests are retried on connection errors and on the retryable statuses,
+    waiting for exponential backoff with full jitter, or for as long as the
+    server asks with Retry-After. Non-idempotent requests are only retried on
+    429 Too Many Requests, as the server didn't process them.
+
+    Args:
+        retries: Maximum number of retries of a request.
+        backoff: Base delay in seconds, doubled at every retry.
+        max_backoff: Maximum delay in seconds, unless set by Retry-After.
+        statuses: HTTP statuses to retry.
+    """
+
+    def __init__(self,
+                 retries=3,
+                 backoff=0.5,
+                 max_backoff=30.0,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    def should_retry(self, method, attempt, response=None):
+        """ Returns True if attempt, counted from 0, may be followed by a
+        retry after it failed with response, or with a connection error if
+        response is None. """
+        if attempt >= self.retries:
+            return False
+        if response is not None and response.status_code == 429:
+            return True
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        return response is None or response.status_code in self.statuses
+
+    def delay(self, attempt, response=None):
+        """ Returns the seconds to wait before retrying attempt. """
+        if response is not None:
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2**attempt))
+
+
+def _body_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode())
+    return len(data)
+
+
+def _response_size(response, stream):
+    if not stream:
+        return len(response.content)
+    length = response.headers.get('Content-Length')
+    return int(length) if length else None
+
+
+class RequestExecutor:
+    """ Sends the requests of a client through a retry policy and an optional
+    rate limiter, reporting every attempt to hooks.
+
+    Args:
+        retry_policy: A RetryPolicy, or None to never retry.
+        rate_limiter: An optional TokenBucket acquired before every attempt.
+        hooks: Callables called with a metrics.RequestEvent after every
+            attempt, such as a metrics.Metrics.
+    """
+
+    def __init__(self, retry_policy=None, rate_limiter=None, hooks=()):
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.hooks = list(hooks)
+
+    def _emit(self, method, url, attempt, started, kwargs, response=None,
+              error=None):
+        latency = time.perf_counter() - started
+        if response is not None:
+            ttfb = response.elapsed.total_seconds()
+            response_bytes = _response_size(response, kwargs.get('stream'))
+        else:
+            ttfb = None
+            response_bytes = None
+        event = metrics.RequestEvent(
+            method=method,
+            url=url,
+            endpoint=metrics.endpoint_name(url),
+            status=response.status_code if response is not None else None,
+            error=type(error).__name__ if error is not None else None,
+            attempt=attempt,
+            latency=latency,
+            ttfb=ttfb,
+            request_bytes=_body_size(kwargs.get('data')),
+            response_bytes=response_bytes)
+        for hook in self.hooks:
+            hook(event)
+
+    def send(self, session, method, url, **kwargs):
+        """ Sends a request with session and returns the final response.
+        Raises the connection error of the last attempt if none succeeded. """
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (RequestsConnectionError, Timeout) as error:
+                if self.hooks:
+                    self._emit(method, url, attempt, started, kwargs,
+                               error=error)
+                if policy is None or not policy.should_retry(method, attempt):
+                    raise
+                time.sleep(policy.delay(attempt))
+            else:
+                if self.hooks:
+                    self._emit(method, url, attempt, started, kwargs,
+                               response=response)
+                if policy is None or not policy.should_retry(
+                        method, attempt, response):
+                    return response
+                delay = policy.delay(attempt, response)
+                if (response.status_code == 429 and
+                        self.rate_limiter is not None):
+                    self.rate_limiter.pause(delay)
+                response.close()
+                time.sleep(delay)
+            attempt += 1
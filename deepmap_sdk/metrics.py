@@ -0,0 +1,169 @@
+""" Request instrumentation hooks and an in-memory metrics aggregator. """
+
+import bisect
+import collections
+import json
+import threading
+import urllib.parse
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+# Path segments of the API endpoints. Any other segment is an id.
+_STATIC_SEGMENTS = frozenset([
+    'api', 'auth', 'bbox', 'diff', 'distribution', 'feature_tiles', 'invite',
+    'maps', 'reset_password', 'search', 'session', 'tile', 'tiles', 'token',
+    'users', 'v1', 'v2', 'vehicle'
+])
+
+RequestEvent = collections.namedtuple('RequestEvent', [
+    'method', 'url', 'endpoint', 'status', 'error', 'attempt', 'latency',
+    'ttfb', 'request_bytes', 'response_bytes'
+])
+RequestEvent.__doc__ = """ One attempt of a request, passed to client hooks.
+
+    method: HTTP method.
+    url: Full url requested.
+    endpoint: url path with ids replaced by '{id}', see endpoint_name.
+    status: HTTP status, or None if the attempt raised error.
+    error: Name of the exception raised by the attempt, or None.
+    attempt: 0 for the first attempt, n for the nth retry.
+    latency: Seconds from sending the request to receiving the body, or to
+        receiving the headers of a streamed response.
+    ttfb: Seconds from sending the request to receiving the headers,
+        including connection setup.
+    request_bytes: Size of the request body.
+    response_bytes: Size of the response body, or its Content-Length for a
+        streamed response. None if unknown.
+"""
+
+
+def endpoint_name(url):
+    """ Returns the path of url with its variable segments, such as map,
+    user and token ids, replaced by '{id}', to group requests by endpoint. """
+    path = urllib.parse.urlsplit(url).path
+    return '/'.join(segment if not segment or segment in _STATIC_SEGMENTS
+                    else '{id}' for segment in path.split('/'))
+
+
+class _EndpointStats:
+    """ Aggregated attempts of one method and endpoint. """
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.ttfb_sum = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.statuses = collections.Counter()
+
+
+class Metrics:
+    """ Aggregates request events per endpoint: latency histograms, time to
+    first byte, payload sizes, status codes, retries and errors.
+
+    A Metrics instance is a hook, to be passed to a client:
+
+        metrics = Metrics()
+        client = DeepmapClient(api_token, hooks=[metrics])
+        ...
+        print(metrics.to_prometheus())
+
+    Attempts that raised a connection error, or got a 5xx response, count as
+    errors. Safe to share between threads and clients.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            key = (event.method, event.endpoint)
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = _EndpointStats(self.buckets)
+            stats.count += 1
+            stats.bucket_counts[bisect.bisect_left(self.buckets,
+                                                   event.latency)] += 1
+            stats.latency_sum += event.latency
+            stats.ttfb_sum += event.ttfb or 0.0
+            stats.request_bytes += event.request_bytes or 0
+            stats.response_bytes += event.response_bytes or 0
+            if event.attempt:
+                stats.retries += 1
+            if event.error is not None or event.status >= 500:
+                stats.errors += 1
+            stats.statuses[event.status or event.error] += 1
+
+    def reset(self):
+        """ Forgets every recorded event. """
+        with self._lock:
+            self._endpoints = {}
+
+    def snapshot(self):
+        """ Returns a dictionary of the metrics of every endpoint, keyed by
+        'METHOD /path'. """
+        with self._lock:
+            result = {}
+            for (method, endpoint), stats in sorted(self._endpoints.items()):
+                cumulative = 0
+                histogram = []
+                for bound, count in zip(self.buckets + ('+Inf',),
+                                        stats.bucket_counts):
+                    cumulative += count
+                    histogram.append([bound, cumulative])
+                result['{} {}'.format(method, endpoint)] = {
+                    'count': stats.count,
+                    'latency_sum': stats.latency_sum,
+                    'latency_mean': stats.latency_sum / stats.count,
+                    'ttfb_mean': stats.ttfb_sum / stats.count,
+                    'latency_histogram': histogram,
+                    'request_bytes': stats.request_bytes,
+                    'response_bytes': stats.response_bytes,
+                    'retries': stats.retries,
+                    'errors': stats.errors,
+                    'error_rate': stats.errors / stats.count,
+                    'statuses': {str(status): count
+                                 for status, count in stats.statuses.items()},
+                }
+            return result
+
+    def to_json(self):
+        """ Returns the snapshot as a JSON string. """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='deepmap_sdk'):
+        """ Returns the metrics in the Prometheus text exposition format. """
+        lines = [
+            '# TYPE {}_request_duration_seconds histogram'.format(prefix),
+        ]
+        counters = collections.defaultdict(list)
+        for name, stats in self.snapshot().items():
+            method, endpoint = name.split(' ', 1)
+            labels = 'method="{}",endpoint="{}"'.format(method, endpoint)
+            for bound, count in stats['latency_histogram']:
+                lines.append(
+                    '{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        prefix, labels, bound, count))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(
+                prefix, labels, stats['latency_sum']))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(
+                prefix, labels, stats['count']))
+            for counter in ('request_bytes', 'response_bytes', 'retries',
+                            'errors'):
+                counters[counter].append('{}_{}_total{{{}}} {}'.format(
+                    prefix, counter, labels, stats[counter]))
+            for status, count in sorted(stats['statuses'].items()):
+                counters['responses'].append(
+                    '{}_responses_total{{{},status="{}"}} {}'.format(
+                        prefix, labels, status, count))
+        for counter, counter_lines in counters.items():
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, counter))
+            lines.extend(counter_lines)
+        return '\n'.join(lines) + '\n'
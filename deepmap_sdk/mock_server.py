@@ -0,0 +1,516 @@
+""" A local stand-in for the DeepMap API, for tests and benchmarks.
+
+Implements the auth, maps, tiles v2 and users endpoints used by the SDK over
+a threaded HTTP/1.1 server, with configurable latency, bandwidth and error
+injection:
+
+    with MockServer(latency=0.02) as server:
+        client = DeepmapClient(server.api_token, server.url)
+"""
+
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+from deepmap_sdk import decoding, tilemath
+
+# Bytes written at a time when the bandwidth is limited.
+_WRITE_CHUNK = 16 * 1024
+
+
+def _tile_bytes(map_id, map_format, z, x, y, version, size):
+    """ Returns deterministic content for a version of a tile. """
+    seed = '{}/{}/{}/{}/{}/{}'.format(map_id, map_format, z, x, y, version)
+    block = hashlib.sha256(seed.encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class MockServer:
+    """ A DeepMap API stand-in holding maps, tiles, users and tokens in
+    memory.
+
+    Every tile of every map exists at initial_version unless updated with
+    update_tiles, and only updated tiles are listed by the diff endpoint.
+    Responses carry an ETag, and conditional requests for unchanged tiles get
+    304 Not Modified.
+
+    Args:
+        latency: Seconds added before every response.
+        bandwidth: Maximum bytes per second of each response body, or None.
+        error_rate: Fraction of requests answered 503 with Retry-After: 0.
+            Session creation requests never fail.
+        tile_size: Bytes of each tile.
+        distribution_size: Bytes of each map distribution.
+        session_lifetime: Seconds before session tokens expire.
+        seed: Seed of the error injection.
+        content_encodings: Content codings JSON and tile bodies are
+            compressed with when the request accepts them, such as
+            ('gzip', ). See decoding.supported_encodings.
+
+    Attributes:
+        requests: Number of requests received.
+        bytes_sent: Number of response body bytes sent.
+    """
+
+    def __init__(self,
+                 latency=0.0,
+                 bandwidth=None,
+                 error_rate=0.0,
+                 tile_size=4096,
+                 distribution_size=8 * 1024**2,
+                 session_lifetime=3600,
+                 seed=0,
+                 content_encodings=()):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.tile_size = tile_size
+        self.distribution_size = distribution_size
+        self.session_lifetime = session_lifetime
+        self.content_encodings = tuple(content_encodings)
+        self.initial_version = 1
+        self.api_token = 'mock-api-token'
+        self.maps = [{'id': 'mock-map', 'name': 'Mock map'}]
+        self.users = {}
+        self.api_tokens = {}
+        self.vehicle_tokens = {}
+        self.feature_tiles = {}
+        self.sessions = set()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._versions = {}
+        self._distributions = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._server = None
+        self._thread = None
+        admin = self._new_user('admin@deepmap.ai', True)
+        self.api_tokens[self.api_token] = {
+            'id': 'api-token-0',
+            'description': 'mock admin',
+            'user_id': admin['id'],
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def url(self):
+        """ Base URL of the running server. """
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """ Starts serving on a free local port in a background thread. """
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the server. """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _new_id(self):
+        return str(next(self._ids))
+
+    def _new_user(self, email, admin):
+        user = {'id': self._new_id(), 'email': email, 'admin': admin}
+        self.users[user['id']] = user
+        return user
+
+    def tile_version(self, map_id, map_format, z, x, y, before=None):
+        """ Returns the latest version of a tile up to before, or None. """
+        versions = self._versions.get((map_id, map_format, z, x, y),
+                                      [self.initial_version])
+        if before is not None:
+            versions = [version for version in versions if version <= before]
+        return versions[-1] if versions else None
+
+    def tile(self, map_id, map_format, z, x, y, version):
+        """ Returns the content of a version of a tile. """
+        return _tile_bytes(map_id, map_format, z, x, y, version,
+                           self.tile_size)
+
+    def update_tiles(self, map_id, map_format, tile_xyzs, version=None):
+        """ Publishes a new version of tiles, by default timestamped now in
+        milliseconds. Returns the version. """
+        if version is None:
+            version = int(time.time() * 1000)
+        with self._lock:
+            for z, x, y in tile_xyzs:
+                self._versions.setdefault((map_id, map_format, z, x, y),
+                                          [self.initial_version]).append(version)
+        return version
+
+    def diff(self, map_id, map_format, z, before=None, after=None):
+        """ Returns the tiles diff response of a level. """
+        result = []
+        for (tile_map, tile_format, tz, x, y), versions in sorted(
+                self._versions.items()):
+            if (tile_map, tile_format, tz) != (map_id, map_format, z):
+                continue
+            matching = [
+                version for version in versions
+                if (before is None or version <= before) and
+                (after is None or version >= after)
+            ]
+            if matching:
+                result.append({'z': z, 'x': x, 'y': y, 'version': matching[-1]})
+        return result
+
+    def distribution_version(self, map_id):
+        """ Returns the version of the distribution of a map. """
+        return self._distributions.get(map_id, 0)
+
+    def distribution(self, map_id, version=None):
+        """ Returns the content of a version of the distribution of a map,
+        by default the latest. """
+        if version is None:
+            version = self.distribution_version(map_id)
+        return _tile_bytes(map_id, 'distribution', 0, 0, 0, version,
+                           self.distribution_size)
+
+    def publish_distribution(self, map_id):
+        """ Publishes a new distribution of a map, of the same size. Returns
+        its version. """
+        with self._lock:
+            version = self._distributions[map_id] = (
+                self.distribution_version(map_id) + 1)
+        return version
+
+    def expire_sessions(self):
+        """ Invalidates every session token issued so far. """
+        with self._lock:
+            self.sessions.clear()
+
+
+def _int(query, name):
+    value = query.get(name)
+    return int(value) if value else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Routes requests to the MockServer of the HTTP server. """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would
+    # delay until the client acknowledges the headers.
+    disable_nagle_algorithm = True
+
+    routes = [
+        ('POST', r'/api/auth/v1/token/api/session', 'create_api_session'),
+        ('POST', r'/api/auth/v1/token/vehicle/session',
+         'create_vehicle_session'),
+        ('POST', r'/api/auth/v1/reset_password', 'reset_password'),
+        ('GET', r'/api/auth/v1/token/api', 'list_api_tokens'),
+        ('POST', r'/api/auth/v1/token/api', 'create_api_token'),
+        ('DELETE', r'/api/auth/v1/token/api/(?P<token_id>[^/]+)',
+         'delete_api_token'),
+        ('GET', r'/api/auth/v1/token/vehicle', 'list_vehicle_tokens'),
+        ('POST', r'/api/auth/v1/token/vehicle', 'create_vehicle_token'),
+        ('DELETE', r'/api/auth/v1/token/vehicle/(?P<token_id>[^/]+)',
+         'delete_vehicle_token'),
+        ('GET', r'/api/maps/v1/maps', 'list_maps'),
+        ('GET', r'/api/maps/v1/(?P<map_id>[^/]+)/distribution',
+         'download_distribution'),
+        ('GET', r'/api/maps/v1/(?P<map_id>[^/]+)/feature_tiles',
+         'list_feature_tiles'),
+        ('GET', r'/api/tiles/v1/feature_tiles/(?P<tile_id>[^/]+)',
+         'download_feature_tile'),
+        ('GET', r'/api/tiles/v2/(?P<map_id>[^/]+)/tile', 'download_tile'),
+        ('GET', r'/api/tiles/v2/(?P<map_id>[^/]+)/diff', 'list_tiles_diff'),
+        ('GET', r'/api/tiles/v2/(?P<map_id>[^/]+)/tiles/search/bbox',
+         'search_tiles'),
+        ('GET', r'/api/users/v1/users', 'list_users'),
+        ('POST', r'/api/users/v1/invite', 'invite_user'),
+        ('GET', r'/api/users/v1/users/(?P<user_id>[^/]+)', 'get_user'),
+        ('POST', r'/api/users/v1/users/(?P<user_id>[^/]+)', 'edit_user'),
+        ('DELETE', r'/api/users/v1/users/(?P<user_id>[^/]+)', 'delete_user'),
+    ]
+    public = {'create_api_session', 'create_vehicle_session', 'reset_password'}
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _route(self, method):
+        parsed = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(parsed.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if body and self.headers.get_content_type() != 'application/json':
+            return self._json(415, {'error': 'Expected a JSON body'})
+        self.payload = json.loads(body) if body else {}
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, parsed.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._json(404, {'error': 'Not found'})
+
+        mock = self.mock
+        with mock._lock:
+            mock.requests += 1
+            fail = (name not in self.public and
+                    mock._random.random() < mock.error_rate)
+        if mock.latency:
+            time.sleep(mock.latency)
+        if fail:
+            return self._json(503, {'error': 'injected failure'},
+                              [('Retry-After', '0')])
+        if name not in self.public and not self._authorized():
+            return self._json(401, {'error': 'Unauthorized'})
+        return getattr(self, name)(**match.groupdict())
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+    def _authorized(self):
+        header = self.headers.get('Authorization', '')
+        return header.startswith('Bearer ') and header[7:] in self.mock.sessions
+
+    def _send(self, status, body, content_type, headers=()):
+        with self.mock._lock:
+            self.mock.bytes_sent += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        bandwidth = self.mock.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), _WRITE_CHUNK):
+            chunk = body[start:start + _WRITE_CHUNK]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+    def _compressed(self, body, headers):
+        """ Returns the body and headers compressed with the first content
+        coding of the server accepted by the request, if any. """
+        if not self.mock.content_encodings:
+            return body, headers
+        accepted = []
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00'):
+                accepted.append(name.strip().lower())
+        for encoding in accepted:
+            if encoding in self.mock.content_encodings:
+                return decoding.compress(body, encoding), list(headers) + [
+                    ('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')
+                ]
+        return body, headers
+
+    def _json(self, status, document, headers=()):
+        body, headers = self._compressed(json.dumps(document).encode(),
+                                         headers)
+        self._send(status, body, 'application/json', headers)
+
+    def _binary(self, body, headers=()):
+        body, headers = self._compressed(body, headers)
+        self._send(200, body, 'application/octet-stream', headers)
+
+    def _session(self, valid):
+        if not valid:
+            return self._json(401, {'error': 'Invalid token'})
+        mock = self.mock
+        token = jwt.encode(
+            {
+                'exp': int(time.time()) + mock.session_lifetime,
+                'jti': uuid.uuid4().hex
+            },
+            'mock-secret',
+            algorithm='HS256')
+        if isinstance(token, bytes):
+            token = token.decode()
+        with mock._lock:
+            mock.sessions.add(token)
+        return self._json(200, {'token': token})
+
+    def create_api_session(self):
+        self._session(self.payload.get('api_token') in self.mock.api_tokens)
+
+    def create_vehicle_session(self):
+        self._session(
+            self.payload.get('vehicle_token') in self.mock.vehicle_tokens)
+
+    def reset_password(self):
+        self._json(200, {})
+
+    def _create_token(self, tokens, kind, extra):
+        token = uuid.uuid4().hex
+        entry = dict(extra, id=self.mock._new_id())
+        with self.mock._lock:
+            tokens[token] = entry
+        self._json(200, dict(entry, **{kind: token}))
+
+    def _delete_token(self, tokens, token_id):
+        with self.mock._lock:
+            for token, entry in list(tokens.items()):
+                if entry['id'] == token_id:
+                    del tokens[token]
+                    return self._json(200, {})
+        return self._json(404, {'error': 'Not found'})
+
+    def list_api_tokens(self):
+        self._json(200, list(self.mock.api_tokens.values()))
+
+    def create_api_token(self):
+        self._create_token(self.mock.api_tokens, 'api_token',
+                           {'description': self.payload.get('description')})
+
+    def delete_api_token(self, token_id):
+        self._delete_token(self.mock.api_tokens, token_id)
+
+    def list_vehicle_tokens(self):
+        self._json(200, list(self.mock.vehicle_tokens.values()))
+
+    def create_vehicle_token(self):
+        self._create_token(
+            self.mock.vehicle_tokens, 'vehicle_token', {
+                'vehicle_id': self.payload.get('vehicle_id'),
+                'description': self.payload.get('description')
+            })
+
+    def delete_vehicle_token(self, token_id):
+        self._delete_token(self.mock.vehicle_tokens, token_id)
+
+    def list_maps(self):
+        self._json(200, self.mock.maps)
+
+    def download_distribution(self, map_id):
+        version = self.mock.distribution_version(map_id)
+        body = self.mock.distribution(map_id, version)
+        etag = '"distribution-{}"'.format(version)
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if not match or (if_range is not None and if_range != etag):
+            return self._binary(body, [('Accept-Ranges', 'bytes'),
+                                       ('ETag', etag)])
+        start = int(match.group(1))
+        if start >= len(body):
+            return self._send(416, b'', 'application/octet-stream',
+                              [('Content-Range', 'bytes */{}'.format(
+                                  len(body))), ('ETag', etag)])
+        end = int(match.group(2)) if match.group(2) else len(body) - 1
+        end = min(end, len(body) - 1)
+        self._send(206, body[start:end + 1], 'application/octet-stream',
+                   [('Content-Range', 'bytes {}-{}/{}'.format(
+                       start, end, len(body))), ('ETag', etag)])
+
+    def list_feature_tiles(self, map_id):
+        self._json(200, [
+            tile for tile in self.mock.feature_tiles.values()
+            if tile['map_id'] == map_id
+        ])
+
+    def download_feature_tile(self, tile_id):
+        tile = self.mock.feature_tiles.get(tile_id)
+        if tile is None:
+            return self._json(404, {'error': 'Not found'})
+        return self._binary(
+            _tile_bytes(tile['map_id'], 'feature', 0, 0, 0, tile_id,
+                        self.mock.tile_size))
+
+    def download_tile(self, map_id):
+        query = self.query
+        map_format = query.get('format')
+        z, x, y = _int(query, 'z'), _int(query, 'x'), _int(query, 'y')
+        if not 0 <= x < 1 << z or not 0 <= y < 1 << z:
+            return self._json(404, {'error': 'Tile not found'})
+        version = self.mock.tile_version(map_id, map_format, z, x, y,
+                                         _int(query, 'before'))
+        after = _int(query, 'after')
+        if version is None or (after is not None and version < after):
+            return self._json(404, {'error': 'Tile not found'})
+        etag = '"{}"'.format(version)
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', 'application/octet-stream',
+                              [('ETag', etag)])
+        return self._binary(self.mock.tile(map_id, map_format, z, x, y,
+                                           version), [('ETag', etag)])
+
+    def list_tiles_diff(self, map_id):
+        query = self.query
+        self._json(
+            200,
+            self.mock.diff(map_id, query.get('format'), _int(query, 'z'),
+                           _int(query, 'before'), _int(query, 'after')))
+
+    def search_tiles(self, map_id):
+        query = self.query
+        z = _int(query, 'z')
+        lat1, lat2 = float(query['lat1']), float(query['lat2'])
+        lng1, lng2 = float(query['lng1']), float(query['lng2'])
+        x1, y1 = tilemath.lat_lng_to_tile(max(lat1, lat2), min(lng1, lng2), z)
+        x2, y2 = tilemath.lat_lng_to_tile(min(lat1, lat2), max(lng1, lng2), z)
+        before, after = _int(query, 'before'), _int(query, 'after')
+        found = []
+        for x in range(int(x1), int(x2) + 1):
+            for y in range(int(y1), int(y2) + 1):
+                version = self.mock.tile_version(map_id, query.get('format'),
+                                                 z, x, y, before)
+                if version is not None and (after is None or version >= after):
+                    found.append({'z': z, 'x': x, 'y': y, 'version': version})
+        self._json(200, found)
+
+    def list_users(self):
+        self._json(200, list(self.mock.users.values()))
+
+    def invite_user(self):
+        with self.mock._lock:
+            user = self.mock._new_user(self.payload['email'],
+                                       bool(self.payload.get('admin')))
+        self._json(200, user)
+
+    def get_user(self, user_id):
+        user = self.mock.users.get(user_id)
+        if user is None:
+            return self._json(404, {'error': 'Not found'})
+        return self._json(200, user)
+
+    def edit_user(self, user_id):
+        user = self.mock.users.get(user_id)
+        if user is None:
+            return self._json(404, {'error': 'Not found'})
+        with self.mock._lock:
+            for field in ('email', 'admin'):
+                if field in self.payload:
+                    user[field] = self.payload[field]
+        return self._json(200, user)
+
+    def delete_user(self, user_id):
+        with self.mock._lock:
+            user = self.mock.users.pop(user_id, None)
+        if user is None:
+            return self._json(404, {'error': 'Not found'})
+        return self._json(200, {})
@@ -0,0 +1,203 @@
+""" An HTTP/2 variant of the local stand-in for the DeepMap API.
+
+Serves the endpoints of mock_server.MockServer over plain text HTTP/2 with
+prior knowledge, multiplexing concurrent requests over each connection. The
+latency and errors are simulated as by MockServer, but not the bandwidth.
+Requires the h2 package, installed with 'pip install .[http2]'.
+
+    with HTTP2MockServer(latency=0.02) as server:
+        transport = transports.HTTP2Transport(http1=False)
+        client = DeepmapClient(server.api_token, server.url,
+                               transport=transport)
+"""
+
+import asyncio
+import email.message
+import io
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+from deepmap_sdk.mock_server import MockServer, _Handler
+
+# Requests handled at once across connections. Handlers block for the
+# simulated latency, so this bounds the concurrency of the server.
+HANDLER_THREADS = 64
+
+
+class _Exchange(_Handler):
+    """ Runs the MockServer handler of one request received on an HTTP/2
+    stream, keeping the response instead of writing it. """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, server, method, path, headers, body):
+        self.server = server
+        self.command = method
+        self.path = path
+        self.headers = headers
+        self.rfile = io.BytesIO(body)
+        self.response = None
+
+    def _send(self, status, body, content_type, headers=()):
+        with self.mock._lock:
+            self.mock.bytes_sent += len(body)
+        response_headers = [('content-type', content_type),
+                            ('content-length', str(len(body)))]
+        response_headers.extend(
+            (name.lower(), value) for name, value in headers)
+        self.response = (status, response_headers, body)
+
+    def run(self):
+        """ Handles the request and returns its (status, headers, body). """
+        self._route(self.command)
+        return self.response
+
+
+class _Protocol(asyncio.Protocol):
+    """ The server side of one HTTP/2 connection. """
+
+    def __init__(self, mock):
+        self.mock = mock
+        self.connection = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False,
+                                      header_encoding='utf-8'))
+        self.transport = None
+        self.requests = {}
+        self.outgoing = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.mock._connections.add(transport)
+        self.connection.initiate_connection()
+        self._flush()
+
+    def connection_lost(self, exc):
+        self.mock._connections.discard(self.transport)
+
+    def _flush(self):
+        data = self.connection.data_to_send()
+        if data:
+            self.transport.write(data)
+
+    def data_received(self, data):
+        try:
+            events = self.connection.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self._flush()
+            self.transport.close()
+            return
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self.requests[event.stream_id] = (event.headers, bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self.connection.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+                if event.stream_id in self.requests:
+                    self.requests[event.stream_id][1].extend(event.data)
+            elif isinstance(event, h2.events.StreamEnded):
+                self._dispatch(event.stream_id)
+            elif isinstance(event, h2.events.WindowUpdated):
+                if event.stream_id:
+                    self._send_body(event.stream_id)
+                else:
+                    for stream_id in list(self.outgoing):
+                        self._send_body(stream_id)
+            elif isinstance(event, h2.events.StreamReset):
+                self.requests.pop(event.stream_id, None)
+                self.outgoing.pop(event.stream_id, None)
+        self._flush()
+
+    def _dispatch(self, stream_id):
+        headers, body = self.requests.pop(stream_id)
+        pseudo_headers = {}
+        message = email.message.Message()
+        for name, value in headers:
+            if name.startswith(':'):
+                pseudo_headers[name] = value
+            else:
+                message[name] = value
+        exchange = _Exchange(self.mock._handler_server,
+                             pseudo_headers[':method'], pseudo_headers[':path'],
+                             message, bytes(body))
+        future = self.mock._loop.run_in_executor(
+            self.mock._executor, exchange.run)
+        future.add_done_callback(
+            lambda future: self._respond(stream_id, future))
+
+    def _respond(self, stream_id, future):
+        if self.transport.is_closing():
+            return
+        try:
+            status, headers, body = future.result()
+        except Exception:  # pylint: disable=broad-except
+            status, headers, body = 500, [('content-length', '0')], b''
+        try:
+            self.connection.send_headers(stream_id,
+                                         [(':status', str(status))] + headers)
+        except h2.exceptions.StreamClosedError:
+            return
+        self.outgoing[stream_id] = memoryview(body)
+        self._send_body(stream_id)
+        self._flush()
+
+    def _send_body(self, stream_id):
+        """ Sends as much of the body of stream_id as flow control allows,
+        and ends the stream once it is all sent. """
+        body = self.outgoing.get(stream_id)
+        if body is None:
+            return
+        while body:
+            size = min(self.connection.local_flow_control_window(stream_id),
+                       self.connection.max_outbound_frame_size, len(body))
+            if size <= 0:
+                self.outgoing[stream_id] = body
+                return
+            self.connection.send_data(stream_id, body[:size].tobytes())
+            body = body[size:]
+        del self.outgoing[stream_id]
+        self.connection.end_stream(stream_id)
+
+
+class HTTP2MockServer(MockServer):
+    """ A MockServer serving plain text HTTP/2, see the module docstring. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._handler_server = types.SimpleNamespace(mock=self)
+        self._connections = set()
+        self._executor = None
+        self._loop = None
+
+    @property
+    def url(self):
+        """ Base URL of the running server. """
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """ Starts serving on a free local port in a background thread. """
+        self._executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS)
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            self._loop.create_server(lambda: _Protocol(self), '127.0.0.1', 0))
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the server and closes its connections. """
+
+        def close():
+            self._server.close()
+            for transport in list(self._connections):
+                transport.close()
+            self._loop.call_soon(self._loop.stop)
+
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,124 @@
+""" Pipelined decoding of downloaded tiles in a process pool. """
+
+import gzip
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+_GZIP_MAGIC = b'\x1f\x8b'
+# Marks the end of the fetched results in the output queue.
+_DONE = object()
+
+
+def _process_context():
+    """ Returns the multiprocessing context of the decoding processes.
+
+    The processes are started while download threads run and may hold
+    locks, which a forked child would inherit locked. They are started from
+    a fork server where available, or else spawned.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def decompress(data):
+    """ Returns data decompressed if it is gzip or zlib encoded, or data
+    unchanged otherwise. """
+    if data[:2] == _GZIP_MAGIC:
+        return gzip.decompress(data)
+    # A zlib stream starts with the deflate method and a header checksum.
+    if (len(data) >= 2 and data[0] == 0x78 and
+            (data[0] << 8 | data[1]) % 31 == 0):
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            pass
+    return data
+
+
+def decode_pipeline(results, decode=decompress, processes=None,
+                    max_pending=None):
+    """ Decodes fetched results in a process pool while they are fetched.
+
+    A thread pulls the (key, result) pairs of results, such as the generator
+    returned by DeepmapClient.download_tiles, and submits each result to the
+    process pool as soon as it is fetched. Once max_pending results are
+    being decoded or waiting to be consumed, fetching pauses until the
+    consumer catches up, so memory stays bounded.
+
+    Args:
+        results: Iterable of (key, result) pairs, where result is a binary
+            string or the exception raised while fetching it.
+        decode: A picklable function of a binary string, such as a module
+            level function.
+        processes: Number of decoding processes, by default the number of
+            CPUs.
+        max_pending: Maximum number of results between fetching and
+            consumption. Defaults to twice the number of processes.
+
+    Returns:
+        A generator of (key, result) pairs in decoding order, where result is
+        the decoded value, or the exception raised while fetching or decoding.
+    """
+    processes = processes or os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * processes
+    slots = threading.Semaphore(max_pending)
+    decoded = queue.Queue()
+    stopped = threading.Event()
+
+    def feed(pool):
+        count = 0
+        error = None
+        try:
+            for key, result in results:
+                while not slots.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                count += 1
+                if isinstance(result, Exception):
+                    decoded.put((key, result, None))
+                    continue
+                try:
+                    future = pool.submit(decode, result)
+                except Exception as submit_error:  # pylint: disable=broad-except
+                    decoded.put((key, submit_error, None))
+                    continue
+                future.add_done_callback(
+                    lambda future, key=key: decoded.put((key, None, future)))
+        except Exception as results_error:  # pylint: disable=broad-except
+            error = results_error
+        finally:
+            if hasattr(results, 'close'):
+                results.close()
+            decoded.put((_DONE, count, error))
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=_process_context()) as pool:
+        feeder = threading.Thread(target=feed, args=(pool, ), daemon=True)
+        feeder.start()
+        try:
+            fed = None
+            received = 0
+            error = None
+            while fed is None or received < fed:
+                key, result, future = decoded.get()
+                if key is _DONE:
+                    fed, error = result, future
+                    continue
+                received += 1
+                slots.release()
+                if future is not None:
+                    result = future.exception()
+                    if result is None:
+                        result = future.result()
+                yield key, result
+            if error is not None:
+                raise error
+        finally:
+            stopped.set()
+            feeder.join()
@@ -0,0 +1,241 @@
+""" Plan tile queries over large regions on the client side.
+
+Tiles follow the web mercator XYZ scheme described in tiles.py: level z has
+2^z x 2^z tiles and tile (0, 0) is at the top left (north west) of the map.
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+from deepmap_sdk import tilemath
+
+# Default maximum number of tiles covered by one search_tiles query.
+DEFAULT_MAX_TILES = 256
+# Equatorial circumference and mean radius of the earth, in meters.
+EARTH_CIRCUMFERENCE = 40075016.686
+EARTH_RADIUS = 6371008.8
+
+
+def _tile_index(coordinate, z):
+    return min(max(int(math.floor(coordinate)), 0), (1 << z) - 1)
+
+
+def covering_tiles(z, lat1, lat2, lng1, lng2):
+    """ Returns the list of (z, x, y) tiles intersecting a lat/lng bbox.
+
+    Args:
+        z: The map level.
+        lat1, lat2: Latitudes of the bbox, in any order.
+        lng1, lng2: Longitudes of the bbox, in any order.
+    """
+    x1, y1 = tilemath.lat_lng_to_xy(max(lat1, lat2), min(lng1, lng2), z)
+    x2, y2 = tilemath.lat_lng_to_xy(min(lat1, lat2), max(lng1, lng2), z)
+    return [(z, x, y)
+            for x in range(_tile_index(x1, z), _tile_index(x2, z) + 1)
+            for y in range(_tile_index(y1, z), _tile_index(y2, z) + 1)]
+
+
+def _point_in_polygon(px, py, points):
+    inside = False
+    for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]):
+        if (ay > py) != (by > py):
+            if px < ax + (py - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+    return inside
+
+
+def _segment_hits_square(ax, ay, bx, by, x, y):
+    """ Returns True if segment a-b crosses the inside of the unit square at
+    (x, y), using Liang-Barsky clipping. Touching its edges doesn't count. """
+    t0, t1 = 0.0, 1.0
+    dx, dy = bx - ax, by - ay
+    for p, q in ((-dx, ax - x), (dx, x + 1 - ax), (-dy, ay - y),
+                 (dy, y + 1 - ay)):
+        if p == 0:
+            if q <= 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 >= t1:
+                return False
+    return True
+
+
+def polygon_tiles(z, polygon):
+    """ Returns the list of (z, x, y) tiles intersecting a polygon.
+
+    Args:
+        z: The map level.
+        polygon: Sequence of (lat, lng) vertices. The polygon is closed
+            implicitly, its edges are straight lines in web mercator.
+    """
+    lats, lngs = zip(*polygon)
+    points = list(zip(*(xy.tolist() for xy in tilemath.lat_lng_to_xy(
+        lats, lngs, z))))
+    edges = list(zip(points, points[1:] + points[:1]))
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    tiles = []
+    for x in range(_tile_index(min(xs), z), _tile_index(max(xs), z) + 1):
+        for y in range(_tile_index(min(ys), z), _tile_index(max(ys), z) + 1):
+            if (_point_in_polygon(x + 0.5, y + 0.5, points) or any(
+                    _segment_hits_square(ax, ay, bx, by, x, y)
+                    for (ax, ay), (bx, by) in edges)):
+                tiles.append((z, x, y))
+    return tiles
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    """ Returns the great circle distance between two points in meters. """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2)**2 + math.cos(phi1) * math.cos(phi2) *
+         math.sin(math.radians(lng2 - lng1) / 2)**2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _point_segment(px, py, ax, ay, bx, by):
+    """ Returns the distance from point p to segment a-b, and the position
+    of the closest point along the segment, from 0 at a to 1 at b. """
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = 0.0
+    if length2:
+        t = min(max(((px - ax) * dx + (py - ay) * dy) / length2, 0.0), 1.0)
+    return math.hypot(px - ax - t * dx, py - ay - t * dy), t
+
+
+def _segment_square_distance(ax, ay, bx, by, x, y):
+    """ Returns the distance from segment a-b to the unit square at (x, y). """
+    if _segment_hits_square(ax, ay, bx, by, x, y):
+        return 0.0
+    distances = [
+        math.hypot(max(x - px, 0.0, px - x - 1), max(y - py, 0.0, py - y - 1))
+        for px, py in ((ax, ay), (bx, by))
+    ]
+    distances.extend(
+        _point_segment(cx, cy, ax, ay, bx, by)[0]
+        for cx, cy in ((x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)))
+    return min(distances)
+
+
+def route_tiles(z, polyline, width):
+    """ Returns the tiles within a corridor along a route, in the order the
+    route reaches them.
+
+    Args:
+        z: The map level.
+        polyline: Sequence of (lat, lng) points of the route. Its segments
+            are straight lines in web mercator.
+        width: Width of the corridor in meters, centered on the route.
+
+    Returns:
+        A list of ((z, x, y), distance) pairs sorted by distance, the
+        distance in meters along the route to the point closest to the tile
+        center.
+    """
+    if not polyline:
+        return []
+    lats, lngs = zip(*polyline)
+    points = list(zip(*(xy.tolist() for xy in tilemath.lat_lng_to_xy(
+        lats, lngs, z))))
+    if len(points) == 1:
+        points.append(points[0])
+        polyline = [polyline[0], polyline[0]]
+    distances = {}
+    along = 0.0
+    for i in range(len(points) - 1):
+        (ax, ay), (bx, by) = points[i], points[i + 1]
+        (lat1, lng1), (lat2, lng2) = polyline[i], polyline[i + 1]
+        length = _haversine(lat1, lng1, lat2, lng2)
+        # Meters per tile shrink with the cosine of the latitude, so use the
+        # highest latitude of the segment to keep the whole corridor.
+        cosine = max(math.cos(math.radians(max(abs(lat1), abs(lat2)))), 1e-9)
+        reach = width / 2 / (EARTH_CIRCUMFERENCE * cosine / (1 << z))
+        for x in range(_tile_index(min(ax, bx) - reach, z),
+                       _tile_index(max(ax, bx) + reach, z) + 1):
+            for y in range(_tile_index(min(ay, by) - reach, z),
+                           _tile_index(max(ay, by) + reach, z) + 1):
+                if _segment_square_distance(ax, ay, bx, by, x, y) > reach:
+                    continue
+                _, t = _point_segment(x + 0.5, y + 0.5, ax, ay, bx, by)
+                distance = along + t * length
+                if distance < distances.get((z, x, y), math.inf):
+                    distances[(z, x, y)] = distance
+        along += length
+    return sorted(distances.items(), key=lambda item: (item[1], item[0]))
+
+
+def tile_bbox(z, x, y):
+    """ Returns the (lat1, lat2, lng1, lng2) bbox of a tile, south to north
+    and west to east. """
+    return tuple(float(bound) for bound in tilemath.tile_bounds(x, y, z))
+
+
+def plan_search(tile_xyzs, max_tiles=DEFAULT_MAX_TILES):
+    """ Splits a set of tiles of one level into search queries.
+
+    Tiles are grouped into square blocks of at most max_tiles tiles, and each
+    non-empty block becomes the bbox of its tiles.
+
+    Returns:
+        A list of (z, lat1, lat2, lng1, lng2) queries for tiles.search_tiles.
+    """
+    side = max(int(math.sqrt(max_tiles)), 1)
+    blocks = {}
+    for z, x, y in tile_xyzs:
+        block = blocks.setdefault((z, x // side, y // side), [x, y, x, y])
+        block[0] = min(block[0], x)
+        block[1] = min(block[1], y)
+        block[2] = max(block[2], x)
+        block[3] = max(block[3], y)
+    return [(z, tilemath.y_to_lat(y2 + 1, z).item(),
+             tilemath.y_to_lat(y1, z).item(),
+             tilemath.x_to_lng(x1, z).item(),
+             tilemath.x_to_lng(x2 + 1, z).item())
+            for (z, _, _), (x1, y1, x2, y2) in sorted(blocks.items())]
+
+
+def search_tiles(client,
+                 map_id,
+                 tile_xyzs,
+                 map_format,
+                 before=None,
+                 after=None,
+                 max_tiles=DEFAULT_MAX_TILES,
+                 max_workers=8):
+    """ Searches a large set of tiles with concurrent bbox queries.
+
+    The tiles are split with plan_search, the queries are issued in
+    parallel, and the results are de-duplicated and restricted to tile_xyzs,
+    as neighbouring queries may both return tiles on their shared edge.
+
+    Args:
+        client: A DeepmapClient.
+        tile_xyzs: The tiles to search, from covering_tiles or polygon_tiles.
+        max_tiles: Maximum number of tiles covered by one query.
+        max_workers: Number of concurrent queries.
+
+    Returns:
+        The list of tiles found, as returned by the search endpoint.
+    """
+    wanted = set(tile_xyzs)
+
+    def search(query):
+        z, lat1, lat2, lng1, lng2 = query
+        found = client.search_tiles(map_id, z, lat1, lat2, lng1, lng2,
+                                    map_format, before, after)
+        if not isinstance(found, list):
+            raise ValueError('Failed to search tiles: {}'.format(found))
+        return found
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for found in executor.map(search, plan_search(wanted, max_tiles)):
+            for tile in found:
+                xyz = (tile['z'], tile['x'], tile['y'])
+                if xyz in wanted:
+                    results[xyz] = tile
+    return list(results.values())
@@ -0,0 +1,179 @@
+""" Background prefetching of the tiles along a route into the tile cache. """
+
+import collections
+import heapq
+import threading
+import time
+from deepmap_sdk import planner
+
+PrefetchProgress = collections.namedtuple(
+    'PrefetchProgress',
+    ['total', 'done', 'failed', 'bytes', 'distance', 'elapsed', 'eta'])
+PrefetchProgress.__doc__ = """ The progress of a RoutePrefetcher.
+
+    total: Number of tiles to prefetch.
+    done: Number of tiles prefetched.
+    failed: Number of tiles that failed to download.
+    bytes: Size of the tiles prefetched.
+    distance: Meters along the route of the nearest tile not handled yet,
+        or None once every tile is.
+    elapsed: Seconds since the prefetch started.
+    eta: Estimated seconds until every tile is handled at the current rate,
+        or None before the first one is.
+"""
+
+
+class RoutePrefetcher:
+    """ Downloads the tiles within a corridor along a route into the tile
+    cache of a client, in a background thread, nearest tiles first.
+
+    The tiles of every level are queued by their distance along the route,
+    so a vehicle following it finds the tiles ahead of it cached. Tiles
+    found later with add_route are queued by the same distance.
+
+        with client.prefetch_route(map_id, polyline, 200, [14, 16], fmt) as p:
+            ...
+            print(p.progress().eta)
+    """
+
+    def __init__(self,
+                 client,
+                 map_id,
+                 polyline,
+                 width,
+                 zs,
+                 map_format,
+                 max_workers=None):
+        """ Plans the prefetch, see add_route.
+
+        Args:
+            client: A DeepmapClient with a cache.
+            max_workers: Number of concurrent downloads. Defaults to the size
+                of the client's connection pool.
+        """
+        if client.cache is None:
+            raise ValueError('Prefetching requires a client with a cache.')
+        self.client = client
+        self.map_id = map_id
+        self.map_format = map_format
+        self.max_workers = max_workers
+        # Heap of (distance along the route, (z, x, y)) of the queued tiles.
+        self._queue = []
+        self._queued = set()
+        # Distances along the route of the tiles being downloaded.
+        self._in_flight = {}
+        self.errors = {}
+        self.total = 0
+        self.done = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+        self._thread = None
+        self._started = None
+        self.add_route(polyline, width, zs)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def add_route(self, polyline, width, zs):
+        """ Queues the tiles within a corridor along a route that weren't
+        queued yet, resuming a finished prefetch. Returns the number of tiles
+        added.
+
+        Args:
+            polyline: Sequence of (lat, lng) points of the route.
+            width: Width of the corridor in meters.
+            zs: Iterable of the levels to prefetch.
+        """
+        added = 0
+        with self._lock:
+            for z in zs:
+                for xyz, distance in planner.route_tiles(z, polyline, width):
+                    if xyz not in self._queued:
+                        self._queued.add(xyz)
+                        heapq.heappush(self._queue, (distance, xyz))
+                        added += 1
+            self.total += added
+            resume = (added and self._finished.is_set() and
+                      not self._stopped.is_set())
+            if resume:
+                self._finished.clear()
+        if resume:
+            self._spawn()
+        return added
+
+    def _next_tiles(self):
+        """ Yields the queued tiles nearest first, until stopped. """
+        while not self._stopped.is_set():
+            with self._lock:
+                if not self._queue:
+                    return
+                distance, xyz = heapq.heappop(self._queue)
+                self._in_flight[xyz] = distance
+            yield xyz
+
+    def _run(self):
+        while True:
+            results = self.client.download_tiles(self.map_id,
+                                                 self._next_tiles(),
+                                                 self.map_format,
+                                                 max_workers=self.max_workers)
+            try:
+                for xyz, result in results:
+                    with self._lock:
+                        del self._in_flight[xyz]
+                        if isinstance(result, Exception):
+                            self.errors[xyz] = result
+                        else:
+                            self.done += 1
+                            self.bytes += len(result)
+            finally:
+                results.close()
+            # Tiles may have been added after the generator ran out.
+            with self._lock:
+                if self._stopped.is_set() or not self._queue:
+                    self._finished.set()
+                    return
+
+    def _spawn(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def start(self):
+        """ Starts prefetching in a background thread, unless started
+        already. Returns self. """
+        if self._started is not None:
+            return self
+        self._started = time.monotonic()
+        self._spawn()
+        return self
+
+    def stop(self):
+        """ Stops queuing downloads and waits for those in flight. """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        """ Waits until every queued tile is handled, or timeout seconds.
+        Returns True if they were. """
+        return self._finished.wait(timeout)
+
+    def progress(self):
+        """ Returns the PrefetchProgress. """
+        with self._lock:
+            elapsed = (0.0 if self._started is None else time.monotonic() -
+                       self._started)
+            handled = self.done + len(self.errors)
+            pending = [distance for distance, _ in self._queue[:1]]
+            pending.extend(self._in_flight.values())
+            distance = min(pending) if pending else None
+            eta = None
+            if handled:
+                eta = (self.total - handled) * elapsed / handled
+            return PrefetchProgress(self.total, self.done, len(self.errors),
+                                    self.bytes, distance, elapsed, eta)
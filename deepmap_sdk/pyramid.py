@@ -0,0 +1,123 @@
+""" Fetching of the tiles of a region at several levels at once.
+
+A tile covers its 4 children at the next level, so a tile whose content
+didn't change has no changed children either. fetch_pyramid uses this to
+only look for changes below the changed tiles of the level above, making an
+update of a multi-resolution mirror proportional to the changes.
+"""
+
+from deepmap_sdk import planner
+
+
+def pyramid_tiles(min_z, max_z, lat1, lat2, lng1, lng2):
+    """ Returns a dictionary of level to the set of (z, x, y) tiles of the
+    levels min_z to max_z intersecting a lat/lng bbox.
+
+    The tiles of max_z are computed once and the levels above are derived
+    from them, so a tile is in the pyramid if and only if one of its
+    descendants at max_z is.
+    """
+    if min_z > max_z:
+        raise ValueError('min_z {} is above max_z {}'.format(min_z, max_z))
+    levels = {
+        max_z: set(planner.covering_tiles(max_z, lat1, lat2, lng1, lng2))
+    }
+    for z in range(max_z - 1, min_z - 1, -1):
+        levels[z] = {(z, x >> 1, y >> 1) for _, x, y in levels[z + 1]}
+    return levels
+
+
+def changed_tiles(client,
+                  map_id,
+                  levels,
+                  map_format,
+                  before=None,
+                  after=None,
+                  max_workers=8):
+    """ Finds the tiles of a pyramid changed in a time range, level by level.
+
+    The tiles of the top level are searched for changes, then below it only
+    the children of changed tiles, with concurrent search queries. Levels
+    below a level without changes aren't queried at all. Without after,
+    every tile of the pyramid is considered changed, and nothing is queried.
+
+    Args:
+        client: A DeepmapClient.
+        levels: Dictionary of level to the tiles of the level, from
+            pyramid_tiles.
+        before: Timestamp of the versions to fetch, by default the latest.
+        after: Timestamp the pyramid was last fetched at.
+        max_workers: Number of concurrent search queries per level.
+
+    Returns:
+        A dictionary of level to a dictionary of the changed (z, x, y) tiles
+        of the level to their version, None if unknown.
+    """
+    if after is None:
+        return {z: dict.fromkeys(tiles) for z, tiles in levels.items()}
+
+    zs = sorted(levels)
+    changed = {}
+    for z in zs:
+        if z == zs[0]:
+            candidates = list(levels[z])
+        else:
+            candidates = [(z, 2 * x + dx, 2 * y + dy)
+                          for _, x, y in changed[z - 1]
+                          for dx in (0, 1)
+                          for dy in (0, 1)
+                          if (z, 2 * x + dx, 2 * y + dy) in levels[z]]
+        changed[z] = {}
+        if not candidates:
+            continue
+        for tile in planner.search_tiles(client,
+                                         map_id,
+                                         candidates,
+                                         map_format,
+                                         before,
+                                         after,
+                                         max_workers=max_workers):
+            changed[z][(tile['z'], tile['x'], tile['y'])] = tile.get('version')
+    return changed
+
+
+def fetch_pyramid(client,
+                  map_id,
+                  min_z,
+                  max_z,
+                  lat1,
+                  lat2,
+                  lng1,
+                  lng2,
+                  map_format,
+                  before=None,
+                  after=None,
+                  max_workers=None):
+    """ Downloads the tiles of levels min_z to max_z in a lat/lng bbox that
+    changed since after, see changed_tiles.
+
+    The tiles are downloaded concurrently, level by level from the top.
+
+    Args:
+        client: A DeepmapClient.
+        before: Timestamp of the versions to fetch, by default the latest.
+        after: Timestamp the region was last fetched at, or None to fetch
+            every tile.
+        max_workers: Number of concurrent requests. Defaults to the size of
+            the client's connection pool.
+
+    Returns:
+        A tuple of a dictionary of the changed (z, x, y) tiles to their
+        version, and a generator of ((z, x, y), result) pairs in completion
+        order, where result is the binary string of the tile, or the
+        exception raised while fetching it.
+    """
+    levels = pyramid_tiles(min_z, max_z, lat1, lat2, lng1, lng2)
+    changed = changed_tiles(client, map_id, levels, map_format, before, after,
+                            max_workers or client.pool_maxsize)
+    versions = {}
+    for z in sorted(changed):
+        versions.update(changed[z])
+    return versions, client.download_tiles(map_id, list(versions),
+                                           map_format, before, None,
+                                           max_workers)
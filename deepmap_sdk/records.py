@@ -0,0 +1,186 @@
+""" Compact typed records of API listings.
+
+The records are named tuples, which take less memory than the decoded JSON
+objects and can't be modified, so they can be shared by the callers of a
+cached listing. Fields of an object that a record type doesn't declare are
+kept in its extra field.
+
+RecordTable holds a large listing in a few arrays per field instead of one
+object per record. Values are kept in their JSON encoding and only decoded
+when accessed.
+"""
+
+import collections
+import json
+from array import array
+
+# Result formats of the listings of DeepmapClient.
+RECORD_FORMATS = ('dict', 'records', 'table')
+
+# Kinds of the cells of a RecordTable column.
+_NONE, _TEXT, _JSON = 0, 1, 2
+
+
+class _Record:
+    """ Conversion of the records from and to decoded JSON objects. """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, item):
+        """ Returns the record of a decoded JSON object. """
+        fields = cls._fields[:-1]
+        extra = {key: value for key, value in item.items() if key not in fields}
+        return cls(*(item.get(field) for field in fields), extra or None)
+
+    def to_dict(self):
+        """ Returns the record as a decoded JSON object. """
+        item = dict(zip(self._fields[:-1], self[:-1]))
+        if self[-1]:
+            item.update(self[-1])
+        return item
+
+
+class Map(_Record, collections.namedtuple('Map', ['id', 'name', 'extra'])):
+    """ A map. """
+    __slots__ = ()
+
+
+class FeatureTile(_Record,
+                  collections.namedtuple('FeatureTile',
+                                         ['id', 'map_id', 'extra'])):
+    """ A feature tile of a map. """
+    __slots__ = ()
+
+
+class User(_Record,
+           collections.namedtuple('User', ['id', 'email', 'admin', 'extra'])):
+    """ A user of the account. """
+    __slots__ = ()
+
+
+class ApiToken(_Record,
+               collections.namedtuple('ApiToken',
+                                      ['id', 'description', 'user_id',
+                                       'extra'])):
+    """ An API access token. """
+    __slots__ = ()
+
+
+class VehicleToken(_Record,
+                   collections.namedtuple('VehicleToken',
+                                          ['id', 'vehicle_id', 'description',
+                                           'extra'])):
+    """ A vehicle access token. """
+    __slots__ = ()
+
+
+class _Column:
+    """ The values of a field, encoded back to back in one buffer. """
+
+    __slots__ = ('data', 'offsets', 'kinds')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('Q', [0])
+        self.kinds = bytearray()
+
+    def append(self, value):
+        if value is None:
+            kind = _NONE
+        elif isinstance(value, str):
+            kind = _TEXT
+            self.data += value.encode()
+        else:
+            kind = _JSON
+            self.data += json.dumps(value, separators=(',', ':')).encode()
+        self.kinds.append(kind)
+        self.offsets.append(len(self.data))
+
+    def get(self, index):
+        kind = self.kinds[index]
+        if kind == _NONE:
+            return None
+        text = self.data[self.offsets[index]:self.offsets[index + 1]].decode()
+        return text if kind == _TEXT else json.loads(text)
+
+    def nbytes(self):
+        return (len(self.data) + len(self.kinds) +
+                self.offsets.itemsize * len(self.offsets))
+
+
+class RecordTable:
+    """ A read-only listing of records stored by column.
+
+    Strings are stored as UTF-8 and other values as JSON in one buffer per
+    field, so a record costs little more than the size of its encoded
+    values. Records are built when accessed, and column decodes a single
+    field.
+
+        table = RecordTable(records.VehicleToken, client.iter_vehicle_tokens())
+        table[0].vehicle_id, table.column('id')
+
+    Args:
+        record_type: The record class of the items, such as Map.
+        items: Iterable of decoded JSON objects, such as the generator of a
+            streamed listing, which is never held in memory at once.
+    """
+
+    def __init__(self, record_type, items=()):
+        self.record_type = record_type
+        self._columns = {field: _Column() for field in record_type._fields}
+        self._length = 0
+        fields = record_type._fields[:-1]
+        extra = self._columns['extra']
+        for item in items:
+            for field in fields:
+                self._columns[field].append(item.get(field))
+            extra.append({
+                key: value for key, value in item.items() if key not in fields
+            } or None)
+            self._length += 1
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('RecordTable index out of range')
+        return self.record_type(*(self._columns[field].get(index)
+                                  for field in self.record_type._fields))
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
+
+    def column(self, field):
+        """ Returns the list of the values of a field. """
+        column = self._columns[field]
+        return [column.get(index) for index in range(self._length)]
+
+    def nbytes(self):
+        """ Returns the size of the buffers of the table. """
+        return sum(column.nbytes() for column in self._columns.values())
+
+
+def convert(document, record_type, record_format):
+    """ Returns a decoded JSON response in a record format.
+
+    Args:
+        document: A decoded list of objects, or a single object.
+        record_type: The record class of the objects.
+        record_format: 'dict' to return document unchanged, 'records' for
+            records and lists of records, or 'table' for a RecordTable of a
+            list. Objects without an id, such as errors, are never converted.
+    """
+    if record_format == 'dict':
+        return document
+    if isinstance(document, list):
+        if record_format == 'table':
+            return RecordTable(record_type, document)
+        return [record_type.from_dict(item) for item in document]
+    if isinstance(document, dict) and 'id' in document:
+        return record_type.from_dict(document)
+    return document
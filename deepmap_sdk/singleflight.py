@@ -0,0 +1,62 @@
+""" Coalescing of concurrent identical calls. """
+
+import threading
+
+
+class _Call:
+    """ A call in flight, waited on by the callers that joined it. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Runs at most one call per key at a time. Callers asking for a key
+    while a call for it is in flight wait for that call and share its result,
+    or the exception it raised, instead of making their own.
+
+    Results are shared, not copied, so functions should return immutable
+    values such as bytes. Nothing is kept once a call returns, so later
+    callers make a new call.
+
+    Attributes:
+        calls: Number of calls made.
+        shared: Number of callers that joined a call in flight.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """ Returns function(*args, **kwargs), or the result of the call in
+        flight for key. """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,93 @@
+""" Incremental parsing of JSON list responses. """
+
+import codecs
+import json
+
+# Bytes read from a streamed response at a time.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JSONArrayParser:
+    """ Parses a JSON array fed in chunks, returning its items as soon as
+    they are complete, so that only the item being received is buffered.
+
+        parser = JSONArrayParser()
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                ...
+        parser.close()
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = False
+        self._done = False
+        self._count = 0
+
+    def _skip_whitespace(self, pos):
+        while pos < len(self._buffer) and self._buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, chunk):
+        """ Adds a chunk of bytes and returns the list of items it completed.
+        Raises ValueError if the document isn't a JSON array. """
+        self._buffer += self._text.decode(chunk)
+        items = []
+        pos = self._skip_whitespace(0)
+        if not self._started:
+            if pos == len(self._buffer):
+                return items
+            if self._buffer[pos] != '[':
+                # Not a list, such as an error. Buffer it all to report it.
+                return items
+            self._started = True
+            pos = self._skip_whitespace(pos + 1)
+
+        while not self._done and pos < len(self._buffer):
+            if self._count == 0 and self._buffer[pos] == ']':
+                self._done = True
+                break
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # A number is only complete once followed by a separator, which
+            # may not have been received yet.
+            end = self._skip_whitespace(end)
+            if end == len(self._buffer) or self._buffer[end] in _NUMBER_CHARS:
+                break
+            if self._buffer[end] == ']':
+                self._done = True
+            elif self._buffer[end] != ',':
+                raise ValueError('Invalid JSON array at: {}'.format(
+                    self._buffer[end:end + 20]))
+            items.append(item)
+            self._count += 1
+            pos = self._skip_whitespace(end + 1)
+        self._buffer = '' if self._done else self._buffer[pos:]
+        return items
+
+    def close(self):
+        """ Checks the whole array was received. Raises ValueError with the
+        decoded document if it wasn't a JSON array. """
+        self._buffer += self._text.decode(b'', final=True)
+        if not self._started:
+            raise ValueError('Expected a JSON list, got: {}'.format(
+                self._buffer[:200]))
+        if not self._done:
+            raise ValueError('Truncated JSON list')
+
+
+def iter_json_array(chunks):
+    """ Returns a generator of the items of a JSON array given an iterable of
+    byte chunks, such as response.iter_content(). """
+    parser = JSONArrayParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
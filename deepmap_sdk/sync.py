@@ -0,0 +1,166 @@
+""" Incremental mirroring of map tiles with the tiles diff API. """
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def diff_tiles(diff):
+    """ Returns a list of (z, x, y, version) tuples from a tiles diff response.
+
+    Args:
+        diff: The decoded JSON list returned by the tiles diff endpoint. The
+            version of a tile is None if the response doesn't include it.
+    """
+    if not isinstance(diff, list):
+        raise ValueError('Failed to list tiles diff: {}'.format(diff))
+    return [(tile['z'], tile['x'], tile['y'], tile.get('version'))
+            for tile in diff]
+
+
+class DirectoryTileStore:
+    """ A local mirror of the tiles of one map and format, stored as one
+    file per tile under root/z/x/y.
+
+    Changes are made through transaction(). Tiles written in a transaction
+    are staged next to the mirror and only moved into place, followed by the
+    sync watermarks, once every tile was written. A failed sync thus leaves
+    the watermarks untouched, so the next sync fetches the same changes again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, z, x, y):
+        return os.path.join(self.root, str(z), str(x), str(y))
+
+    def _watermarks_path(self):
+        return os.path.join(self.root, 'watermarks.json')
+
+    def get(self, z, x, y):
+        """ Returns the stored tile at (z, x, y), or None if absent. """
+        try:
+            with open(self._path(z, x, y), 'rb') as tile:
+                return tile.read()
+        except FileNotFoundError:
+            return None
+
+    def watermarks(self):
+        """ Returns a dictionary of zoom level to the version (millisecond
+        timestamp) the level was last synced up to. """
+        try:
+            with open(self._watermarks_path()) as watermarks:
+                return {int(z): ts for z, ts in json.load(watermarks).items()}
+        except FileNotFoundError:
+            return {}
+
+    def get_watermark(self, z):
+        """ Returns the timestamp zoom level z was last synced up to, or None
+        if it was never synced. """
+        return self.watermarks().get(z)
+
+    def transaction(self):
+        """ Returns a context manager staging tile writes and watermark
+        updates, applied together when the block exits without error. """
+        return _DirectoryTransaction(self)
+
+
+class _DirectoryTransaction:
+    """ Staged changes to a DirectoryTileStore. """
+
+    def __init__(self, store):
+        self.store = store
+        self.staging = None
+        self.tiles = []
+        self.watermarks = {}
+
+    def __enter__(self):
+        self.staging = tempfile.mkdtemp(prefix='.staging-', dir=self.store.root)
+        return self
+
+    def put(self, z, x, y, data, version=None):
+        """ Stages the tile at (z, x, y). Versions aren't kept by this store,
+        the latest put tile replaces the previous one. """
+        path = os.path.join(self.staging, str(len(self.tiles)))
+        with open(path, 'wb') as tile:
+            tile.write(data)
+        self.tiles.append((path, self.store._path(z, x, y)))
+
+    def set_watermark(self, z, timestamp):
+        """ Stages the timestamp zoom level z is synced up to. """
+        self.watermarks[z] = timestamp
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                for staged, path in self.tiles:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(staged, path)
+                if self.watermarks:
+                    watermarks = self.store.watermarks()
+                    watermarks.update(self.watermarks)
+                    staged = os.path.join(self.staging, 'watermarks.json')
+                    with open(staged, 'w') as staged_file:
+                        json.dump(watermarks, staged_file)
+                    os.replace(staged, self.store._watermarks_path())
+        finally:
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def sync_map(client, map_id, z, map_format, local_store, max_workers=None):
+    """ Brings local_store up to date with the tiles of a map at level z.
+
+    Asks the diff endpoint for the tiles changed since the store's watermark
+    for z, downloads only those tiles in parallel, and commits them together
+    with the new watermark in one store transaction. The watermark is the
+    newest version listed by the diff, so it only depends on the server's
+    clock, and tiles are downloaded as of that version, so tiles updated
+    while the sync runs are picked up by the next one. As both bounds of the
+    diff are inclusive, tiles versioned exactly at the watermark are fetched
+    again. Raises the first download error, in which case the store is left
+    unchanged.
+
+    The diff is requested up to the current time, which bounds the sync if
+    the diff doesn't include the version of every tile: tiles are then
+    downloaded as of that time, and the watermark advances to it, so a sync
+    depends on the local clock being in sync with the server's.
+
+    Args:
+        client: A DeepmapClient.
+        local_store: A store with get_watermark(z) and transaction(), such as
+            DirectoryTileStore or tile_store.TileStore.
+        max_workers: Number of concurrent downloads, see
+            DeepmapClient.download_tiles.
+
+    Returns:
+        The list of (z, x, y) tiles updated in the store.
+    """
+    watermark = local_store.get_watermark(z)
+    bound = int(time.time() * 1000)
+    changed = diff_tiles(
+        client.list_tiles_diff(map_id,
+                               z,
+                               map_format,
+                               before=bound,
+                               after=watermark))
+    versions = {(tz, tx, ty): version for tz, tx, ty, version in changed}
+    if None in versions.values():
+        newest = bound
+    else:
+        newest = max(versions.values(), default=None)
+
+    with local_store.transaction() as txn:
+        for xyz, result in client.download_tiles(map_id,
+                                                 versions,
+                                                 map_format,
+                                                 before=newest,
+                                                 max_workers=max_workers):
+            if isinstance(result, Exception):
+                raise result
+            txn.put(*xyz, result, version=versions[xyz])
+        if newest is not None:
+            txn.set_watermark(z, newest)
+    return list(versions)
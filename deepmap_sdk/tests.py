@@ -1,5 +1,34 @@
 """ Tests for the Deepmap Client class. """
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import urllib3.response
+from requests import HTTPError, Response
+from deepmap_sdk import (decoding, downloads, maps, planner, pyramid, records,
+                         tile_cache, tilemath, tiles, user_admin)
 from deepmap_sdk.deepmap_sdk_example import DeepmapClient
+from deepmap_sdk.endpoints import TileEndpoints
+from deepmap_sdk.executor import RetryPolicy, TokenBucket
+from deepmap_sdk.metrics import Metrics, RequestEvent, endpoint_name
+from deepmap_sdk.mock_server import MockServer
+from deepmap_sdk.pipeline import _process_context, decode_pipeline, decompress
+from deepmap_sdk.singleflight import SingleFlight
+from deepmap_sdk.streaming import JSONArrayParser, iter_json_array
+from deepmap_sdk.sync import DirectoryTileStore, sync_map
+from deepmap_sdk.tile_cache import TileCache, tile_key
+from deepmap_sdk.tile_store import TileStore
+from deepmap_sdk.time_travel import TimeTravel, VersionIndex, VersionNotFound
+from deepmap_sdk.transports import HTTP2Transport
+from deepmap_sdk.vehicle_sessions import SessionError, VehicleSessionPool
 
 
 def test_client_functions_as_admin(admin_token, server):
@@ -132,3 +161,1160 @@ def test_client_functions_as_user(admin_token, reg_token, server):
 
     test_client.delete_user(invited['id'])
     assert (num_users - 1) == len(test_client.list_users())
+
+
+def test_download_tiles_bounds_requests_in_flight():
+    """ Tests that bulk downloads only pull a bounded number of tiles ahead
+    of the consumer, and return per-tile errors as results. """
+
+    with MockServer(latency=0.01) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        pulled = []
+
+        def tile_xyzs():
+            for x in range(50):
+                pulled.append(x)
+                yield (6, x, 1)
+            # Outside the grid of level 1.
+            pulled.append(None)
+            yield (1, 7, 7)
+
+        results = {}
+        for xyz, result in client.download_tiles('mock-map', tile_xyzs(),
+                                                 'fmt', max_workers=4):
+            results[xyz] = result
+            assert len(pulled) - len(results) <= 2 * 4
+        assert len(results) == 51
+        assert isinstance(results.pop((1, 7, 7)), HTTPError)
+        assert results == {(6, x, 1): mock.tile('mock-map', 'fmt', 6, x, 1, 1)
+                           for x in range(50)}
+
+
+def test_async_client_against_stub_server():
+    """ Tests the asyncio client against a local stub of the API. """
+    aiohttp = pytest.importorskip('aiohttp')
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from deepmap_sdk.async_client import AsyncDeepmapClient
+
+    # Header and payload of an unsigned JWT expiring far in the future.
+    token = 'eyJhbGciOiJub25lIn0.eyJleHAiOjQxMDI0NDQ4MDB9.'
+
+    async def create_session(request):
+        if (await request.json())['api_token'] != 'stub-token':
+            return web.json_response({'error': 'Invalid token'}, status=401)
+        return web.json_response({'token': token})
+
+    async def list_maps(request):
+        assert request.headers['Authorization'] == 'Bearer ' + token
+        return web.json_response([{'id': '1'}, {'id': '2'}])
+
+    async def download_tile(request):
+        query = request.query
+        if query['x'] == '3':
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.Response(body='{z}/{x}/{y}'.format(**query).encode())
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/api/auth/v1/token/api/session', create_session)
+        app.router.add_get('/api/maps/v1/maps', list_maps)
+        app.router.add_get('/api/tiles/v2/{map_id}/tile', download_tile)
+        async with TestServer(app) as server:
+            server_url = str(server.make_url(''))
+            rejected = AsyncDeepmapClient('bad-token', server_url)
+            assert rejected.is_exp()
+            with pytest.raises(aiohttp.ClientResponseError):
+                async with rejected:
+                    pass
+            # The HTTP session of a failed login is closed.
+            assert rejected.session is None
+            async with AsyncDeepmapClient('stub-token', server_url,
+                                          max_concurrency=2) as client:
+                assert not client.is_exp()
+                assert len(await client.list_maps()) == 2
+                assert [m['id'] async for m in client.iter_maps()] == ['1', '2']
+                xyzs = [(4, x, 1) for x in range(6)]
+                results = {
+                    xyz: result async for xyz, result in client.download_tiles(
+                        '1', xyzs, 'fmt')
+                }
+        assert set(results) == set(xyzs)
+        assert results[(4, 0, 1)] == b'4/0/1'
+        assert isinstance(results[(4, 3, 1)], Exception)
+
+    asyncio.run(run())
+
+
+def test_tile_cache_eviction_and_counters(tmp_path):
+    """ Tests the LRU eviction and counters of the on-disk tile cache. """
+
+    cache = TileCache(str(tmp_path), max_bytes=10)
+    keys = [tile_key('map', 'fmt', 3, x, 0) for x in range(3)]
+
+    assert cache.get(keys[0]) is None
+    cache.put(keys[0], b'aaaa', etag='"a"')
+    cache.put(keys[1], b'bbbb')
+    assert cache.get(keys[0]) == b'aaaa'
+    assert cache.validators(keys[0]) == {'If-None-Match': '"a"'}
+
+    # keys[1] is now the least recently used tile.
+    cache.put(keys[2], b'cccc')
+    assert keys[1] not in cache
+    assert cache.revalidated(keys[0]) == b'aaaa'
+
+    reopened = TileCache(str(tmp_path), max_bytes=10)
+    assert reopened.get(keys[2]) == b'cccc'
+    assert reopened.stats()['bytes'] == 8
+    assert cache.stats() == {
+        'hits': 2,
+        'misses': 3,
+        'revalidations': 1,
+        'evictions': 1,
+        'entries': 2,
+        'bytes': 8,
+    }
+
+
+def test_cached_tiles_are_final_only_before_a_past_timestamp(tmp_path):
+    """ Tests that tiles pinned by a before timestamp in the past are served
+    from the cache, and others revalidated. """
+
+    with MockServer() as mock:
+        cache = TileCache(str(tmp_path))
+        client = DeepmapClient(mock.api_token, mock.url, cache=cache)
+        future = int(time.time() * 1000) + 24 * 3600 * 1000
+        for before in (1000, future, None):
+            client.download_tile('mock-map', 3, 1, 1, 'fmt', before=before)
+        requests = mock.requests
+        assert client.download_tile('mock-map', 3, 1, 1, 'fmt',
+                                    before=1000) == mock.tile(
+                                        'mock-map', 'fmt', 3, 1, 1, 1)
+        assert mock.requests == requests
+
+        version = mock.update_tiles('mock-map', 'fmt', [(3, 1, 1)])
+        for before in (future, None):
+            assert client.download_tile('mock-map', 3, 1, 1, 'fmt',
+                                        before=before) == mock.tile(
+                                            'mock-map', 'fmt', 3, 1, 1, version)
+        assert mock.requests == requests + 2
+
+
+def test_distribution_download_resumes_only_unchanged_files(tmp_path):
+    """ Tests that an interrupted download resumes, unless the distribution
+    was republished since or while it runs. """
+
+    def interrupted(get):
+        """ Returns a get failing after the first chunk of a range. """
+
+        def failing_get(url, **kwargs):
+            response = get(url, **kwargs)
+            if kwargs['headers'].get('Range', 'bytes=0-0') != 'bytes=0-0':
+                chunks = response.iter_content(16 * 1024)
+
+                def iter_content(chunk_size):
+                    yield next(chunks)
+                    raise IOError('connection reset')
+
+                response.iter_content = iter_content
+            return response
+
+        return failing_get
+
+    dest_path = str(tmp_path / 'distribution')
+
+    def download(get):
+        url = maps.download_distribution('mock-map', mock.url)
+        downloads.download_file(get, url, dest_path, chunk_size=16 * 1024)
+        with open(dest_path, 'rb') as distribution:
+            return distribution.read()
+
+    size = 256 * 1024
+    with MockServer(distribution_size=size) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+
+        with pytest.raises(IOError):
+            download(interrupted(client._get))
+        sent = mock.bytes_sent
+        assert download(client._get) == mock.distribution('mock-map')
+        assert mock.bytes_sent - sent < size
+
+        # A distribution republished at the same size isn't spliced.
+        with pytest.raises(IOError):
+            download(interrupted(client._get))
+        mock.publish_distribution('mock-map')
+        assert download(client._get) == mock.distribution('mock-map')
+
+        # Nor one republished while it downloads, which restarts it.
+        published = []
+
+        def republishing_get(url, **kwargs):
+            if 'If-Range' in kwargs['headers'] and not published:
+                published.append(mock.publish_distribution('mock-map'))
+            return client._get(url, **kwargs)
+
+        with pytest.raises(IOError):
+            download(interrupted(client._get))
+        assert download(republishing_get) == mock.distribution('mock-map')
+
+    with MockServer(distribution_size=0) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        assert download(client._get) == b''
+
+
+def test_sync_map_downloads_only_changed_tiles(tmp_path):
+    """ Tests that sync_map fetches the diff since the last sync and commits
+    tiles and watermark together. """
+
+    class DiffClient:
+        """ Serves a fixed diff, with or without versions, and records the
+        requested time ranges and downloads. """
+
+        def __init__(self, diff, failing=(), versioned=True):
+            self.diff = diff
+            self.failing = failing
+            self.versioned = versioned
+            self.afters = []
+            self.downloads = []
+
+        def list_tiles_diff(self, map_id, z, map_format, before=None,
+                            after=None):
+            self.afters.append(after)
+            return [
+                tile if self.versioned else
+                {key: tile[key] for key in ('z', 'x', 'y')}
+                for tile in self.diff
+                if tile['z'] == z and (after is None or tile['version'] >= after)
+                and (before is None or tile['version'] <= before)
+            ]
+
+        def download_tiles(self, map_id, tile_xyzs, map_format, before=None,
+                           after=None, max_workers=None):
+            for xyz in tile_xyzs:
+                self.downloads.append(xyz)
+                if xyz in self.failing:
+                    yield xyz, IOError('connection reset')
+                else:
+                    yield xyz, '{}/{}/{}'.format(*xyz).encode()
+
+    store = DirectoryTileStore(str(tmp_path))
+    # Versions from a server clock far behind the local one.
+    diff = [{
+        'z': 2,
+        'x': 1,
+        'y': 3,
+        'version': 200
+    }, {
+        'z': 2,
+        'x': 0,
+        'y': 0,
+        'version': 100
+    }]
+
+    failing_client = DiffClient(diff, failing=[(2, 0, 0)])
+    with pytest.raises(IOError):
+        sync_map(failing_client, 'map', 2, 'fmt', store)
+    assert store.get(2, 1, 3) is None
+    assert store.get_watermark(2) is None
+
+    client = DiffClient(diff)
+    assert sorted(sync_map(client, 'map', 2, 'fmt', store)) == [(2, 0, 0),
+                                                                (2, 1, 3)]
+    assert store.get(2, 1, 3) == b'2/1/3'
+    assert store.get_watermark(2) == 200
+
+    sync_map(client, 'map', 2, 'fmt', store)
+    assert client.afters == [None, 200]
+
+    # Without versions, the watermark advances to the time of the sync.
+    store = DirectoryTileStore(str(tmp_path / 'unversioned'))
+    unversioned = DiffClient(diff, versioned=False)
+    started = int(time.time() * 1000)
+    assert len(sync_map(unversioned, 'map', 2, 'fmt', store)) == 2
+    assert started <= store.get_watermark(2) <= time.time() * 1000
+    unversioned.downloads.clear()
+    assert sync_map(unversioned, 'map', 2, 'fmt', store) == []
+    assert unversioned.downloads == []
+
+
+def test_packed_tile_store_versions_rollback_and_compaction(tmp_path):
+    """ Tests that the packed store keeps versions, rolls back failed
+    transactions, compacts, and mirrors a map with sync_map. """
+
+    store = TileStore(str(tmp_path / 'store'), segment_bytes=64)
+    with store.transaction() as txn:
+        for version in (1, 2, 3):
+            txn.put(4, 1, 2, 'v{}'.format(version).encode() * 10, version)
+        txn.put(4, 0, 0, b'other', 5)
+        txn.set_watermark(4, 10)
+    assert store.get(4, 1, 2) == b'v3' * 10
+    assert store.get_version(4, 1, 2, 1) == b'v1' * 10
+    assert store.get_version(4, 1, 2, 4) is None
+    assert store.versions(4, 1, 2) == [1, 2, 3]
+    assert store.get(4, 9, 9) is None
+    assert store.stats()['segments'] > 1
+
+    with pytest.raises(IOError):
+        with store.transaction() as txn:
+            txn.put(4, 1, 2, b'lost', 4)
+            txn.set_watermark(4, 20)
+            raise IOError('connection reset')
+    assert store.versions(4, 1, 2) == [1, 2, 3]
+    assert store.get_watermark(4) == 10
+
+    assert isinstance(store.get(4, 1, 2), bytes)
+    assert isinstance(store.get_version(4, 1, 2, 1), bytes)
+    view = store.view(4, 1, 2)
+    assert isinstance(view, memoryview) and store.view(4, 1, 2, 2) == b'v2' * 10
+    with pytest.raises(ValueError):
+        store.compact(keep_versions=0)
+    reclaimed = store.compact()
+    assert reclaimed == 2 * 20
+    assert view == b'v3' * 10
+    assert store.versions(4, 1, 2) == [3]
+    store.close()
+
+    reopened = TileStore(str(tmp_path / 'store'))
+    assert reopened.get(4, 0, 0) == b'other'
+    assert reopened.get_watermark(4) == 10
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        mirror = TileStore(str(tmp_path / 'mirror'))
+        mock.update_tiles('mock-map', 'fmt', [(3, 1, 1), (3, 2, 2)], 1000)
+        assert sorted(client.sync_map('mock-map', 3, 'fmt',
+                                      mirror)) == [(3, 1, 1), (3, 2, 2)]
+        assert mirror.get(3, 2, 2) == mock.tile('mock-map', 'fmt', 3, 2, 2,
+                                                1000)
+        assert mirror.versions(3, 2, 2) == [1000]
+
+
+def test_time_travel_answers_from_local_version_index(tmp_path):
+    """ Tests that historical queries only hit the network for what the
+    version index doesn't hold. """
+
+    index = VersionIndex()
+    index.add_diff(5, [(5, 1, 1, 150)], before=200, after=100)
+    index.add_diff(5, [(5, 1, 1, 250), (5, 2, 2, 300)], before=300,
+                   after=200)
+    assert index.changes(5, 100, 300) == {(5, 1, 1): 250, (5, 2, 2): 300}
+    assert index.version_at(5, 1, 1, 260) == 250
+    assert index.version_at(5, 1, 1, 199) == 150
+    # Versions before 150 are unknown.
+    with pytest.raises(KeyError):
+        index.version_at(5, 1, 1, 120)
+    assert index.missing(5, 0, 400) == [(0, 100), (300, 400)]
+    index.add_diff(5, [(5, 1, 1, 50)], before=100)
+    assert index.version_at(5, 2, 2, 150) is None
+    assert index.version_at(5, 1, 1, 100) == 50
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        mock.update_tiles('mock-map', 'fmt', [(4, 3, 3), (4, 5, 5)], 1000)
+        mock.update_tiles('mock-map', 'fmt', [(4, 3, 3)], 2000)
+        history = TimeTravel(client, 'mock-map', 'fmt',
+                             TileStore(str(tmp_path)))
+
+        assert history.changes(4, 500, 1500) == {(4, 3, 3): 1000,
+                                                 (4, 5, 5): 1000}
+        requests = mock.requests
+        assert history.changes(4, 500, 1500) == {(4, 3, 3): 1000,
+                                                 (4, 5, 5): 1000}
+        assert history.changes(4, 1500, 2500) == {(4, 3, 3): 2000}
+        assert mock.requests == requests + 1
+        assert history.changes(4, 500, 2500) == {(4, 3, 3): 2000,
+                                                 (4, 5, 5): 1000}
+        assert mock.requests == requests + 1
+
+        assert history.version_at(4, 3, 3, 1700) == 1000
+        # Tiles have no version before the initial one, which is only
+        # looked up once.
+        with pytest.raises(VersionNotFound):
+            history.version_at(4, 5, 5, 0)
+        requests = mock.requests
+        with pytest.raises(VersionNotFound):
+            history.version_at(4, 5, 5, 0)
+        assert mock.requests == requests
+        assert history.tile_at(4, 3, 3, 1700) == mock.tile(
+            'mock-map', 'fmt', 4, 3, 3, 1000)
+        requests = mock.requests
+        assert history.tile_at(4, 3, 3, 1200) == mock.tile(
+            'mock-map', 'fmt', 4, 3, 3, 1000)
+        assert mock.requests == requests
+
+
+def test_decode_pipeline_decodes_in_processes():
+    """ Tests that downloaded tiles are decoded in a process pool, with
+    download errors passed through. """
+
+    # Workers aren't forked from the threads downloading tiles.
+    assert _process_context().get_start_method() != 'fork'
+
+    assert decompress(gzip.compress(b'tile')) == b'tile'
+    assert decompress(zlib.compress(b'tile')) == b'tile'
+    assert decompress(b'raw tile') == b'raw tile'
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        xyzs = [(5, x, 1) for x in range(30)] + [(1, 7, 7)]
+        results = dict(
+            client.decode_tiles('mock-map', xyzs, 'fmt', decode=zlib.crc32,
+                                processes=2))
+        assert len(results) == 31
+        assert results[(5, 4, 1)] == zlib.crc32(
+            mock.tile('mock-map', 'fmt', 5, 4, 1, 1))
+        assert isinstance(results[(1, 7, 7)], Exception)
+
+    def failing_results():
+        yield 'a', b'x'
+        raise IOError('connection reset')
+
+    pipeline = decode_pipeline(failing_results(), decode=len, processes=1)
+    assert next(pipeline) == ('a', 1)
+    with pytest.raises(IOError):
+        next(pipeline)
+
+
+def test_session_token_renewed_before_expiration():
+    """ Tests that a session token expiring within the refresh margin is
+    renewed before the request, without a 401 round trip. """
+
+    events = []
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               refresh_margin=300,
+                               hooks=[events.append])
+        token = client.token
+        assert client.list_maps() == mock.maps
+        assert client.token == token
+
+        client.expiration = time.time() + 100
+        del events[:]
+        assert client.list_maps() == mock.maps
+        assert client.token != token and token in mock.sessions
+        assert [(event.endpoint, event.status) for event in events] == [
+            ('/api/auth/v1/token/api/session', 200),
+            ('/api/maps/v1/maps', 200),
+        ]
+        assert client.expiration > time.time() + 300
+
+    # Sessions shorter than the margin are renewed halfway, not on every
+    # request.
+    with MockServer(session_lifetime=60) as mock:
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               refresh_margin=300,
+                               hooks=[events.append])
+        del events[:]
+        client.list_maps()
+        client.list_maps()
+        assert [event.endpoint for event in events
+               ] == ['/api/maps/v1/maps'] * 2
+
+
+def test_session_token_renewed_once_for_concurrent_requests():
+    """ Tests that concurrent requests share one renewal of a token about to
+    expire. """
+
+    events = []
+    with MockServer(latency=0.05) as mock:
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               coalesce=False,
+                               hooks=[events.append])
+        client.expiration = time.time() + 100
+        del events[:]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            assert list(executor.map(lambda _: client.list_maps(),
+                                     range(16))) == [mock.maps] * 16
+        logins = [
+            event for event in events
+            if event.endpoint == '/api/auth/v1/token/api/session'
+        ]
+        assert len(logins) == 1
+
+
+def test_rejected_token_retried_once_after_login(caplog):
+    """ Tests that a request rejected with a 401 is sent again once with a
+    new session token, and that failed renewals are logged. """
+
+    events = []
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url, hooks=[events.append])
+        mock.expire_sessions()
+        del events[:]
+        assert client.list_maps() == mock.maps
+        assert [(event.endpoint, event.status) for event in events] == [
+            ('/api/maps/v1/maps', 401),
+            ('/api/auth/v1/token/api/session', 200),
+            ('/api/maps/v1/maps', 200),
+        ]
+
+        refused = DeepmapClient('invalid', mock.url, lazy_login=True)
+        with caplog.at_level(logging.ERROR, logger='deepmap_sdk'):
+            response = refused._get(mock.url + '/api/maps/v1/maps')
+        assert response.status_code == 401
+        assert 'Could not renew the session token.' in caplog.messages
+
+
+def test_planner_tile_cover_and_split():
+    """ Tests the client side tile math and search query planning. """
+
+    assert planner.covering_tiles(0, -10, 10, -10, 10) == [(0, 0, 0)]
+    # One degree around the origin touches the four center tiles at level 1.
+    assert sorted(planner.covering_tiles(1, -1, 1, -1, 1)) == [(1, 0, 0),
+                                                                (1, 0, 1),
+                                                                (1, 1, 0),
+                                                                (1, 1, 1)]
+    lat1, lat2, lng1, lng2 = planner.tile_bbox(3, 2, 5)
+    assert planner.covering_tiles(3, lat1 + 1e-6, lat2 - 1e-6, lng1 + 1e-6,
+                                  lng2 - 1e-6) == [(3, 2, 5)]
+
+    # A triangle over the north west half of a 4x4 block.
+    lat1, lat2, lng1, lng2 = planner.tile_bbox(4, 8, 8)
+    _, north, west, _ = planner.tile_bbox(4, 8, 5)
+    _, _, _, east = planner.tile_bbox(4, 11, 8)
+    triangle = [(north, west), (north, east), (lat1 + 1e-6, west)]
+    assert len(planner.polygon_tiles(4, triangle)) == 10
+
+    region = planner.covering_tiles(10, 37.0, 37.5, -122.5, -121.5)
+    queries = planner.plan_search(region, max_tiles=16)
+    assert all(len(planner.covering_tiles(*query)) <= 25 for query in queries)
+    covered = set()
+    for query in queries:
+        covered.update(planner.covering_tiles(*query))
+    assert covered >= set(region)
+
+
+def test_tilemath_conversions():
+    """ Tests the vectorized tile math against known tiles. """
+    np = pytest.importorskip('numpy')
+
+    x, y = tilemath.lat_lng_to_tile(np.array([37.7749, -90.0, 0.0]),
+                                    np.array([-122.4194, 180.0, 0.0]), 12)
+    assert x.tolist() == [655, 4095, 2048]
+    assert y.tolist() == [1583, 4095, 2048]
+
+    lat1, lat2, lng1, lng2 = tilemath.tile_bounds(655, 1583, 12)
+    assert lat1 < 37.7749 < lat2 and lng1 < -122.4194 < lng2
+
+    assert tilemath.tile_to_quadkey(3, 5, 3) == '213'
+    quadkeys = tilemath.tile_to_quadkey(x, y, 12)
+    qx, qy, qz = tilemath.quadkey_to_tile(quadkeys)
+    assert qx.tolist() == x.tolist() and qy.tolist() == y.tolist()
+    assert qz == 12
+
+    cx, cy, cz = tilemath.children(x, y, 12)
+    px, py, pz = tilemath.parent(cx, cy, cz)
+    assert (px == x[:, np.newaxis]).all() and (py == y[:, np.newaxis]).all()
+    assert pz == 12
+
+    nx, ny, valid = tilemath.neighbors(0, 0, 1)
+    assert valid.sum() == 5
+    assert set(zip(nx[valid].tolist(), ny[valid].tolist())) == {(1, 0), (1, 1),
+                                                                (0, 1)}
+
+
+def test_retry_policy_and_token_bucket():
+    """ Tests which failures are retried and the rate limiter pacing. """
+
+    def response(status, retry_after=None):
+        result = Response()
+        result.status_code = status
+        if retry_after is not None:
+            result.headers['Retry-After'] = retry_after
+        return result
+
+    policy = RetryPolicy(retries=2, backoff=1.0)
+    assert policy.should_retry('GET', 0, response(503))
+    assert policy.should_retry('GET', 1)
+    assert not policy.should_retry('GET', 2, response(503))
+    assert not policy.should_retry('GET', 0, response(404))
+    assert not policy.should_retry('POST', 0, response(503))
+    assert policy.should_retry('POST', 0, response(429))
+    assert policy.delay(0, response(429, '7')) == 7
+    assert 0 <= policy.delay(1) <= 2
+
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_json_array_parser_across_chunks():
+    """ Tests that list items are parsed incrementally whatever the chunking. """
+
+    items = [{'id': i, 'name': 'tuile é {}'.format(i)} for i in range(20)]
+    items += [12345, -1.5e3, None, 'last']
+    document = json.dumps(items).encode()
+    for size in (1, 2, 5, 64, len(document)):
+        chunks = [document[i:i + size] for i in range(0, len(document), size)]
+        assert list(iter_json_array(chunks)) == items
+
+    parser = JSONArrayParser()
+    assert parser.feed(b'[{"id": 1}, {"id"') == [{'id': 1}]
+    assert parser.feed(b': 2}, 3') == [{'id': 2}]
+    assert parser.feed(b']') == [3]
+    parser.close()
+
+    assert list(iter_json_array([b' [ ', b' ] '])) == []
+    for invalid in ([b'{"error": "Unauthorized"}'], [b'[1, 2']):
+        with pytest.raises(ValueError):
+            list(iter_json_array(invalid))
+
+
+def test_precompiled_urls_match_module_functions():
+    """ Tests that endpoints.TileEndpoints builds the same urls as tiles. """
+    np = pytest.importorskip('numpy')
+
+    for server_url in ('https://api.deepmap.com', 'http://localhost:8080/x/'):
+        builder = TileEndpoints(server_url)
+        for map_format, before, after in (('fmt', None, None),
+                                          ('a b/c', 1561000000000, 0),
+                                          ('fmt', 0, 1500000000000.5)):
+            assert builder.download_tile('m1', 3, 4, 5, map_format, before,
+                                         after) == tiles.download_tile(
+                                             'm1', server_url, 3, 4, 5,
+                                             map_format, before, after)
+            assert builder.list_tiles_diff(
+                'm1', 3, map_format, before, after) == tiles.list_tiles_diff(
+                    'm1', server_url, 3, map_format, before, after)
+            assert builder.search_tiles(
+                'm1', 3, 37.1, 37.2, -122.5, -122.4, map_format, before,
+                after) == tiles.search_tiles('m1', server_url, 3, 37.1, 37.2,
+                                             -122.5, -122.4, map_format,
+                                             before, after)
+            xyzs = np.array([[3, 0, 0], [3, 7, 2]])
+            assert builder.download_tiles('m1', xyzs, map_format, before,
+                                          after) == [
+                                              tiles.download_tile(
+                                                  'm1', server_url, z, x, y,
+                                                  map_format, before, after)
+                                              for z, x, y in xyzs.tolist()
+                                          ]
+    # A zero bound is a bound.
+    assert 'before=0' in tiles.download_tile('m1', 'https://api.deepmap.com',
+                                             3, 4, 5, 'fmt', before=0)
+
+
+def test_metrics_aggregation_and_export():
+    """ Tests that request events are aggregated per endpoint and exported. """
+
+    assert endpoint_name('https://api.deepmap.com/api/tiles/v2/42/tile?z=1'
+                        ) == '/api/tiles/v2/{id}/tile'
+    # Ids that look like words are ids too.
+    assert endpoint_name('https://api.deepmap.com/api/users/v1/users/abc'
+                        ) == '/api/users/v1/users/{id}'
+    assert endpoint_name('https://api.deepmap.com/api/auth/v1/token/api/'
+                         'session') == '/api/auth/v1/token/api/session'
+
+    def event(status, latency, attempt=0, error=None):
+        return RequestEvent(method='GET',
+                            url='http://localhost/api/maps/v1/maps',
+                            endpoint='/api/maps/v1/maps',
+                            status=status,
+                            error=error,
+                            attempt=attempt,
+                            latency=latency,
+                            ttfb=latency / 2,
+                            request_bytes=0,
+                            response_bytes=100 if status else None)
+
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics(event(503, 0.05))
+    metrics(event(200, 0.5, attempt=1))
+    metrics(event(None, 2.0, attempt=2, error='ConnectionError'))
+
+    stats = metrics.snapshot()['GET /api/maps/v1/maps']
+    assert stats['count'] == 3
+    assert stats['latency_histogram'] == [[0.1, 1], [1.0, 2], ['+Inf', 3]]
+    assert stats['retries'] == 2
+    assert stats['errors'] == 2
+    assert stats['response_bytes'] == 200
+    assert stats['statuses'] == {'503': 1, '200': 1, 'ConnectionError': 1}
+
+    text = metrics.to_prometheus()
+    assert ('deepmap_sdk_request_duration_seconds_bucket{method="GET",'
+            'endpoint="/api/maps/v1/maps",le="1.0"} 2') in text
+    assert 'deepmap_sdk_errors_total{method="GET",' in text
+
+
+def test_vehicle_session_pool_refreshes_in_expiration_order():
+    """ Tests bulk creation of vehicle tokens and sessions, and renewal. """
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        pool = VehicleSessionPool(client, max_workers=4)
+        vehicle_ids = ['vehicle-{}'.format(i) for i in range(20)]
+        assert pool.create_tokens(vehicle_ids) == {}
+        assert len(pool) == 20
+        assert pool.create_sessions() == {}
+        tokens = {
+            vehicle_id: pool.get(vehicle_id) for vehicle_id in vehicle_ids
+        }
+        assert set(tokens.values()) <= mock.sessions
+        assert pool.get('vehicle-3') == tokens['vehicle-3']
+        assert 0 < pool.next_refresh() <= 3600 - pool.refresh_margin
+
+        assert pool.refresh_due() == {}
+        assert pool.get('vehicle-3') == tokens['vehicle-3']
+        assert pool.refresh_due(now=time.time() + 3600) == {}
+        assert all(pool.get(vehicle_id) != tokens[vehicle_id]
+                   for vehicle_id in vehicle_ids)
+
+        pool.add_vehicle('revoked', 'not-a-token')
+        errors = pool.create_sessions(['revoked', 'vehicle-0'])
+        assert list(errors) == ['revoked']
+        assert isinstance(errors['revoked'], SessionError)
+
+        with pool:
+            pool.remove_vehicle('revoked')
+            assert pool.headers('vehicle-0')['Authorization'].startswith(
+                'Bearer ')
+
+    # Concurrent callers finding a session stale renew it once.
+    with MockServer(latency=0.1) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        pool = VehicleSessionPool(client)
+        pool.create_tokens(['vehicle-0'])
+        stale = pool.get_session('vehicle-0')
+        pool._sessions['vehicle-0'] = stale._replace(expiration=time.time())
+        sessions = len(mock.sessions)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            tokens = set(
+                executor.map(lambda _: pool.get('vehicle-0'), range(8)))
+        assert len(tokens) == 1 and stale.token not in tokens
+        assert len(mock.sessions) == sessions + 1
+
+
+def test_concurrent_identical_requests_are_coalesced():
+    """ Tests that concurrent identical requests share one HTTP request. """
+
+    flights = SingleFlight()
+    with pytest.raises(ZeroDivisionError):
+        flights.do('key', lambda: 1 / 0)
+    assert flights.do('key', lambda: 42) == 42
+
+    class Interrupted(BaseException):
+        pass
+
+    release = threading.Event()
+
+    def interrupted():
+        release.wait()
+        raise Interrupted()
+
+    calls = flights.calls
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, 'key', interrupted)
+        while flights.calls == calls:
+            time.sleep(0.01)
+        follower = executor.submit(flights.do, 'key', lambda: 42)
+        while flights.shared < 1:
+            time.sleep(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(Interrupted):
+                future.result()
+
+    with MockServer(latency=0.2) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        requests = mock.requests
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            tile_results = list(
+                executor.map(
+                    lambda _: client.download_tile('mock-map', 4, 1, 1, 'fmt'),
+                    range(8)))
+            map_lists = list(
+                executor.map(lambda _: client.list_maps(), range(8)))
+        assert tile_results == [mock.tile('mock-map', 'fmt', 4, 1, 1, 1)] * 8
+        assert map_lists == [mock.maps] * 8
+        # Every caller gets its own decoded response.
+        assert len({id(map_list) for map_list in map_lists}) == 8
+        assert mock.requests == requests + 2
+        assert client.flights.shared == 14
+
+        uncoalesced = DeepmapClient(mock.api_token, mock.url, coalesce=False)
+        requests = mock.requests
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: uncoalesced.list_maps(), range(4)))
+        assert mock.requests == requests + 4
+
+
+def test_client_over_http2_transport():
+    """ Tests the client end to end over HTTP/2 against the mock server. """
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+    from deepmap_sdk.mock_server_http2 import HTTP2MockServer
+
+    with HTTP2MockServer() as mock:
+        transport = HTTP2Transport(http1=False)
+        client = DeepmapClient(mock.api_token, mock.url, transport=transport)
+        assert [m['id'] for m in client.iter_maps()] == ['mock-map']
+
+        xyzs = [(6, x, 7) for x in range(40)]
+        results = dict(client.download_tiles('mock-map', xyzs, 'fmt'))
+        assert results[(6, 3, 7)] == mock.tile('mock-map', 'fmt', 6, 3, 7, 1)
+        assert client.download_tile('mock-map', 1, 5, 5, 'fmt') == {
+            'error': 'Tile not found'
+        }
+
+        token = client.token
+        mock.expire_sessions()
+        assert client.list_maps() == mock.maps
+        assert client.token != token
+        transport.close()
+
+
+def test_lazy_login_and_session_cache(tmp_path):
+    """ Tests that a lazy client logs in on its first request, and that a
+    cached session token is reused without logging in. """
+
+    session_cache = str(tmp_path / 'session.json')
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               lazy_login=True,
+                               session_cache=session_cache)
+        assert mock.requests == 0 and client.is_exp()
+        assert client.list_maps() == mock.maps
+        assert mock.requests == 2
+        with open(session_cache) as cache_file:
+            assert mock.api_token not in cache_file.read()
+
+        restored = DeepmapClient(mock.api_token,
+                                 mock.url,
+                                 session_cache=session_cache)
+        assert restored.token == client.token
+        assert restored.list_maps() == mock.maps
+        assert mock.requests == 3
+        # A restored session sends JSON bodies with the same headers.
+        assert restored.session.headers['Content-Type'] == 'application/json'
+        assert restored.invite_user('restored@deepmap.ai')['email'] == (
+            'restored@deepmap.ai')
+        assert mock.requests == 4
+
+        # Sessions of other access tokens or servers aren't reused.
+        other = DeepmapClient(mock.api_token,
+                              mock.url + '/',
+                              session_cache=session_cache)
+        assert mock.requests == 5 and other.token is not None
+
+        # Malformed cached sessions are ignored.
+        with open(session_cache) as cache_file:
+            valid = json.load(cache_file)
+        for cached in (dict(valid, token=None), dict(valid, token=42),
+                       dict(valid, expiration=True), [valid]):
+            with open(session_cache, 'w') as cache_file:
+                json.dump(cached, cache_file)
+            requests = mock.requests
+            DeepmapClient(mock.api_token, mock.url + '/',
+                          session_cache=session_cache)
+            assert mock.requests == requests + 1
+
+        # Nor sessions expiring within the refresh margin.
+        with open(session_cache) as cache_file:
+            cached = json.load(cache_file)
+        cached['expiration'] = time.time() + 60
+        with open(session_cache, 'w') as cache_file:
+            json.dump(cached, cache_file)
+        requests = mock.requests
+        DeepmapClient(mock.api_token, mock.url + '/',
+                      session_cache=session_cache)
+        assert mock.requests == requests + 1
+
+
+def test_bulk_user_administration():
+    """ Tests bulk invites, edits and deletions against the mock server. """
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        emails = ['operator{}@deepmap.ai'.format(i) for i in range(20)]
+        admins = [(email, 'True') for email in emails[10:]]
+        invited = client.invite_users(emails[:10] + admins, max_workers=4)
+        assert len(invited.succeeded) == 20 and not invited.failed
+        assert [result.user['email'] for result in invited] == emails
+        admin = [result.user['admin'] for result in invited]
+        assert admin == [False] * 10 + [True] * 10
+        # Results keep the items as given.
+        assert [result.item for result in invited] == emails[:10] + admins
+        user_ids = [result.user['id'] for result in invited]
+
+        with pytest.raises(ValueError):
+            client.edit_users([(user_ids[0], 'new@deepmap.ai', ''),
+                               (user_ids[1], '', '')])
+        assert mock.users[user_ids[0]]['email'] == emails[0]
+
+        edited = client.edit_users([(user_id, '', 'True')
+                                    for user_id in user_ids[:5]] +
+                                   [('missing', 'new@deepmap.ai', '')])
+        assert all(mock.users[user_id]['admin'] for user_id in user_ids[:5])
+        failure, = edited.failed
+        assert failure.item == ('missing', 'new@deepmap.ai', '')
+        assert isinstance(failure.error, user_admin.UserAdminError)
+        assert failure.error.status_code == 404
+        summary = edited.summary()
+        assert (summary['total'], summary['succeeded'],
+                summary['failed']) == (6, 5, 1)
+        with pytest.raises(user_admin.UserAdminError):
+            edited.raise_for_errors()
+
+        deleted = client.delete_users(user_ids + ['missing'])
+        assert len(deleted.succeeded) == 20 and len(deleted.failed) == 1
+        assert not set(user_ids) & set(mock.users)
+
+        # Any 2xx response is a success.
+        def created(method, url, **kwargs):
+            response = client._request(method, url, **kwargs)
+            response.status_code = 201
+            return response
+
+        invite = ['created@deepmap.ai', '']
+        invited = user_admin.invite_users(created, mock.url, [invite], 1)
+        assert not invited.failed and invited.results[0].item is invite
+
+
+def test_user_and_token_changes_are_logged(capsys, caplog):
+    """ Tests that single user and token changes log instead of printing. """
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        with caplog.at_level(logging.INFO, logger='deepmap_sdk'):
+            user_id = client.invite_user('fake@deepmap.ai')['id']
+            client.edit_user(user_id, admin='True')
+            client.delete_user(user_id)
+            client.delete_user(user_id)
+            client.delete_api_token('missing')
+    assert capsys.readouterr().out == ''
+    assert [record.getMessage() for record in caplog.records] == [
+        'User edited.', 'User deleted.', 'Could not delete user.',
+        'Could not delete API token.'
+    ]
+
+
+def test_route_prefetch_downloads_nearest_tiles_first(tmp_path):
+    """ Tests that the tiles along a route are cached in route order. """
+
+    route = [(37.77, -122.42), (37.80, -122.40), (37.85, -122.27)]
+    route_tiles = planner.route_tiles(14, route, 200)
+    distances = [distance for _, distance in route_tiles]
+    assert distances == sorted(distances) and distances[0] == 0
+    assert len(route_tiles) == len(set(xyz for xyz, _ in route_tiles))
+    assert route_tiles[0][0] == (14, 2620, 6333)
+
+    requested = []
+
+    def hook(event):
+        match = re.search(r'z=(\d+)&x=(\d+)&y=(\d+)', event.url)
+        if match:
+            requested.append(tuple(int(part) for part in match.groups()))
+
+    with MockServer() as mock:
+        cache = tile_cache.TileCache(str(tmp_path))
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               cache=cache,
+                               hooks=[hook])
+        with client.prefetch_route('mock-map',
+                                   route,
+                                   200, [13, 14],
+                                   'fmt',
+                                   max_workers=1) as prefetcher:
+            assert prefetcher.wait(30)
+            progress = prefetcher.progress()
+            expected = planner.route_tiles(13, route, 200) + route_tiles
+            expected.sort(key=lambda item: (item[1], item[0]))
+            assert requested == [xyz for xyz, _ in expected]
+            assert progress.total == progress.done == len(expected)
+            assert progress.eta == 0 and progress.distance is None
+
+            # Extending the route resumes the finished prefetch.
+            assert prefetcher.add_route(route[-1:] + [(37.86, -122.25)], 200,
+                                        [14]) > 0
+            assert prefetcher.wait(30)
+            assert prefetcher.progress().done == len(requested)
+        for z, x, y in requested:
+            key = tile_cache.tile_key('mock-map', 'fmt', z, x, y)
+            assert cache.get(key) == mock.tile('mock-map', 'fmt', z, x, y, 1)
+
+
+def test_pyramid_fetch_only_descends_into_changed_tiles():
+    """ Tests that a pyramid fetch skips the children of unchanged tiles. """
+
+    bbox = (37.70, 37.80, -122.50, -122.40)
+    levels = pyramid.pyramid_tiles(12, 15, *bbox)
+    assert sorted(levels) == [12, 13, 14, 15]
+    for z in range(13, 16):
+        parents = {(z - 1, x >> 1, y >> 1) for _, x, y in levels[z]}
+        assert parents == levels[z - 1]
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        versions, results = client.fetch_pyramid('mock-map', 12, 15, *bbox,
+                                                 'fmt')
+        assert set(versions) == set().union(*levels.values())
+        assert len(dict(results)) == len(versions)
+
+        # A tile changes along with its ancestors, as they cover it.
+        _, x, y = sorted(levels[15])[0]
+        lineage = [(z, x >> (15 - z), y >> (15 - z)) for z in range(12, 16)]
+        synced = mock.initial_version + 1
+        version = mock.update_tiles('mock-map', 'fmt', lineage,
+                                    version=synced + 1)
+        mock.update_tiles('mock-map', 'fmt', [(12, 0, 0)], version=synced + 1)
+
+        requests = mock.requests
+        versions, results = client.fetch_pyramid('mock-map',
+                                                 12,
+                                                 15,
+                                                 *bbox,
+                                                 'fmt',
+                                                 after=synced)
+        results = dict(results)
+        assert versions == dict.fromkeys(lineage, version)
+        assert results[lineage[-1]] == mock.tile('mock-map', 'fmt',
+                                                 *lineage[-1], version)
+        # The searches of the top level, one search per level below it and
+        # one download per changed tile.
+        top = planner.plan_search(levels[12], planner.DEFAULT_MAX_TILES)
+        assert mock.requests - requests == len(top) + 3 + 4
+
+        versions, results = client.fetch_pyramid('mock-map',
+                                                 12,
+                                                 15,
+                                                 *bbox,
+                                                 'fmt',
+                                                 after=version + 1)
+        assert versions == {} and dict(results) == {}
+
+
+def test_accept_encoding_checks_the_transport_decoders(monkeypatch):
+    """ Tests that the codings of other transports are checked against
+    their own decoders rather than urllib3's. """
+    httpx_decoders = pytest.importorskip('httpx._decoders')
+
+    monkeypatch.setattr(urllib3.response, 'brotli', None, raising=False)
+    monkeypatch.setitem(httpx_decoders.SUPPORTED_DECODERS, 'br', object)
+    assert 'br' not in decoding.supported_encodings()
+    transport = HTTP2Transport()
+    try:
+        assert 'br' in decoding.supported_encodings(transport)
+        assert decoding.accept_encoding(['br', 'gzip'],
+                                        transport) == 'br, gzip'
+    finally:
+        transport.close()
+
+
+def test_compressed_responses_and_json_backends(monkeypatch):
+    """ Tests content encoding negotiation and the JSON backends against a
+    mock server compressing its responses. """
+    pytest.importorskip('orjson')
+
+    assert decoding.accept_encoding(['gzip']) == 'gzip'
+    assert decoding.accept_encoding('identity') == 'identity'
+    with pytest.raises(ValueError):
+        decoding.accept_encoding(['compress'])
+    # Codings urllib3 can't decode aren't accepted, even if their packages
+    # are installed.
+    monkeypatch.setattr(urllib3.response, 'HAS_ZSTD', False, raising=False)
+    monkeypatch.setattr(urllib3.response, 'brotli', None, raising=False)
+    assert decoding.supported_encodings() == ['gzip', 'deflate']
+    with pytest.raises(ValueError):
+        decoding.accept_encoding(['zstd'])
+    monkeypatch.undo()
+    with pytest.raises(ValueError):
+        decoding.json_loads('yaml')
+
+    xyzs = [(12, x, y) for x in range(20) for y in range(20)]
+    with MockServer(content_encodings=('gzip', 'deflate')) as mock:
+        mock.update_tiles('mock-map', 'fmt', xyzs, version=2)
+        sizes = {}
+        for encoding, backend in (('identity', 'json'), ('gzip', 'json'),
+                                  ('deflate', 'orjson')):
+            client = DeepmapClient(mock.api_token,
+                                   mock.url,
+                                   accept_encoding=encoding,
+                                   json_backend=backend)
+            sent = mock.bytes_sent
+            diff = client.list_tiles_diff('mock-map', 12, 'fmt')
+            sizes[encoding] = mock.bytes_sent - sent
+            assert len(diff) == len(xyzs) and diff[0]['version'] == 2
+            assert list(client.iter_maps()) == mock.maps
+            tile = client.download_tile('mock-map', 12, 1, 2, 'fmt')
+            assert tile == mock.tile('mock-map', 'fmt', 12, 1, 2, 2)
+        assert sizes['gzip'] < sizes['identity'] / 4
+        assert sizes['deflate'] < sizes['identity'] / 4
+
+
+def test_listings_as_records_and_tables():
+    """ Tests the typed records and the columnar table of listings. """
+
+    item = {'id': '7', 'vehicle_id': 'car', 'description': None, 'seats': 4}
+    token = records.VehicleToken.from_dict(item)
+    assert token == ('7', 'car', None, {'seats': 4})
+    assert token.to_dict() == item and not hasattr(token, '__dict__')
+
+    document = json.dumps([{
+        'id': str(i),
+        'vehicle_id': 'vehicle-{}'.format(i),
+        'description': 'fleet vehicle',
+        'active': i % 2 == 0,
+    } for i in range(5000)])
+    tracemalloc.start()
+    items = json.loads(document)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    table = records.RecordTable(records.VehicleToken, json.loads(document))
+    table_bytes = tracemalloc.get_traced_memory()[0] - dict_bytes
+    tracemalloc.stop()
+    assert table_bytes < dict_bytes / 3
+    assert len(table) == 5000
+    assert table[-1] == records.VehicleToken.from_dict(items[-1])
+    assert [token.to_dict() for token in table] == items
+    assert table.column('extra')[:2] == [{'active': True}, {'active': False}]
+
+    with MockServer() as mock:
+        client = DeepmapClient(mock.api_token,
+                               mock.url,
+                               record_format='records')
+        map_list = client.list_maps()
+        assert map_list == [records.Map('mock-map', 'Mock map', None)]
+        assert list(client.iter_maps()) == map_list
+        user = client.list_users()[0]
+        assert isinstance(user, records.User) and user.admin
+        assert client.get_user(user.id) == user
+        assert client.get_user('missing') == {'error': 'Not found'}
+
+        client.record_format = 'table'
+        users = client.list_users()
+        assert isinstance(users, records.RecordTable)
+        assert users[0] == user and users.column('email') == [user.email]
+
+
+def test_client_against_mock_server(tmp_path):
+    """ Tests the client end to end against the local mock server. """
+
+    with MockServer(error_rate=0.1, distribution_size=1024**2) as mock:
+        client = DeepmapClient(mock.api_token, mock.url)
+        assert [m['id'] for m in client.iter_maps()] == ['mock-map']
+
+        xyzs = [(6, x, 7) for x in range(40)]
+        results = dict(client.download_tiles('mock-map', xyzs, 'fmt'))
+        assert results[(6, 3, 7)] == mock.tile('mock-map', 'fmt', 6, 3, 7, 1)
+        assert all(isinstance(tile, bytes) for tile in results.values())
+
+        # Failed invites aren't retried, as they may have been processed.
+        mock.error_rate = 0
+        mock.expire_sessions()
+        invited = client.invite_user('fake@deepmap.ai')
+        assert client.get_user(invited['id'])['email'] == 'fake@deepmap.ai'
+
+        checksum = hashlib.sha256(mock.distribution('mock-map')).hexdigest()
+        dest_path = str(tmp_path / 'distribution')
+        client.download_distribution('mock-map',
+                                     dest_path,
+                                     segments=3,
+                                     checksum=checksum)
+        with open(dest_path, 'rb') as distribution:
+            assert distribution.read() == mock.distribution('mock-map')
@@ -0,0 +1,202 @@
+""" Persistent on-disk cache of downloaded tiles. """
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Default upper bound on the total size of the cached tile blobs.
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def tile_key(map_id, map_format, z, x, y, before=None, after=None):
+    """ Returns the cache key of a tile of the tiles v2 API.
+
+    The before and after timestamps pin the version of the tile, so requests
+    for different time ranges are cached separately.
+    """
+    return '/'.join(
+        str(part) for part in ('tile', map_id, map_format, z, x, y, before or
+                               '', after or ''))
+
+
+def feature_tile_key(tile_id):
+    """ Returns the cache key of a feature tile. """
+    return 'feature_tile/{}'.format(tile_id)
+
+
+class TileCache:
+    """ A size-bounded, least recently used cache of tile blobs on disk.
+
+    Blobs are stored one per file under directory, next to an SQLite index
+    holding their size, HTTP validators (ETag and Last-Modified) and last use
+    time. The cache is safe to share between threads.
+
+    Counters, as returned by stats():
+        hits: Tiles served from the cache, including after a revalidation.
+        misses: Tiles whose body had to be downloaded.
+        revalidations: Hits confirmed by a 304 Not Modified response.
+        evictions: Tiles removed to stay under max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(_SCHEMA)
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used)')
+        self.total_bytes = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM tiles').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _read(self, key):
+        """ Returns the blob of key and marks it used, or None if absent. """
+        try:
+            with open(self._path(key), 'rb') as blob:
+                data = blob.read()
+        except FileNotFoundError:
+            self._remove(key)
+            return None
+        with self._lock:
+            self._db.execute('UPDATE tiles SET last_used = ? WHERE key = ?',
+                             (time.time(), key))
+        return data
+
+    def _remove(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        """ Removes key from the index and its blob. Called with the lock
+        held, so that a concurrent put of key isn't deleted with it. """
+        row = self._db.execute('SELECT size FROM tiles WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            return
+        self._db.execute('DELETE FROM tiles WHERE key = ?', (key,))
+        self.total_bytes -= row[0]
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM tiles WHERE key = ?',
+                                    (key,)).fetchone() is not None
+
+    def get(self, key):
+        """ Returns the cached blob of key, or None if it isn't cached. """
+        data = self._read(key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+        return data
+
+    def validators(self, key):
+        """ Returns the conditional request headers to revalidate key, or an
+        empty dictionary if it isn't cached. """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified FROM tiles WHERE key = ?',
+                (key,)).fetchone()
+        headers = {}
+        if row is not None:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def revalidated(self, key):
+        """ Returns the cached blob of key after the server confirmed it is
+        unchanged, or None if it was evicted meanwhile. """
+        data = self.get(key)
+        if data is not None:
+            with self._lock:
+                self.revalidations += 1
+        return data
+
+    def put(self, key, data, etag=None, last_modified=None):
+        """ Stores the downloaded blob of key, evicting the least recently
+        used tiles if the cache grows over max_bytes. """
+        with self._lock:
+            self.misses += 1
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as blob:
+            blob.write(data)
+
+        with self._lock:
+            os.replace(temp_path, path)
+            row = self._db.execute('SELECT size FROM tiles WHERE key = ?',
+                                   (key,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)',
+                (key, len(data), etag, last_modified, time.time()))
+            self.total_bytes += len(data) - (row[0] if row else 0)
+            victims = []
+            if self.total_bytes > self.max_bytes:
+                excess = self.total_bytes - self.max_bytes
+                for victim, size in self._db.execute(
+                        'SELECT key, size FROM tiles WHERE key != ? '
+                        'ORDER BY last_used', (key,)):
+                    victims.append(victim)
+                    excess -= size
+                    if excess <= 0:
+                        break
+            for victim in victims:
+                self._delete(victim)
+            self.evictions += len(victims)
+
+    def clear(self):
+        """ Removes every tile from the cache. """
+        with self._lock:
+            keys = [row[0] for row in self._db.execute('SELECT key FROM tiles')]
+        for key in keys:
+            self._remove(key)
+
+    def stats(self):
+        """ Returns a dictionary of the cache counters and current size. """
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self.total_bytes,
+        }
+
+    def close(self):
+        """ Closes the index. """
+        self._db.close()
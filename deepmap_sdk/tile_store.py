@@ -0,0 +1,394 @@
+""" A local tile store packing tiles into large memory-mapped segment files. """
+
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+
+# Size above which the segment being appended to is closed and a new one
+# started.
+DEFAULT_SEGMENT_BYTES = 256 * 1024**2
+
+_INDEX_FILE = 'index'
+_INDEX_MAGIC = b'DMTSIDX1'
+_HEADER = struct.Struct('<8sI')
+# z, x, y, version, segment, offset, size.
+_RECORD = struct.Struct('<BIIqIQI')
+_SEGMENT_NAME = re.compile(r'^(\d{6})\.seg$')
+_MAX_VERSION = 2**63 - 1
+
+
+def _segment_name(segment):
+    return '{:06d}.seg'.format(segment)
+
+
+class _Index:
+    """ An immutable snapshot of the index: the sorted (z, x, y, version)
+    keys, the (segment, offset, size) location of each key, and the sync
+    watermarks. """
+
+    def __init__(self, keys, locations, watermarks):
+        self.keys = keys
+        self.locations = locations
+        self.watermarks = watermarks
+
+    def latest(self, z, x, y):
+        """ Returns the position of the latest version of (z, x, y), or None. """
+        position = bisect.bisect_right(self.keys, (z, x, y, _MAX_VERSION)) - 1
+        if position >= 0 and self.keys[position][:3] == (z, x, y):
+            return position
+        return None
+
+    def versions(self, z, x, y):
+        """ Returns the range of positions of every version of (z, x, y). """
+        start = bisect.bisect_left(self.keys, (z, x, y, -_MAX_VERSION))
+        end = bisect.bisect_right(self.keys, (z, x, y, _MAX_VERSION), start)
+        return range(start, end)
+
+
+class TileStore:
+    """ A local mirror of the tiles of one map and format, packed into
+    append-only segment files under root, with a sorted (z, x, y, version)
+    index.
+
+    Tiles are read back as bytes, or with view as memoryview slices of the
+    memory-mapped segments, without copying. Every version put is kept until
+    compact() drops the superseded ones. Changes are made through
+    transaction(): tiles are appended to the segments, but only become
+    visible, together with the sync watermarks, when the new index replaces
+    the old one once the transaction succeeds. A failed transaction leaves
+    the store unchanged.
+
+    Any number of threads and processes may read the store, while a single
+    process writes to it. Readers in other processes see the changes after
+    calling reload().
+    """
+
+    def __init__(self, root, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        os.makedirs(root, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._maps_lock = threading.Lock()
+        self._maps = {}
+        self._index_stat = None
+        self._index = _Index([], [], {})
+        self.reload()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _segments(self):
+        """ Returns the sorted ids of the segment files. """
+        segments = []
+        for name in os.listdir(self.root):
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def reload(self):
+        """ Reads the index again if another process changed it. """
+        try:
+            stat = os.stat(self._path(_INDEX_FILE))
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._index_stat:
+            return
+        with open(self._path(_INDEX_FILE), 'rb') as index_file:
+            data = index_file.read()
+        magic, meta_size = _HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC:
+            raise ValueError('Not a tile store index: {}'.format(self.root))
+        meta = json.loads(data[_HEADER.size:_HEADER.size + meta_size])
+        keys = []
+        locations = []
+        for z, x, y, version, segment, offset, size in _RECORD.iter_unpack(
+                data[_HEADER.size + meta_size:]):
+            keys.append((z, x, y, version))
+            locations.append((segment, offset, size))
+        watermarks = {int(z): ts for z, ts in meta['watermarks'].items()}
+        self._index = _Index(keys, locations, watermarks)
+        self._index_stat = signature
+
+    def _write_index(self, index):
+        """ Atomically replaces the index file. """
+        meta = json.dumps({'watermarks': index.watermarks}).encode()
+        staged = self._path(_INDEX_FILE + '.tmp')
+        with open(staged, 'wb') as index_file:
+            index_file.write(_HEADER.pack(_INDEX_MAGIC, len(meta)))
+            index_file.write(meta)
+            index_file.write(b''.join(
+                _RECORD.pack(*key, *location)
+                for key, location in zip(index.keys, index.locations)))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(staged, self._path(_INDEX_FILE))
+        stat = os.stat(self._path(_INDEX_FILE))
+        self._index_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._index = index
+
+    def _view(self, segment, offset, size):
+        """ Returns a memoryview of size bytes at offset in segment. """
+        if size == 0:
+            return memoryview(b'')
+        with self._maps_lock:
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < offset + size:
+                # The segment grew since it was mapped. Views of the previous
+                # mapping stay valid, it is unmapped once they are released.
+                with open(self._path(_segment_name(segment)), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = mapped
+        return memoryview(mapped)[offset:offset + size]
+
+    def _read(self, lookup):
+        """ Returns the view of the location found by lookup(index), or
+        None. Retries with a fresh index if a concurrent compaction removed
+        the segment of the location. """
+        while True:
+            index = self._index
+            position = lookup(index)
+            if position is None:
+                return None
+            try:
+                return self._view(*index.locations[position])
+            except FileNotFoundError:
+                if self._index is index:
+                    raise
+
+    def get(self, z, x, y):
+        """ Returns the latest stored version of the tile at (z, x, y), or
+        None if absent. """
+        view = self.view(z, x, y)
+        return None if view is None else bytes(view)
+
+    def get_version(self, z, x, y, version):
+        """ Returns the given version of the tile at (z, x, y), or None if it
+        isn't stored. """
+        view = self.view(z, x, y, version)
+        return None if view is None else bytes(view)
+
+    def view(self, z, x, y, version=None):
+        """ Returns a read-only memoryview of a version of the tile at
+        (z, x, y), by default the latest, or None if it isn't stored. The
+        view maps the segment file, so reading it copies nothing, and stays
+        valid after a compaction. """
+        if version is None:
+            return self._read(lambda index: index.latest(z, x, y))
+
+        def lookup(index):
+            position = bisect.bisect_left(index.keys, (z, x, y, version))
+            if (position < len(index.keys) and
+                    index.keys[position] == (z, x, y, version)):
+                return position
+            return None
+
+        return self._read(lookup)
+
+    def versions(self, z, x, y):
+        """ Returns the sorted list of stored versions of the tile at
+        (z, x, y). """
+        index = self._index
+        return [index.keys[position][3] for position in index.versions(z, x, y)]
+
+    def __len__(self):
+        """ Returns the number of stored tile versions. """
+        return len(self._index.keys)
+
+    def __iter__(self):
+        """ Iterates over the (z, x, y, version) keys of the stored tiles, in
+        order. """
+        return iter(self._index.keys)
+
+    def watermarks(self):
+        """ Returns a dictionary of zoom level to the millisecond timestamp
+        the level was last synced up to. """
+        return dict(self._index.watermarks)
+
+    def get_watermark(self, z):
+        """ Returns the timestamp zoom level z was last synced up to, or None
+        if it was never synced. """
+        return self._index.watermarks.get(z)
+
+    def transaction(self):
+        """ Returns a context manager appending tiles and staging watermark
+        updates, made visible together when the block exits without error.
+        Transactions are serialized. """
+        return _PackedTransaction(self)
+
+    def stats(self):
+        """ Returns a dictionary of the number of tile versions and segments,
+        the bytes of segment files, and the bytes of the latest versions. """
+        index = self._index
+        live = 0
+        for position in range(len(index.keys)):
+            if (position + 1 == len(index.keys) or
+                    index.keys[position + 1][:3] != index.keys[position][:3]):
+                live += index.locations[position][2]
+        segments = self._segments()
+        return {
+            'versions': len(index.keys),
+            'segments': len(segments),
+            'segment_bytes': sum(
+                os.path.getsize(self._path(_segment_name(segment)))
+                for segment in segments),
+            'live_bytes': live,
+        }
+
+    def compact(self, keep_versions=1):
+        """ Rewrites the tiles into new segments, dropping all but the latest
+        keep_versions versions of each tile, and the bytes of failed
+        transactions. Returns the number of bytes reclaimed.
+
+        Readers of this store keep working during the compaction. Readers in
+        other processes must reload() before the removed segments are
+        closed, which is immediately on Windows.
+
+        Raises:
+            ValueError: If keep_versions is less than 1.
+        """
+        if keep_versions < 1:
+            raise ValueError(
+                'keep_versions must be at least 1, got {}'.format(keep_versions))
+        with self._write_lock:
+            index = self._index
+            old_segments = self._segments()
+            old_bytes = sum(
+                os.path.getsize(self._path(_segment_name(segment)))
+                for segment in old_segments)
+            kept = []
+            for position, key in enumerate(index.keys):
+                newer = index.keys[position + 1:position + 1 + keep_versions]
+                if (len(newer) < keep_versions or
+                        newer[-1][:3] != key[:3]):
+                    kept.append(position)
+
+            writer = _SegmentWriter(self, (old_segments or [0])[-1] + 1,
+                                    append=False)
+            try:
+                locations = []
+                for position in kept:
+                    locations.append(
+                        writer.append(self._view(*index.locations[position])))
+                writer.sync()
+            finally:
+                writer.close()
+            self._write_index(
+                _Index([index.keys[position] for position in kept], locations,
+                       index.watermarks))
+
+            with self._maps_lock:
+                for segment in old_segments:
+                    self._maps.pop(segment, None)
+            for segment in old_segments:
+                os.remove(self._path(_segment_name(segment)))
+            return old_bytes - writer.written
+
+    def close(self):
+        """ Drops the memory maps. Views still referenced stay valid. """
+        with self._maps_lock:
+            self._maps = {}
+
+
+class _SegmentWriter:
+    """ Appends blobs to the segments of a TileStore, starting a new segment
+    when the current one exceeds the store's segment size. """
+
+    def __init__(self, store, segment, append=True):
+        self.store = store
+        self.segment = segment
+        self.written = 0
+        self.file = None
+        self._open(append)
+        # Length of the segment before this writer, to roll back to.
+        self.start = (self.segment, self.file.tell())
+
+    def _open(self, append):
+        path = self.store._path(_segment_name(self.segment))
+        self.file = open(path, 'ab' if append else 'xb')
+
+    def append(self, data):
+        """ Appends data and returns its (segment, offset, size) location. """
+        offset = self.file.tell()
+        if offset and offset + len(data) > self.store.segment_bytes:
+            self.sync()
+            self.file.close()
+            self.segment += 1
+            self._open(append=False)
+            offset = 0
+        self.file.write(data)
+        self.written += len(data)
+        return self.segment, offset, len(data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def rollback(self):
+        """ Truncates the segments back to their length before the writer. """
+        self.file.close()
+        segment, length = self.start
+        os.truncate(self.store._path(_segment_name(segment)), length)
+        for created in range(segment + 1, self.segment + 1):
+            os.remove(self.store._path(_segment_name(created)))
+
+    def close(self):
+        self.file.close()
+
+
+class _PackedTransaction:
+    """ Staged changes to a TileStore. """
+
+    def __init__(self, store):
+        self.store = store
+        self.writer = None
+        self.tiles = {}
+        self.watermarks = {}
+
+    def __enter__(self):
+        self.store._write_lock.acquire()
+        try:
+            segments = self.store._segments()
+            self.writer = _SegmentWriter(self.store, (segments or [0])[-1])
+        except BaseException:
+            self.store._write_lock.release()
+            raise
+        return self
+
+    def put(self, z, x, y, data, version=None):
+        """ Appends the tile at (z, x, y). version is the tile's millisecond
+        timestamp; a tile put again with the same version replaces it. """
+        key = (z, x, y, 0 if version is None else version)
+        self.tiles[key] = self.writer.append(data)
+
+    def set_watermark(self, z, timestamp):
+        """ Stages the timestamp zoom level z is synced up to. """
+        self.watermarks[z] = timestamp
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None:
+                self.writer.rollback()
+                return
+            self.writer.sync()
+            self.writer.close()
+            if not self.tiles and not self.watermarks:
+                return
+            index = self.store._index
+            entries = [(key, location)
+                       for key, location in zip(index.keys, index.locations)
+                       if key not in self.tiles]
+            entries.extend(self.tiles.items())
+            entries.sort()
+            watermarks = dict(index.watermarks)
+            watermarks.update(self.watermarks)
+            self.store._write_index(
+                _Index([key for key, _ in entries],
+                       [location for _, location in entries], watermarks))
+        finally:
+            self.store._write_lock.release()
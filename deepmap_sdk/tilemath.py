@@ -0,0 +1,124 @@
+""" Vectorized conversions between lat/lng coordinates and XYZ tiles.
+
+Tiles follow the web mercator XYZ scheme described in tiles.py: level z has
+2^z x 2^z tiles and tile (0, 0) is at the top left (north west) of the map.
+
+Every function takes scalars or NumPy arrays of any shape, which are
+broadcast together, so millions of points such as a GPS trace are converted
+in one call.
+"""
+
+import numpy as np
+
+# Latitude limit of the web mercator projection, in degrees.
+MAX_LATITUDE = 85.0511287798066
+
+# Offsets of the 8 neighbours of a tile, clockwise from the north west.
+_NEIGHBOR_DX = np.array([-1, 0, 1, 1, 1, 0, -1, -1])
+_NEIGHBOR_DY = np.array([-1, -1, -1, 0, 1, 1, 1, 0])
+
+
+def lat_lng_to_xy(lat, lng, z):
+    """ Returns the fractional tile coordinates (x, y) of lat/lngs at level z.
+    The integer part is the tile index, the fractional part the position
+    within the tile. Latitudes are clamped to the web mercator limits. """
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE,
+                  MAX_LATITUDE)
+    n = np.exp2(z)
+    x = (np.asarray(lng, dtype=np.float64) + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n
+    return x, y
+
+
+def lat_lng_to_tile(lat, lng, z):
+    """ Returns the integer (x, y) indices of the tiles containing lat/lngs
+    at level z. """
+    x, y = lat_lng_to_xy(lat, lng, z)
+    last = np.exp2(z) - 1
+    return (np.clip(np.floor(x), 0, last).astype(np.int64),
+            np.clip(np.floor(y), 0, last).astype(np.int64))
+
+
+def x_to_lng(x, z):
+    """ Returns the longitude of the west edge of tile column x at level z.
+    Fractional x are allowed. """
+    return np.asarray(x, dtype=np.float64) / np.exp2(z) * 360.0 - 180.0
+
+
+def y_to_lat(y, z):
+    """ Returns the latitude of the north edge of tile row y at level z.
+    Fractional y are allowed. """
+    y = np.asarray(y, dtype=np.float64)
+    return np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * y / np.exp2(z)))))
+
+
+def tile_bounds(x, y, z):
+    """ Returns the (lat1, lat2, lng1, lng2) bounds of tiles, south to north
+    and west to east. """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    return y_to_lat(y + 1, z), y_to_lat(y, z), x_to_lng(x, z), x_to_lng(
+        x + 1, z)
+
+
+def tile_center(x, y, z):
+    """ Returns the (lat, lng) centers of tiles. """
+    return y_to_lat(np.asarray(y) + 0.5, z), x_to_lng(np.asarray(x) + 0.5, z)
+
+
+def parent(x, y, z):
+    """ Returns the (x, y, z) of the tiles containing tiles at level z - 1. """
+    return np.asarray(x) >> 1, np.asarray(y) >> 1, z - 1
+
+
+def children(x, y, z):
+    """ Returns the (x, y, z) of the 4 tiles at level z + 1 covering tiles.
+    x and y have an extra trailing axis of length 4, ordered north west,
+    north east, south west, south east. """
+    x = np.asarray(x)[..., np.newaxis] << 1
+    y = np.asarray(y)[..., np.newaxis] << 1
+    return x + np.array([0, 1, 0, 1]), y + np.array([0, 0, 1, 1]), z + 1
+
+
+def neighbors(x, y, z):
+    """ Returns the (x, y, valid) of the 8 tiles around tiles at level z.
+
+    x, y and valid have an extra trailing axis of length 8, clockwise from
+    the north west neighbour. Columns wrap around the antimeridian, and
+    neighbours beyond the poles are marked False in valid.
+    """
+    n = 1 << z
+    x = (np.asarray(x)[..., np.newaxis] + _NEIGHBOR_DX) % n
+    y = np.asarray(y)[..., np.newaxis] + _NEIGHBOR_DY
+    valid = (y >= 0) & (y < n)
+    return x, y, valid
+
+
+def tile_to_quadkey(x, y, z):
+    """ Returns the quadkeys of tiles at level z, as an array of strings of
+    z base-4 digits. """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    if z == 0:
+        return np.full(np.broadcast(x, y).shape, '', dtype='U1')
+    shifts = np.arange(z - 1, -1, -1)
+    digits = (((x[..., np.newaxis] >> shifts) & 1) |
+              (((y[..., np.newaxis] >> shifts) & 1) << 1))
+    ascii_digits = np.ascontiguousarray(digits + ord('0'), dtype=np.uint8)
+    return ascii_digits.view('S{}'.format(z))[..., 0].astype('U{}'.format(z))
+
+
+def quadkey_to_tile(quadkeys):
+    """ Returns the (x, y, z) of tiles given an array of quadkeys of the same
+    level z. """
+    quadkeys = np.asarray(quadkeys, dtype=np.bytes_)
+    z = quadkeys.dtype.itemsize
+    if z == 0:
+        zeros = np.zeros(quadkeys.shape, dtype=np.int64)
+        return zeros, zeros.copy(), 0
+    digits = quadkeys[..., np.newaxis].view(np.uint8) - ord('0')
+    digits = digits.reshape(quadkeys.shape + (z,)).astype(np.int64)
+    weights = 1 << np.arange(z - 1, -1, -1)
+    x = ((digits & 1) * weights).sum(axis=-1)
+    y = (((digits >> 1) & 1) * weights).sum(axis=-1)
+    return x, y, z
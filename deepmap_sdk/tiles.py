@@ -37,9 +37,9 @@ def list_tiles_diff(map_id, server_url, z, map_format, before=None, after=None):
     query = {}
     query['format'] = map_format
     query['z'] = z
-    if before:
+    if before is not None:
         query['before'] = before
-    if after:
+    if after is not None:
         query['after'] = after
 
     url_sections = list(urllib.parse.urlparse(url))
@@ -77,9 +77,9 @@ def search_tiles(map_id, server_url, z, lat1, lat2, lng1, lng2, map_format, befo
     query['lat2'] = lat2
     query['lng1'] = lng1
     query['lng2'] = lng2
-    if before:
+    if before is not None:
         query['before'] = before
-    if after:
+    if after is not None:
         query['after'] = after
 
     url_sections = list(urllib.parse.urlparse(url))
@@ -117,9 +117,9 @@ def download_tile(map_id, server_url, z, x, y, map_format, before=None, after=No
     query['z'] = z
     query['x'] = x
     query['y'] = y
-    if before:
+    if before is not None:
         query['before'] = before
-    if after:
+    if after is not None:
         query['after'] = after
 
     url_sections = list(urllib.parse.urlparse(url))
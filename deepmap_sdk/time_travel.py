@@ -0,0 +1,245 @@
+""" Tile queries at past times, answered from a local version index. """
+
+import bisect
+import threading
+from deepmap_sdk import planner, sync
+
+_MAX_TIME = float('inf')
+
+
+class VersionNotFound(KeyError):
+    """ Raised when a tile has no version at or before a timestamp, such as
+    a tile first published later. The argument is the (z, x, y, timestamp)
+    queried. """
+
+
+class VersionIndex:
+    """ What is known locally of the version history of the tiles of one map
+    and format.
+
+    It is populated with the results of tiles diff queries, each giving the
+    latest version in a time range of the tiles of a level updated in that
+    range, with versions of single tiles known to be current at a time,
+    such as from searches, and with tiles known to have no version yet at a
+    time. Answers are exact: queries that can't be answered from what was
+    recorded raise KeyError. TimeTravel looks those up on the server.
+
+    Timestamps are integer milliseconds. The version None stands for the
+    original version of a tile, which diffs don't list.
+    """
+
+    def __init__(self):
+        # Level to the sorted list of (after, before, {(x, y): version}) of
+        # the recorded diffs.
+        self._diffs = {}
+        # (z, x, y) to the sorted list of (start, end, version) time ranges
+        # over which the tile is known to be at version.
+        self._spans = {}
+        # (z, x, y) to the latest time the tile is known to have no version
+        # at.
+        self._absent = {}
+        self._lock = threading.Lock()
+
+    def add_diff(self, z, diff, before, after=None):
+        """ Records a tiles diff.
+
+        Args:
+            diff: The list of (z, x, y, version) of the tiles updated at level
+                z between after and before, see sync.diff_tiles.
+            before: The upper bound of the diff query.
+            after: The lower bound of the diff query, None or 0 for a diff
+                since the beginning.
+        """
+        tiles = {(x, y): version for _, x, y, version in diff}
+        with self._lock:
+            diffs = self._diffs.setdefault(z, [])
+            diffs.append((after or 0, before, tiles))
+            diffs.sort(key=lambda diff: diff[:2])
+
+    def add_version(self, z, x, y, version, timestamp):
+        """ Records that the tile at (z, x, y) was at version at timestamp,
+        and so since version. """
+        start = -1 if version is None else version
+        with self._lock:
+            bisect.insort(self._spans.setdefault((z, x, y), []),
+                          (start, timestamp, version))
+
+    def add_absent(self, z, x, y, timestamp):
+        """ Records that the tile at (z, x, y) had no version yet at
+        timestamp. """
+        with self._lock:
+            self._absent[(z, x, y)] = max(
+                timestamp, self._absent.get((z, x, y), timestamp))
+
+    def _span_version(self, z, x, y, timestamp):
+        spans = self._spans.get((z, x, y), ())
+        for start, end, version in reversed(
+                spans[:bisect.bisect_right(spans, (timestamp, _MAX_TIME))]):
+            if timestamp <= end:
+                return True, version
+        return False, None
+
+    def version_at(self, z, x, y, timestamp):
+        """ Returns the version of the tile at (z, x, y) current at
+        timestamp, that is its latest version up to timestamp. Raises
+        VersionNotFound if the tile is known to have no version at
+        timestamp, or KeyError if its version isn't known locally. """
+        with self._lock:
+            if timestamp <= self._absent.get((z, x, y), -1):
+                raise VersionNotFound((z, x, y, timestamp))
+            diffs = self._diffs.get(z, ())
+            while timestamp >= 0:
+                known, version = self._span_version(z, x, y, timestamp)
+                if known:
+                    return version
+                earlier = None
+                for after, before, tiles in diffs:
+                    if after > timestamp:
+                        break
+                    if timestamp > before:
+                        continue
+                    if (x, y) not in tiles:
+                        # Not updated in the diff range, so still at its
+                        # version before it.
+                        earlier = after - 1
+                        break
+                    latest = tiles[(x, y)]
+                    if latest is not None and latest <= timestamp:
+                        return latest
+                if earlier is None:
+                    raise KeyError((z, x, y, timestamp))
+                timestamp = earlier
+            return None
+
+    def _chain(self, z, after, before):
+        """ Returns the recorded diffs chained from after up to before, and
+        the ranges missing from the chain. """
+        diffs = self._diffs.get(z, [])
+        chain = []
+        missing = []
+        cursor = after
+        while cursor < before:
+            starts = [
+                diff for diff in diffs if diff[0] == cursor and
+                cursor < diff[1] <= before
+            ]
+            if starts:
+                diff = max(starts, key=lambda diff: diff[1])
+                chain.append(diff)
+                cursor = diff[1]
+                continue
+            later = [diff[0] for diff in diffs if cursor < diff[0] < before]
+            end = min(later) if later else before
+            missing.append((cursor, end))
+            cursor = end
+        return chain, missing
+
+    def missing(self, z, after, before):
+        """ Returns the list of (after, before) diff ranges to record for
+        changes(z, after, before) to be answered locally. """
+        with self._lock:
+            return self._chain(z, after or 0, before)[1]
+
+    def changes(self, z, after, before):
+        """ Returns a dictionary of the tiles of level z updated between after
+        and before to their latest version in that range, as the tiles diff
+        query would. Raises KeyError if the range wasn't fully recorded. """
+        if (after or 0) >= before:
+            raise ValueError('Empty time range: {} to {}'.format(after, before))
+        with self._lock:
+            chain, missing = self._chain(z, after or 0, before)
+            if missing:
+                raise KeyError((z, ) + missing[0])
+            latest = {}
+            for _, _, tiles in chain:
+                for xy, version in tiles.items():
+                    if xy not in latest or (version or 0) > (latest[xy] or 0):
+                        latest[xy] = version
+            return {(z, ) + xy: version for xy, version in latest.items()}
+
+
+class TimeTravel:
+    """ Queries of the tiles of a map at past times, answered locally when
+    possible.
+
+    Versions of tiles and changes between two times are resolved with a
+    VersionIndex, and the network only queried for what it doesn't hold.
+    Tile contents are kept by version in an optional store, such as a
+    tile_store.TileStore.
+
+        history = TimeTravel(client, map_id, map_format, TileStore(path))
+        changed = history.changes(z, t1, t2)
+        tile = history.tile_at(z, x, y, t2)
+    """
+
+    def __init__(self, client, map_id, map_format, store=None, index=None):
+        """ Initializes the queries.
+
+        Args:
+            client: A DeepmapClient.
+            store: An optional store with get_version(z, x, y, version) and
+                transaction(), tile contents are kept in.
+            index: The VersionIndex to use, by default a new one.
+        """
+        self.client = client
+        self.map_id = map_id
+        self.map_format = map_format
+        self.store = store
+        self.index = index if index is not None else VersionIndex()
+
+    def version_at(self, z, x, y, timestamp):
+        """ Returns the version of the tile at (z, x, y) current at
+        timestamp, or None for its original version. Raises VersionNotFound
+        if the tile has no version at or before timestamp. """
+        try:
+            return self.index.version_at(z, x, y, timestamp)
+        except VersionNotFound:
+            raise
+        except KeyError:
+            pass
+        lat1, lat2, lng1, lng2 = planner.tile_bbox(z, x, y)
+        found = self.client.search_tiles(self.map_id, z, lat1, lat2, lng1,
+                                         lng2, self.map_format,
+                                         before=timestamp)
+        for tz, tx, ty, version in sync.diff_tiles(found):
+            self.index.add_version(tz, tx, ty, version, timestamp)
+        try:
+            return self.index.version_at(z, x, y, timestamp)
+        except KeyError:
+            self.index.add_absent(z, x, y, timestamp)
+            raise VersionNotFound((z, x, y, timestamp)) from None
+
+    def changes(self, z, after, before):
+        """ Returns a dictionary of the (z, x, y) tiles updated between after
+        and before to their latest version in that range. Only the parts of
+        the range not yet recorded are queried. """
+        for missing_after, missing_before in self.index.missing(
+                z, after, before):
+            diff = self.client.list_tiles_diff(self.map_id,
+                                               z,
+                                               self.map_format,
+                                               before=missing_before,
+                                               after=missing_after)
+            self.index.add_diff(z, sync.diff_tiles(diff), missing_before,
+                                missing_after)
+        return self.index.changes(z, after, before)
+
+    def tile_at(self, z, x, y, timestamp):
+        """ Returns the content of the tile at (z, x, y) as of timestamp,
+        from the store if it holds that version. Raises VersionNotFound if
+        the tile has no version at timestamp, or the download error. """
+        version = self.version_at(z, x, y, timestamp)
+        if self.store is not None and version is not None:
+            data = self.store.get_version(z, x, y, version)
+            if data is not None:
+                return data
+        _, result = next(
+            self.client.download_tiles(self.map_id, [(z, x, y)],
+                                       self.map_format,
+                                       before=timestamp))
+        if isinstance(result, Exception):
+            raise result
+        if self.store is not None and version is not None:
+            with self.store.transaction() as txn:
+                txn.put(z, x, y, result, version)
+        return result
@@ -0,0 +1,56 @@
+""" On-disk cache of a session token (JWT), reused across processes. """
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def _fingerprint(server_url, api_token):
+    """ Identifies the server and access token a session was created for,
+    without storing the access token. """
+    return hashlib.sha256('{}\n{}'.format(server_url,
+                                          api_token).encode()).hexdigest()
+
+
+def load_session(path, server_url, api_token, margin=0):
+    """ Returns the cached (token, expiration) of a session created with
+    api_token on server_url, or None if there is none valid for at least
+    margin more seconds. """
+    try:
+        with open(path) as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('fingerprint') != _fingerprint(
+            server_url, api_token):
+        return None
+    token = cached.get('token')
+    expiration = cached.get('expiration')
+    if (not isinstance(token, str) or isinstance(expiration, bool) or
+            not isinstance(expiration, (int, float))):
+        return None
+    if time.time() >= expiration - margin:
+        return None
+    return token, expiration
+
+
+def save_session(path, server_url, api_token, token, expiration):
+    """ Atomically writes a session to the cache at path, readable only by
+    the current user. """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, staged = tempfile.mkstemp(prefix='.session-', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w') as cache_file:
+            json.dump(
+                {
+                    'fingerprint': _fingerprint(server_url, api_token),
+                    'token': token,
+                    'expiration': expiration,
+                }, cache_file)
+        os.replace(staged, path)
+    except BaseException:
+        os.remove(staged)
+        raise
@@ -0,0 +1,161 @@
+""" HTTP transports the client sends its requests with.
+
+A transport has a mutable headers mapping sent with every request, a
+request(method, url, **kwargs) method with the arguments of
+requests.Session.request that returns a requests.Response like object, and
+close(). requests.Session, the default transport, is one. A transport whose
+responses aren't decoded by urllib3 also has content_encodings(), see
+decoding.transport_encodings.
+
+HTTP2Transport requires httpx with HTTP/2 support, installable with
+'pip install .[http2]'.
+"""
+
+import datetime
+import json
+import time
+from requests import HTTPError, Session, Timeout
+from requests import ConnectionError as RequestsConnectionError
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Connections per server of the HTTP/2 transport. Each connection
+# multiplexes many concurrent requests.
+DEFAULT_HTTP2_CONNECTIONS = 4
+# Seconds to wait for the server, when the request sets no timeout.
+DEFAULT_TIMEOUT = 60.0
+
+
+def requests_transport(pool_maxsize):
+    """ Returns a requests.Session pooling up to pool_maxsize HTTP/1.1
+    connections per server. """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                          pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class HTTP2Response:
+    """ An httpx response with the interface of a requests.Response used by
+    the client. """
+
+    def __init__(self, response, elapsed):
+        self.raw = response
+        self.status_code = response.status_code
+        self.reason = response.reason_phrase
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.elapsed = elapsed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def content(self):
+        return self.raw.read()
+
+    @property
+    def text(self):
+        self.raw.read()
+        return self.raw.text
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+    def iter_content(self, chunk_size=1):
+        """ Returns an iterator over the decoded body in chunks. """
+        return self.raw.iter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        """ Raises a requests.HTTPError for 4xx and 5xx statuses. """
+        if self.status_code >= 400:
+            message = '{} Error: {} for url: {}'.format(
+                self.status_code, self.reason, self.url)
+            raise HTTPError(message, response=self)
+
+    def close(self):
+        self.raw.close()
+
+
+class HTTP2Transport:
+    """ Sends requests over HTTP/2, multiplexing concurrent requests over a
+    few connections per server.
+
+    Args:
+        max_connections: Connections per server.
+        http1: Whether to fall back to HTTP/1.1 for servers that don't
+            negotiate HTTP/2. Must be False for plain text http:// servers,
+            which are then assumed to speak HTTP/2 without negotiation.
+        timeout: Seconds to wait for the server, when the request sets no
+            timeout.
+    """
+
+    def __init__(self,
+                 max_connections=DEFAULT_HTTP2_CONNECTIONS,
+                 http1=True,
+                 timeout=DEFAULT_TIMEOUT):
+        import httpx
+        self._httpx = httpx
+        self.headers = CaseInsensitiveDict()
+        self.timeout = timeout
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        self.client = httpx.Client(http1=http1, http2=True, limits=limits)
+
+    def request(self,
+                method,
+                url,
+                params=None,
+                data=None,
+                headers=None,
+                timeout=None,
+                allow_redirects=True,
+                stream=False):
+        """ Sends a request and returns an HTTP2Response. Raises the requests
+        ConnectionError or Timeout exceptions on failure. """
+        httpx = self._httpx
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        if isinstance(data, str):
+            data = data.encode()
+        started = time.perf_counter()
+        try:
+            request = self.client.build_request(
+                method,
+                url,
+                params=params,
+                content=data,
+                headers=request_headers,
+                timeout=timeout if timeout is not None else self.timeout)
+            response = self.client.send(request,
+                                        stream=stream,
+                                        follow_redirects=allow_redirects)
+        except httpx.TimeoutException as error:
+            raise Timeout(error)
+        except httpx.TransportError as error:
+            raise RequestsConnectionError(error)
+        # httpx only measures the elapsed time of closed responses.
+        elapsed = datetime.timedelta(seconds=time.perf_counter() - started)
+        return HTTP2Response(response, elapsed)
+
+    def content_encodings(self):
+        """ Returns the content codings httpx decodes, which depend on the
+        brotli and zstandard packages installed. """
+        from httpx import _decoders
+        decoders = getattr(_decoders, 'SUPPORTED_DECODERS',
+                           ('gzip', 'deflate'))
+        return [encoding for encoding in decoders if encoding != 'identity']
+
+    def close(self):
+        """ Closes the connections. """
+        self.client.close()
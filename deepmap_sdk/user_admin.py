@@ -0,0 +1,157 @@
+""" User administration in bulk, with a result per user. """
+
+import collections
+import json
+from concurrent.futures import ThreadPoolExecutor
+from deepmap_sdk import users
+
+UserResult = collections.namedtuple('UserResult', ['item', 'user', 'error'])
+UserResult.__doc__ = """ The outcome of one operation of a bulk operation.
+
+    item: The invite, edit or user id the operation was given.
+    user: The decoded response of a successful operation, or None.
+    error: The exception that failed the operation, or None.
+"""
+
+
+class UserAdminError(Exception):
+    """ Raised when the server rejects an operation on a user. The arguments
+    are the status code and the decoded error response. """
+
+    @property
+    def status_code(self):
+        return self.args[0]
+
+
+class BulkReport:
+    """ The results of a bulk operation, in the order of its items.
+
+    Attributes:
+        results: List of UserResult.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def succeeded(self):
+        """ The results of the successful operations. """
+        return [result for result in self.results if result.error is None]
+
+    @property
+    def failed(self):
+        """ The results of the failed operations. """
+        return [result for result in self.results if result.error is not None]
+
+    def summary(self):
+        """ Returns a dictionary of the number of operations, successes and
+        failures, and of the failure messages by item. """
+        failed = self.failed
+        return {
+            'total': len(self.results),
+            'succeeded': len(self.results) - len(failed),
+            'failed': len(failed),
+            'errors': {
+                str(result.item): repr(result.error) for result in failed
+            },
+        }
+
+    def raise_for_errors(self):
+        """ Raises the error of the first failed operation, if any. """
+        for result in self.results:
+            if result.error is not None:
+                raise result.error
+
+
+def _run(request, operations, items, max_workers):
+    """ Sends the (method, url, payload) operation of each item through
+    request concurrently, and returns a BulkReport. """
+
+    def call(operation):
+        method, url, payload = operation
+        data = None if payload is None else json.dumps(payload)
+        response = request(method, url, data=data)
+        try:
+            decoded = response.json()
+        except ValueError:
+            decoded = None
+        if not response.ok:
+            raise UserAdminError(response.status_code, decoded)
+        return decoded
+
+    def attempt(item_operation):
+        item, operation = item_operation
+        try:
+            return UserResult(item, call(operation), None)
+        except Exception as error:  # pylint: disable=broad-except
+            return UserResult(item, None, error)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return BulkReport(list(executor.map(attempt, zip(items, operations))))
+
+
+def invite_users(request, server_url, invites, max_workers):
+    """ Invites users concurrently. Returns a BulkReport whose users are the
+    invited users.
+
+    Failed invites aren't retried by the client, as they may have been
+    processed. Check the failures with list_users before inviting again.
+
+    Args:
+        request: A function sending a request, such as
+            DeepmapClient._request.
+        server_url: String of base URL of the API.
+        invites: Iterable of emails, or of (email, admin) pairs, where admin
+            is 'True' for admins.
+        max_workers: Number of concurrent requests.
+    """
+    invites = list(invites)
+    operations = []
+    for invite in invites:
+        email, admin = (invite, '') if isinstance(invite, str) else invite
+        url, payload = users.invite_user(email, admin, server_url)
+        operations.append(('POST', url, payload))
+    return _run(request, operations, invites, max_workers)
+
+
+def edit_users(request, server_url, edits, max_workers):
+    """ Edits users concurrently. Returns a BulkReport whose users are the
+    edited users. Raises ValueError before sending anything if an edit
+    changes nothing.
+
+    Args:
+        request: A function sending a request, such as
+            DeepmapClient._request.
+        server_url: String of base URL of the API.
+        edits: Iterable of (user_id, email, admin) tuples, see
+            users.edit_user.
+        max_workers: Number of concurrent requests.
+    """
+    edits = list(edits)
+    operations = []
+    for user_id, email, admin in edits:
+        url, payload = users.edit_user(user_id, email, admin, server_url)
+        operations.append(('POST', url, payload))
+    return _run(request, operations, edits, max_workers)
+
+
+def delete_users(request, server_url, user_ids, max_workers):
+    """ Deletes users concurrently. Returns a BulkReport.
+
+    Args:
+        request: A function sending a request, such as
+            DeepmapClient._request.
+        server_url: String of base URL of the API.
+        user_ids: Iterable of user ids.
+        max_workers: Number of concurrent requests.
+    """
+    user_ids = list(user_ids)
+    operations = [('DELETE', users.delete_user(user_id, server_url), None)
+                  for user_id in user_ids]
+    return _run(request, operations, user_ids, max_workers)
@@ -1,7 +1,6 @@
 """ Create requests params for users API. """
 
 import urllib.parse
-import sys
 
 
 def list_users(server_url):
@@ -52,13 +51,16 @@ def edit_user(user_id, email, admin, server_url):
         admin: String of 'True' or 'False' represnting new admin status,
                or empty string if no change.
         server_url: String of base URL of the API.
+
+    Raises:
+        ValueError: If neither email nor admin change.
     """
 
     url = urllib.parse.urljoin(server_url,
                                '/api/users/v1/users/{}'.format(user_id))
 
     if not email and not admin:
-        sys.exit('Nothing to be changed.')
+        raise ValueError('Nothing to be changed.')
     else:
         payload = {}
         if email:
@@ -0,0 +1,266 @@
+""" Session tokens of a fleet of vehicles, created and renewed in bulk. """
+
+import collections
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import jwt
+from deepmap_sdk import singleflight
+
+# Seconds before expiration at which a vehicle session token is renewed.
+DEFAULT_REFRESH_MARGIN = 300
+# Seconds before retrying to renew a session that failed to renew.
+DEFAULT_RETRY_DELAY = 10
+
+VehicleSession = collections.namedtuple('VehicleSession',
+                                        ['vehicle_id', 'token', 'expiration'])
+VehicleSession.__doc__ = """ A session token (JWT) of a vehicle.
+
+    vehicle_id: Id of the vehicle.
+    token: The session token.
+    expiration: Unix time at which the token expires.
+"""
+
+
+class SessionError(Exception):
+    """ Raised when the server refuses to create a vehicle token or session.
+    The first argument is the decoded error response. """
+
+
+class VehicleSessionPool:
+    """ Caches the session tokens of many vehicles and renews them ahead of
+    their expiration.
+
+    Vehicle access tokens are either created with create_tokens, or added
+    with add_vehicle. get returns a valid session token with a dictionary
+    lookup. Sessions are renewed in expiration order by refresh_due, called
+    periodically, or by a background thread between start and stop:
+
+        with VehicleSessionPool(client) as pool:
+            pool.create_tokens(vehicle_ids)
+            pool.create_sessions()
+            ...
+            headers = pool.headers(vehicle_id)
+
+    Safe to share between threads.
+    """
+
+    def __init__(self,
+                 client,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 retry_delay=DEFAULT_RETRY_DELAY,
+                 max_workers=None):
+        """ Initializes the pool.
+
+        Args:
+            client: A DeepmapClient logged in as an admin, used to create
+                vehicle tokens and sessions.
+            refresh_margin: Seconds before expiration at which a session
+                token is renewed.
+            retry_delay: Seconds before retrying to renew a session that
+                failed to renew.
+            max_workers: Number of concurrent requests of the bulk
+                operations. Defaults to the size of the client's connection
+                pool.
+        """
+        self.client = client
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.max_workers = max_workers or client.pool_maxsize
+        self._vehicle_tokens = {}
+        self._sessions = {}
+        # Heap of (refresh time, vehicle id, token). Entries whose token was
+        # since replaced are skipped when popped.
+        self._schedule = []
+        self._lock = threading.Lock()
+        # Concurrent renewals of the session of a vehicle share one request.
+        self._renewals = singleflight.SingleFlight()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def __len__(self):
+        return len(self._vehicle_tokens)
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._vehicle_tokens
+
+    def _map(self, function, vehicle_ids):
+        """ Calls function on every vehicle id concurrently. Returns a
+        dictionary of the exceptions raised, by vehicle id. """
+
+        def call(vehicle_id):
+            try:
+                function(vehicle_id)
+            except Exception as error:  # pylint: disable=broad-except
+                return vehicle_id, error
+            return vehicle_id, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return {
+                vehicle_id: error
+                for vehicle_id, error in executor.map(call, vehicle_ids)
+                if error is not None
+            }
+
+    def add_vehicle(self, vehicle_id, vehicle_token):
+        """ Adds a vehicle with an existing vehicle access token. """
+        with self._lock:
+            self._vehicle_tokens[vehicle_id] = vehicle_token
+
+    def remove_vehicle(self, vehicle_id):
+        """ Forgets a vehicle and its session. """
+        with self._lock:
+            self._vehicle_tokens.pop(vehicle_id, None)
+            self._sessions.pop(vehicle_id, None)
+
+    def _create_token(self, vehicle_id, description):
+        response = self.client.create_vehicle_token(vehicle_id, description)
+        if 'vehicle_token' not in response:
+            raise SessionError(response)
+        self.add_vehicle(vehicle_id, response['vehicle_token'])
+
+    def create_tokens(self, vehicle_ids, description=''):
+        """ Creates a vehicle access token for every vehicle concurrently and
+        adds the vehicles to the pool. Returns a dictionary of the exceptions
+        raised, by vehicle id, for the vehicles that failed.
+
+        Args:
+            vehicle_ids: Iterable of unique identifiers of the vehicles.
+            description: Description of the created tokens.
+        """
+        return self._map(
+            lambda vehicle_id: self._create_token(vehicle_id, description),
+            vehicle_ids)
+
+    def _renew(self, vehicle_id, stale_token=None):
+        """ Creates a session for vehicle_id and returns it, unless another
+        thread already replaced stale_token, in which case the current
+        session is returned. Callers renewing the same vehicle at the same
+        time wait for a single renewal. """
+        return self._renewals.do(vehicle_id, self._create_session, vehicle_id,
+                                 stale_token)
+
+    def _create_session(self, vehicle_id, stale_token):
+        with self._lock:
+            current = self._sessions.get(vehicle_id)
+            if current is not None and current.token != stale_token:
+                return current
+        response = self.client.create_vehicle_session(
+            self._vehicle_tokens[vehicle_id])
+        if 'token' not in response:
+            raise SessionError(response)
+        token = response['token']
+        decoded_token = jwt.decode(token, algorithms=["ES256"], verify=False)
+        session = VehicleSession(vehicle_id, token, decoded_token['exp'])
+        with self._lock:
+            current = self._sessions.get(vehicle_id)
+            if current is not None and current.token != stale_token:
+                return current
+            if vehicle_id not in self._vehicle_tokens:
+                return session
+            self._sessions[vehicle_id] = session
+            refresh_at = session.expiration - self.refresh_margin
+            wake = not self._schedule or refresh_at < self._schedule[0][0]
+            heapq.heappush(self._schedule, (refresh_at, vehicle_id, token))
+        if wake:
+            self._wakeup.set()
+        return session
+
+    def create_sessions(self, vehicle_ids=None):
+        """ Creates a session for every vehicle concurrently. Returns a
+        dictionary of the exceptions raised, by vehicle id, for the vehicles
+        that failed.
+
+        Args:
+            vehicle_ids: Iterable of vehicle ids. Defaults to every vehicle
+                without a session.
+        """
+        if vehicle_ids is None:
+            with self._lock:
+                vehicle_ids = [
+                    vehicle_id for vehicle_id in self._vehicle_tokens
+                    if vehicle_id not in self._sessions
+                ]
+        return self._map(self._renew, vehicle_ids)
+
+    def get_session(self, vehicle_id):
+        """ Returns a VehicleSession valid for at least refresh_margin
+        seconds, renewing it first if needed. Raises KeyError if the vehicle
+        isn't in the pool, or SessionError if the session can't be
+        renewed. """
+        session = self._sessions.get(vehicle_id)
+        if session is None:
+            return self._renew(vehicle_id)
+        if time.time() >= session.expiration - self.refresh_margin:
+            return self._renew(vehicle_id, session.token)
+        return session
+
+    def get(self, vehicle_id):
+        """ Returns a valid session token of the vehicle, see get_session. """
+        return self.get_session(vehicle_id).token
+
+    def headers(self, vehicle_id):
+        """ Returns the headers of a request authenticated as the vehicle. """
+        return {'Authorization': 'Bearer ' + self.get(vehicle_id)}
+
+    def next_refresh(self):
+        """ Returns the seconds until the next session is due for renewal,
+        or None if there are no sessions. """
+        with self._lock:
+            if not self._schedule:
+                return None
+            return max(self._schedule[0][0] - time.time(), 0)
+
+    def refresh_due(self, now=None):
+        """ Renews concurrently the sessions due for renewal at time now,
+        which defaults to the current time. Sessions that fail to renew are
+        retried after retry_delay. Returns a dictionary of the exceptions
+        raised, by vehicle id. """
+        if now is None:
+            now = time.time()
+        due = {}
+        with self._lock:
+            while self._schedule and self._schedule[0][0] <= now:
+                _, vehicle_id, token = heapq.heappop(self._schedule)
+                session = self._sessions.get(vehicle_id)
+                if session is not None and session.token == token:
+                    due[vehicle_id] = token
+        errors = self._map(
+            lambda vehicle_id: self._renew(vehicle_id, due[vehicle_id]), due)
+        if errors:
+            with self._lock:
+                for vehicle_id in errors:
+                    heapq.heappush(
+                        self._schedule,
+                        (now + self.retry_delay, vehicle_id, due[vehicle_id]))
+        return errors
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            self.refresh_due()
+            self._wakeup.wait(self.next_refresh())
+
+    def start(self):
+        """ Starts renewing sessions in a background thread. """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ Stops the background thread. """
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None